@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#
+# Time a full DANL sweep with no hardware attached. controller_cc tunes
+# sim_tuner_source_c through its "command" message port, and the rest of
+# the flowgraph is the same as usrp_danl.DANLTest.
+#
+# Usage: ./benchmark_danl_sweep.py [--nsegments N] [--fft-len N] [--naverages N]
+#                                  [--tune-latency N] [--nskip-tune N]
+#
+
+from __future__ import division, print_function
+
+import argparse
+import time
+
+import numpy as np
+
+import gnuradio.fft
+from gnuradio import blocks
+from gnuradio import gr
+
+import usrpcalibrator
+
+
+class SimulatedDANL(gr.top_block):
+    def __init__(self, args):
+        gr.top_block.__init__(self)
+
+        overlap = 0.25
+        nvalid_bins = int(args.fft_len * (1 - overlap)) // 2 * 2
+        center_freqs = 1e9 + 10e6 * np.arange(args.nsegments)
+        ncopy = args.fft_len * args.naverages
+        window = gnuradio.fft.window.flattop(args.fft_len)
+
+        src = usrpcalibrator.sim_tuner_source_c(args.tune_latency)
+        self.ctrl = usrpcalibrator.controller_cc(center_freqs.tolist(),
+                                                 0,
+                                                 0,
+                                                 args.nskip_tune,
+                                                 ncopy)
+        self.ctrl.set_exit_after_complete(True)
+        psd = usrpcalibrator.psd_estimator_cf(args.fft_len,
+                                              args.naverages,
+                                              window)
+        stitch = usrpcalibrator.stitch_fft_segments_ff(args.fft_len,
+                                                       args.nsegments,
+                                                       overlap,
+                                                       nvalid_bins,
+                                                       True)
+        self.sink = blocks.vector_sink_f(args.nsegments * nvalid_bins)
+
+        self.msg_connect(self.ctrl, "command", src, "command")
+        self.connect(src, self.ctrl, psd, stitch, self.sink)
+
+
+def main(args):
+    tb = SimulatedDANL(args)
+
+    nsamples = args.nsegments * (args.tune_latency + args.nskip_tune +
+                                 args.fft_len * args.naverages)
+    print("{} segments, fft_len {}, naverages {}".format(args.nsegments,
+                                                         args.fft_len,
+                                                         args.naverages))
+    print("tune latency {} samples, tune skip {} samples".format(args.tune_latency,
+                                                                 args.nskip_tune))
+
+    start_time = time.time()
+    tb.run()
+    elapsed = time.time() - start_time
+
+    assert len(tb.sink.data()) > 0
+    print("sweep took {:.3f} s, {:.1f} segments/s, >= {:.2f} MS/s".format(
+        elapsed, args.nsegments / elapsed, nsamples / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nsegments', type=int, default=100)
+    parser.add_argument('--fft-len', type=int, default=4096)
+    parser.add_argument('--naverages', type=int, default=100)
+    parser.add_argument('--tune-latency', type=int, default=10000)
+    parser.add_argument('--nskip-tune', type=int, default=50000)
+    args = parser.parse_args()
+
+    main(args)
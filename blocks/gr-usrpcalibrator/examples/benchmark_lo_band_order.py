@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+# Compare sweeping in schedule order with controller_cc's LO band order.
+# sim_tuner_source_c adds a relock latency to every tune that crosses an LO
+# band edge, so the samples spent waiting for rx_freq tags show the time
+# saved by crossing fewer edges. The default edges are the AD9361 (B2xx)
+# RX LO divider boundaries.
+#
+# Usage: ./benchmark_lo_band_order.py [--start F] [--stop F] [--step F]
+#                                     [--nspans N] [--shuffle]
+#                                     [--tune-latency N] [--crossing-latency N]
+#                                     [--samp-rate F]
+#
+
+from __future__ import division, print_function
+
+import argparse
+import random
+
+import numpy as np
+
+from gnuradio import blocks
+from gnuradio import gr
+
+import usrpcalibrator
+
+
+AD9361_DIVIDER_EDGES = [93.75e6, 187.5e6, 375e6, 750e6, 1.5e9, 3e9]
+
+
+class SimulatedSweep(gr.top_block):
+    def __init__(self, args, center_freqs, lo_band_order):
+        gr.top_block.__init__(self)
+
+        self.src = usrpcalibrator.sim_tuner_source_c(args.tune_latency)
+        self.src.set_lo_band_edges(AD9361_DIVIDER_EDGES, args.crossing_latency)
+        self.ctrl = usrpcalibrator.controller_cc(center_freqs,
+                                                 0,
+                                                 0,
+                                                 args.nskip_tune,
+                                                 args.ncopy)
+        self.ctrl.set_exit_after_complete(True)
+        if lo_band_order:
+            self.ctrl.set_lo_band_order(AD9361_DIVIDER_EDGES)
+
+        self.msg_connect(self.ctrl, "command", self.src, "command")
+        self.connect(self.src, self.ctrl, blocks.null_sink(gr.sizeof_gr_complex))
+
+
+def run_sweep(args, center_freqs, lo_band_order):
+    tb = SimulatedSweep(args, center_freqs, lo_band_order)
+    for _ in range(args.nspans):
+        tb.run()
+
+    # Every sample the controller read but didn't copy was spent tuning
+    nread = tb.ctrl.nitems_read(0)
+    nwaited = nread - tb.ctrl.nitems_written(0)
+    return nread, nwaited, tb.src.nband_crossings()
+
+
+def main(args):
+    center_freqs = np.arange(args.start, args.stop, args.step).tolist()
+    if args.shuffle:
+        random.seed(0)
+        random.shuffle(center_freqs)
+
+    print("{} segments, {} spans, {} order".format(
+        len(center_freqs), args.nspans,
+        "shuffled" if args.shuffle else "ascending"))
+
+    fmt = "{:<16} {:>10} {:>14} {:>14}"
+    print(fmt.format("order", "crossings", "sweep (s)", "tuning (s)"))
+
+    results = {}
+    for name, lo_band_order in (("schedule", False), ("LO band", True)):
+        nread, nwaited, ncrossings = run_sweep(args, center_freqs, lo_band_order)
+        results[name] = nread / args.samp_rate
+        print(fmt.format(name,
+                         ncrossings,
+                         "{:.3f}".format(nread / args.samp_rate),
+                         "{:.3f}".format(nwaited / args.samp_rate)))
+
+    saved = results["schedule"] - results["LO band"]
+    print("LO band order saved {:.3f} s ({:.1f}%) at {:.1f} MS/s".format(
+        saved, 100 * saved / results["schedule"], args.samp_rate / 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--start', type=float, default=70e6)
+    parser.add_argument('--stop', type=float, default=6e9)
+    parser.add_argument('--step', type=float, default=50e6)
+    parser.add_argument('--nspans', type=int, default=4)
+    parser.add_argument('--shuffle', action='store_true',
+                        help="sweep the segments in a random schedule order")
+    parser.add_argument('--ncopy', type=int, default=4096 * 10)
+    parser.add_argument('--nskip-tune', type=int, default=10000)
+    parser.add_argument('--tune-latency', type=int, default=5000)
+    parser.add_argument('--crossing-latency', type=int, default=100000)
+    parser.add_argument('--samp-rate', type=float, default=10e6,
+                        help="sample rate used to convert samples to seconds")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# Compare throughput of psd_estimator_cf against the block chain it replaces
+# in usrp_danl.DANLTest.
+#
+# Usage: ./benchmark_psd_estimator.py [--fft-len N] [--naverages N] [--nsamples N]
+#
+
+from __future__ import division, print_function
+
+import argparse
+import math
+import time
+
+import numpy as np
+
+import gnuradio.fft
+from gnuradio import blocks
+from gnuradio import gr
+
+import usrpcalibrator
+
+
+# Sample rates the DANL sweep needs to keep up with
+TARGET_RATES = (10e6, 56e6)
+
+
+class ChainPSD(gr.top_block):
+    """The original 6-block power spectrum chain"""
+    def __init__(self, src_data, nsamples, fft_len, naverages, window):
+        gr.top_block.__init__(self)
+
+        src = blocks.vector_source_c(src_data, repeat=True)
+        head = blocks.head(gr.sizeof_gr_complex, nsamples)
+        s2v = blocks.stream_to_vector(gr.sizeof_gr_complex, fft_len)
+        scale = blocks.multiply_const_cc(0.0028, fft_len)
+        fft = gnuradio.fft.fft_vcc(fft_len, True, window, True)
+        c2mag_sq = blocks.complex_to_mag_squared(fft_len)
+        stats = usrpcalibrator.bin_statistics_ff(fft_len, naverages)
+        window_pwr = fft_len * sum(tap*tap for tap in window)
+        power_scalar = -10.0 * math.log10(window_pwr * 50)
+        W2dBm = blocks.nlog10_ff(10.0, fft_len, 30 + power_scalar)
+        sink = blocks.null_sink(gr.sizeof_float * fft_len)
+
+        self.connect(src, head, s2v, scale, fft, c2mag_sq, stats, W2dBm, sink)
+
+
+class FusedPSD(gr.top_block):
+    """psd_estimator_cf"""
+    def __init__(self, src_data, nsamples, fft_len, naverages, window):
+        gr.top_block.__init__(self)
+
+        src = blocks.vector_source_c(src_data, repeat=True)
+        head = blocks.head(gr.sizeof_gr_complex, nsamples)
+        psd = usrpcalibrator.psd_estimator_cf(fft_len, naverages, window, 0.0028)
+        sink = blocks.null_sink(gr.sizeof_float * fft_len)
+
+        self.connect(src, head, psd, sink)
+
+
+def benchmark(tb_class, args, src_data, window):
+    tb = tb_class(src_data, args.nsamples, args.fft_len, args.naverages, window)
+    start_time = time.time()
+    tb.run()
+    elapsed = time.time() - start_time
+    return args.nsamples / elapsed
+
+
+def main(args):
+    # Use a whole number of averages so both graphs do the same work
+    nsamples_each_avg = args.fft_len * args.naverages
+    args.nsamples = max(1, args.nsamples // nsamples_each_avg) * nsamples_each_avg
+
+    nsrc = args.fft_len * 64
+    src_data = (np.random.randn(nsrc) + 1j*np.random.randn(nsrc)).tolist()
+    window = gnuradio.fft.window.flattop(args.fft_len)
+
+    print("fft_len {}, naverages {}, {} samples".format(args.fft_len,
+                                                        args.naverages,
+                                                        args.nsamples))
+
+    results = []
+    for name, tb_class in (("chain", ChainPSD), ("psd_estimator_cf", FusedPSD)):
+        rate = benchmark(tb_class, args, src_data, window)
+        results.append(rate)
+        keeps_up = ", ".join("{} {:.0f} MS/s".format("keeps up with" if rate >= r
+                                                     else "too slow for",
+                                                     r / 1e6)
+                             for r in TARGET_RATES)
+        print("{:>18}: {:7.2f} MS/s ({})".format(name, rate / 1e6, keeps_up))
+
+    print("speedup: {:.2f}x".format(results[1] / results[0]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fft-len', type=int, default=4096)
+    parser.add_argument('--naverages', type=int, default=100)
+    parser.add_argument('--nsamples', type=int, default=int(200e6))
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#
+# Measure stitch_fft_segments_ff throughput with octave-sized vectors, with
+# and without averaging of overlapping bins.
+#
+# Usage: ./benchmark_stitch_fft_segments.py [--fft-len N] [--nsegments N] [--nsweeps N]
+#
+
+from __future__ import division, print_function
+
+import argparse
+import time
+
+import numpy as np
+
+from gnuradio import blocks
+from gnuradio import gr
+
+import usrpcalibrator
+
+
+class StitchBenchmark(gr.top_block):
+    def __init__(self, args, average_overlap):
+        gr.top_block.__init__(self)
+
+        nvalid_bins = int(args.fft_len * (1 - args.overlap)) // 2 * 2
+        vlen = args.fft_len * args.nsegments
+
+        src_data = np.random.randn(vlen).tolist()
+        src = blocks.vector_source_f(src_data, repeat=True, vlen=vlen)
+        head = blocks.head(gr.sizeof_float * vlen, args.nsweeps)
+        stitch = usrpcalibrator.stitch_fft_segments_ff(args.fft_len,
+                                                       args.nsegments,
+                                                       args.overlap,
+                                                       nvalid_bins)
+        stitch.set_average_overlap(average_overlap)
+        sink = blocks.null_sink(gr.sizeof_float * args.nsegments * nvalid_bins)
+
+        self.connect(src, head, stitch, sink)
+
+
+def main(args):
+    vlen = args.fft_len * args.nsegments
+    print("{} segments of {} bins ({:.1f} MB per sweep), {} sweeps".format(
+        args.nsegments, args.fft_len, vlen * 4 / 1e6, args.nsweeps))
+
+    for average_overlap in (False, True):
+        tb = StitchBenchmark(args, average_overlap)
+        start_time = time.time()
+        tb.run()
+        elapsed = time.time() - start_time
+
+        mode = "averaging overlap" if average_overlap else "discarding overlap"
+        print("{:>18}: {:8.1f} sweeps/s, {:7.1f} MB/s in".format(
+            mode, args.nsweeps / elapsed, args.nsweeps * vlen * 4 / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fft-len', type=int, default=4096)
+    # A 3840-6020 MHz octave at 10 MS/s with 25% overlap
+    parser.add_argument('--nsegments', type=int, default=291)
+    parser.add_argument('--overlap', type=float, default=0.25)
+    parser.add_argument('--nsweeps', type=int, default=200)
+    args = parser.parse_args()
+
+    main(args)
@@ -25,17 +25,33 @@
 #include <cstdlib> /* size_t */
 
 #include <usrpcalibrator/api.h>
-#include <gnuradio/sync_decimator.h>
+#include <gnuradio/block.h>
 
 namespace gr {
   namespace usrpcalibrator {
 
     /*!
-     * \brief <+description of block+>
+     * \brief Per-bin statistics over every meas_interval input vectors
      * \ingroup usrpcalibrator
      *
+     * Output 0 is the mean of each bin. The optional outputs are, in
+     * order, the maximum (max-hold), the minimum (min-hold) and the
+     * variance of each bin over the same vectors. Only the statistics of
+     * connected outputs are computed, all in a single pass over the input.
+     *
+     * With a nonzero alpha, output 0 is instead an exponential moving
+     * average, avg += alpha * (x - avg), updated by every input vector and
+     * carried across measurement intervals. It is still output once per
+     * meas_interval vectors, so a long-running monitor gets a smoothed
+     * spectrum at a bounded rate without restarting the average.
+     *
+     * A "segment_start" tag (see controller_cc) always begins a new
+     * measurement interval. Input vectors of an interval interrupted by
+     * one are dropped instead of being mixed with the next segment, and
+     * the exponential average restarts at each tagged vector. Tags on the
+     * input vectors of an interval are moved to its output item.
      */
-    class USRPCALIBRATOR_API bin_statistics_ff : virtual public gr::sync_decimator
+    class USRPCALIBRATOR_API bin_statistics_ff : virtual public gr::block
     {
      public:
       typedef boost::shared_ptr<bin_statistics_ff> sptr;
@@ -48,7 +64,16 @@ namespace gr {
        * class. usrpcalibrator::bin_statistics_ff::make is the public interface for
        * creating new instances.
        */
-      static sptr make(size_t vlen, size_t meas_period);
+      static sptr make(size_t vlen, size_t meas_period, float alpha=0.0);
+
+      /*!
+       * \brief Set the exponential averaging weight (0 for block mean).
+       *
+       * A new exponential average starts from the next input vector.
+       * Throws std::invalid_argument unless 0 <= alpha <= 1.
+       */
+      virtual void set_alpha(float alpha) = 0;
+      virtual float alpha() const = 0;
     };
 
   } // namespace usrpcalibrator
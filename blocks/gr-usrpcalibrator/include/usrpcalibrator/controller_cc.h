@@ -35,6 +35,54 @@ namespace gr {
      * \brief Control sweeping a URSP
      * \ingroup usrpcalibrator
      *
+     * The first sample copied for each segment is tagged "segment_start".
+     * The tag's value is a dict whose "index" key holds the segment's
+     * 0-based position in center_freqs, whose "nskip" key holds the
+     * number of samples actually skipped after the rx_freq tag and whose
+     * "ncopy" key holds the number of samples copied for the segment.
+     * The dict also holds the number of schedules completed before this
+     * one ("span"), the requested center frequency ("freq"), the
+     * rx_freq tag's value ("rx_freq"), the tune result's "rf_freq" and
+     * "dsp_freq" when tuning a usrp_source directly, whether the segment
+     * was tuned with integer-N ("integer_n"), the scheduled "gain" if
+     * set_schedule sets gains and, once an rx_time
+     * tag and the sample rate are known, the device time of the tagged
+     * sample ("rx_time", a (full secs, frac secs) tuple like UHD's).
+     * Downstream blocks resynchronise on these tags rather than relying
+     * on counting samples.
+     *
+     * By default every segment uses the same nskip_tune, ncopy and
+     * lo_offset. set_schedule gives each segment its own skip count, copy
+     * count, gain and LO offset, so a single run can sweep bands that need
+     * different settings.
+     *
+     * The block either tunes the usrp_source it is made with directly, or,
+     * if made without one, publishes each tune request on its "command"
+     * message port as a dict with keys "freq" and "lo_offset" (plus "args"
+     * when integer-N tuning is requested). That port can be connected to a
+     * usrp_source's "command" port, or to a sim_tuner_source_c to run a
+     * sweep without hardware. In both cases, copying starts after an
+     * "rx_freq" tag within tag_freq_tolerance Hz of the requested frequency.
+     *
+     * A message on the "freqs" input port replaces the center frequencies
+     * while the flowgraph runs. It may be a vector or list of frequencies,
+     * or a single frequency to hop to. The new span replaces the whole
+     * schedule (with the block's default skip, copy count and LO offset)
+     * and starts at the next segment boundary, without the initial sample
+     * delay. Each completed segment is reported on the "segment" output
+     * port as its segment_start dict plus the stream "offset" of its first
+     * output sample, so a zooming or monitoring application can follow
+     * the sweep without counting samples.
+     *
+     * While copying, an "rx_time" tag that does not follow on from the
+     * previous one by the number of samples in between (or any rx_time
+     * tag if the time or sample rate is not yet known) means samples were
+     * dropped, e.g. by an overflow. The segment is then re-acquired: the
+     * samples already copied are abandoned and the segment is copied again
+     * from the tagged sample, with a new segment_start tag of the same
+     * index whose "retries" key counts the attempts so far. The tuning is
+     * unchanged, so no skip is needed. psd_estimator_cf discards the
+     * abandoned samples on seeing such a tag.
      */
     class USRPCALIBRATOR_API controller_cc : virtual public gr::block
     {
@@ -57,6 +105,16 @@ namespace gr {
                        size_t ncopy,
                        bool use_integer_tuning=false);
 
+      /*!
+       * \brief Make a controller that tunes via its "command" message port
+       */
+      static sptr make(std::vector<double> center_freqs,
+                       double lo_offset,
+                       size_t nskip_init,
+                       size_t nskip_tune,
+                       size_t ncopy,
+                       bool use_integer_tuning=false);
+
       /*!
        * \brief Return true if flowgraph will exit at end of span
        */
@@ -65,17 +123,150 @@ namespace gr {
       /*!
        * \brief Exit the flowgraph at the end of the span.
        *
-       * The end of the span means the block has copied a multiple of
-       * ncopy*nsegments samples.
+       * The end of the span means the block has copied every segment of
+       * the schedule.
        */
       virtual void set_exit_after_complete(bool exit_after_complete) = 0;
 
+      /*!
+       * \brief Replace the center frequencies swept by the block.
+       *
+       * Also resets the block to the start of the span. Call between runs
+       * of the flowgraph to sweep a new span without rebuilding it.
+       */
+      virtual void set_center_freqs(const std::vector<double> &center_freqs) = 0;
+
+      /*!
+       * \brief Return the center frequencies swept by the block
+       */
+      virtual std::vector<double> center_freqs() const = 0;
+
+      /*!
+       * \brief Replace the per-segment schedule swept by the block.
+       *
+       * Element i of each vector applies to segment i. An empty vector
+       * means the block's default (nskip_tune, ncopy or lo_offset) for
+       * every segment, or for \p gains, that the gain is left alone.
+       * Non-empty vectors must be the same length as \p center_freqs.
+       * Like set_center_freqs, resets the block to the start of the span.
+       */
+      virtual void set_schedule(const std::vector<double> &center_freqs,
+                                const std::vector<size_t> &nskip_tune,
+                                const std::vector<size_t> &ncopy,
+                                const std::vector<double> &gains,
+                                const std::vector<double> &lo_offsets) = 0;
+
+      /*!
+       * \brief Set samples to skip after USRP initialization.
+       *
+       * Takes effect at the start of the next span. Set to 0 when the
+       * flowgraph is rerun with an already initialized USRP.
+       */
+      virtual void set_nskip_init(size_t nskip_init) = 0;
+
       /*!
        * \brief Disable verification of tag frequency
        *
        * Useful for unit testing
        */
       virtual void disable_verify_tag_freq() = 0;
+
+      /*!
+       * \brief Set how far in Hz an rx_freq tag may be from the expected
+       * frequency (default 1 Hz)
+       */
+      virtual void set_tag_freq_tolerance(double tolerance) = 0;
+      virtual double tag_freq_tolerance() const = 0;
+
+      /*!
+       * \brief Set the sample rate used to time stamp segments.
+       *
+       * An rx_rate tag on the input overrides it.
+       */
+      virtual void set_samp_rate(double samp_rate) = 0;
+      virtual double samp_rate() const = 0;
+
+      /*!
+       * \brief Skip only until the signal has settled after a retune.
+       *
+       * After the rx_freq tag, the mean power and DC offset of consecutive
+       * windows of \p window samples are compared. The segment is settled
+       * once 2 successive window pairs agree to within \p tolerance_db
+       * (the DC offset is compared relative to the window's RMS level).
+       * At least \p nskip_min and at most the segment's nskip_tune
+       * samples are skipped.
+       * The initial sample delay after USRP initialization is always
+       * skipped in full before the statistics are watched.
+       */
+      virtual void set_adaptive_settle(size_t window,
+                                       double tolerance_db,
+                                       size_t nskip_min) = 0;
+
+      /*!
+       * \brief Sweep segments grouped by LO band rather than in schedule order.
+       *
+       * Segments are ordered by the LO band their LO frequency (freq plus
+       * lo_offset) falls in, bands being separated by \p edges (e.g. VCO
+       * band or LO divider boundaries), then by LO frequency. Every other
+       * span is swept in reverse, so repeated spans don't jump from the
+       * top band back to the bottom one. Each band edge is then crossed
+       * once per span. Segments keep their index in segment_start tags,
+       * so stitched spectra remain in frequency order. Takes effect at the
+       * start of the next span.
+       */
+      virtual void set_lo_band_order(const std::vector<double> &edges) = 0;
+
+      /*!
+       * \brief Sweep segments in schedule order (default)
+       */
+      virtual void disable_lo_band_order() = 0;
+
+      /*!
+       * \brief Return true if segments are swept grouped by LO band
+       */
+      virtual bool lo_band_order() const = 0;
+
+      /*!
+       * \brief Choose integer-N or fractional-N tuning for each segment.
+       *
+       * A segment is tuned with mode_n=integer if that puts its LO within
+       * \p tolerance Hz of the requested LO frequency, and fractional-N
+       * otherwise. When tuning a usrp_source directly, integer-N is tried
+       * first and checked against the tune result, retuning fractional-N
+       * if needed. Without a usrp_source, the LO error is predicted from
+       * \p lo_step, the spacing of the integer-N LO grid (the PLL's
+       * comparison frequency over its output divider), which must then be
+       * positive. Each segment's choice is kept for later spans until the
+       * schedule changes. Overrides use_integer_tuning.
+       */
+      virtual void set_auto_integer_tuning(double tolerance,
+                                           double lo_step=0) = 0;
+
+      /*!
+       * \brief Tune every segment as given by use_integer_tuning (default)
+       */
+      virtual void disable_auto_integer_tuning() = 0;
+
+      /*!
+       * \brief Return true if integer-N tuning is chosen per segment
+       */
+      virtual bool auto_integer_tuning() const = 0;
+
+      /*!
+       * \brief Always skip nskip_tune samples after a retune (default)
+       */
+      virtual void disable_adaptive_settle() = 0;
+
+      /*!
+       * \brief Return true if the tune delay is detected adaptively
+       */
+      virtual bool adaptive_settle() const = 0;
+
+      /*!
+       * \brief Return the number of segments re-acquired after dropped
+       * samples since the block was made
+       */
+      virtual uint64_t nretries() const = 0;
     };
 
   } // namespace usrpcalibrator
@@ -0,0 +1,96 @@
+/* -*- c++ -*- */
+/*
+ * Copyright 2016 Douglas Anderson
+ *
+ * This is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 3, or (at your option)
+ * any later version.
+ *
+ * This software is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this software; see the file COPYING.  If not, write to
+ * the Free Software Foundation, Inc., 51 Franklin Street,
+ * Boston, MA 02110-1301, USA.
+ */
+
+#ifndef INCLUDED_USRPCALIBRATOR_MEAN_POWER_CF_H
+#define INCLUDED_USRPCALIBRATOR_MEAN_POWER_CF_H
+
+#include <stdint.h>
+
+#include <usrpcalibrator/api.h>
+#include <gnuradio/sync_block.h>
+
+namespace gr {
+  namespace usrpcalibrator {
+
+    /*!
+     * \brief Measure mean power of a complex stream on request
+     * \ingroup usrpcalibrator
+     *
+     * A sink that discards its input until arm() is called. It then skips
+     * nskip samples, integrates |x|^2 over the next nintegrate samples and
+     * computes their mean power in dBm into 50 ohms. The result is
+     * available from power_dbm() once done() returns true, and is also
+     * published on the "power" message port as a dict with keys
+     * "power_dbm", "nsamples" and "offset" (the first integrated sample).
+     *
+     * This lets a flowgraph stream continuously while Python takes single
+     * measurements, without the samples ever reaching Python.
+     *
+     * arm_at_time() instead starts integrating at the sample received at a
+     * given device time, located from the "rx_time" and "rx_rate" tags that
+     * usrp_source adds to its stream. If that sample has already passed,
+     * integration starts immediately and the message's "late" key is true.
+     */
+    class USRPCALIBRATOR_API mean_power_cf : virtual public gr::sync_block
+    {
+     public:
+      typedef boost::shared_ptr<mean_power_cf> sptr;
+
+      /*!
+       * \brief Return a shared_ptr to a new instance of usrpcalibrator::mean_power_cf.
+       *
+       * To avoid accidental use of raw pointers, usrpcalibrator::mean_power_cf's
+       * constructor is in a private implementation
+       * class. usrpcalibrator::mean_power_cf::make is the public interface for
+       * creating new instances.
+       */
+      static sptr make();
+
+      /*!
+       * \brief Start a measurement, abandoning any in progress
+       */
+      virtual void arm(uint64_t nskip, uint64_t nintegrate) = 0;
+
+      /*!
+       * \brief Start a measurement at device time time_secs
+       */
+      virtual void arm_at_time(double time_secs, uint64_t nintegrate) = 0;
+
+      /*!
+       * \brief Return true once the measurement started by arm() is complete
+       */
+      virtual bool done() const = 0;
+
+      /*!
+       * \brief Return the last completed measurement in dBm
+       */
+      virtual double power_dbm() const = 0;
+
+      /*!
+       * \brief Return true if the last measurement armed with arm_at_time()
+       * started after its requested device time
+       */
+      virtual bool late() const = 0;
+    };
+
+  } // namespace usrpcalibrator
+} // namespace gr
+
+#endif /* INCLUDED_USRPCALIBRATOR_MEAN_POWER_CF_H */
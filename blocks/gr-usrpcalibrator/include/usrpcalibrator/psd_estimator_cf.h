@@ -0,0 +1,110 @@
+/* -*- c++ -*- */
+/*
+ * Copyright 2016 Douglas Anderson
+ *
+ * This is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 3, or (at your option)
+ * any later version.
+ *
+ * This software is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this software; see the file COPYING.  If not, write to
+ * the Free Software Foundation, Inc., 51 Franklin Street,
+ * Boston, MA 02110-1301, USA.
+ */
+
+
+#ifndef INCLUDED_USRPCALIBRATOR_PSD_ESTIMATOR_CF_H
+#define INCLUDED_USRPCALIBRATOR_PSD_ESTIMATOR_CF_H
+
+#include <cstdlib> /* size_t */
+#include <vector>
+
+#include <usrpcalibrator/api.h>
+#include <gnuradio/block.h>
+
+namespace gr {
+  namespace usrpcalibrator {
+
+    /*!
+     * \brief Averaged power spectrum in dBm from complex samples
+     * \ingroup usrpcalibrator
+     *
+     * Replaces the chain stream_to_vector -> multiply_const_cc -> fft_vcc
+     * -> complex_to_mag_squared -> bin_statistics_ff -> nlog10_ff.
+     *
+     * Input samples are cut into frames of fft_len, windowed (the voltage
+     * scale factor is folded into the window), transformed and their
+     * magnitude squared is accumulated. Every naverages frames one
+     * fft-shifted vector of fft_len bins is produced in dBm into 50 ohms,
+     * normalized by the window power. Only one log is taken per output.
+     *
+     * Tags on the input samples of an average are moved to its output
+     * vector, so that e.g. controller_cc's "segment_start" tags mark the
+     * spectrum of each segment.
+     *
+     * A "segment_start" tag whose dict value has an "ncopy" key starts a
+     * new average of ncopy / fft_len frames (at least one). Any partial
+     * average still accumulating is produced first, so each segment of a
+     * controller_cc schedule yields exactly one vector whatever its copy
+     * count. Without such tags, naverages frames make up each output.
+     *
+     * Frames are aligned to segment_start tags: input before a tag that
+     * falls part way through a frame is dropped. If the tag has a non-zero
+     * "retries" key, the segment is being copied again after controller_cc
+     * saw dropped samples, and the partial average of the abandoned
+     * attempt is discarded instead of produced.
+     *
+     * The scale factor only holds at the gain it was measured at. Once
+     * set_reference_gain is called, the spectrum of a segment whose
+     * segment_start tag has a "gain" key (see controller_cc's
+     * set_schedule) is corrected by the difference from that gain.
+     */
+    class USRPCALIBRATOR_API psd_estimator_cf : virtual public gr::block
+    {
+     public:
+      typedef boost::shared_ptr<psd_estimator_cf> sptr;
+
+      /*!
+       * \brief Return a shared_ptr to a new instance of usrpcalibrator::psd_estimator_cf.
+       *
+       * To avoid accidental use of raw pointers, usrpcalibrator::psd_estimator_cf's
+       * constructor is in a private implementation
+       * class. usrpcalibrator::psd_estimator_cf::make is the public interface for
+       * creating new instances.
+       *
+       * Output 0 is the averaged spectrum in dBm. Optional output 1 is
+       * the max-hold spectrum in dBm over the same frames, and optional
+       * output 2 the variance of each averaged bin relative to its
+       * square, i.e. var(frame power) / (mean^2 * nframes), from which
+       * the standard error of the average in dB is
+       * 10*log10(1 + sqrt(output 2)). Segment tags are copied to every
+       * output.
+       *
+       * \param fft_len number of bins per frame
+       * \param naverages number of frames averaged into each output
+       * \param window window taps, length fft_len (empty for rectangular)
+       * \param scale_factor voltage scale factor applied to input samples
+       */
+      static sptr make(size_t fft_len,
+                       size_t naverages,
+                       const std::vector<float> &window,
+                       float scale_factor=1.0);
+
+      /*!
+       * \brief Set the gain in dB that scale_factor was measured at.
+       *
+       * Until called, "gain" keys in segment_start tags are ignored.
+       */
+      virtual void set_reference_gain(double gain) = 0;
+    };
+
+  } // namespace usrpcalibrator
+} // namespace gr
+
+#endif /* INCLUDED_USRPCALIBRATOR_PSD_ESTIMATOR_CF_H */
@@ -0,0 +1,84 @@
+/* -*- c++ -*- */
+/*
+ * Copyright 2016 Douglas Anderson
+ *
+ * This is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 3, or (at your option)
+ * any later version.
+ *
+ * This software is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this software; see the file COPYING.  If not, write to
+ * the Free Software Foundation, Inc., 51 Franklin Street,
+ * Boston, MA 02110-1301, USA.
+ */
+
+#ifndef INCLUDED_USRPCALIBRATOR_SIM_TUNER_SOURCE_C_H
+#define INCLUDED_USRPCALIBRATOR_SIM_TUNER_SOURCE_C_H
+
+#include <cstdlib> /* size_t */
+
+#include <vector>
+
+#include <usrpcalibrator/api.h>
+#include <gnuradio/sync_block.h>
+
+namespace gr {
+  namespace usrpcalibrator {
+
+    /*!
+     * \brief Stand-in for a usrp_source when testing sweeps
+     * \ingroup usrpcalibrator
+     *
+     * Accepts the same tune dicts on its "command" message port as a
+     * usrp_source (see controller_cc) and, tune_latency samples after a
+     * command is handled, tags the output with "rx_freq" set to the
+     * command's "freq". The output is a ramp, sample n being (n, 0), so
+     * that tests can tell exactly which samples were passed downstream.
+     *
+     * To model a PLL that takes longer to relock across a VCO band or
+     * divider boundary, set_lo_band_edges adds crossing_latency samples to
+     * every tune whose LO frequency ("freq" plus "lo_offset") is in a
+     * different band than the previous tune's.
+     */
+    class USRPCALIBRATOR_API sim_tuner_source_c : virtual public gr::sync_block
+    {
+     public:
+      typedef boost::shared_ptr<sim_tuner_source_c> sptr;
+
+      /*!
+       * \brief Return a shared_ptr to a new instance of usrpcalibrator::sim_tuner_source_c.
+       *
+       * To avoid accidental use of raw pointers, usrpcalibrator::sim_tuner_source_c's
+       * constructor is in a private implementation
+       * class. usrpcalibrator::sim_tuner_source_c::make is the public interface for
+       * creating new instances.
+       *
+       * \param tune_latency samples between a tune command and its rx_freq tag
+       */
+      static sptr make(size_t tune_latency);
+
+      virtual void set_tune_latency(size_t tune_latency) = 0;
+      virtual size_t tune_latency() const = 0;
+
+      /*!
+       * \brief Add crossing_latency samples to tunes that change LO band
+       */
+      virtual void set_lo_band_edges(const std::vector<double> &edges,
+                                     size_t crossing_latency) = 0;
+
+      /*!
+       * \brief Return the number of tunes that changed LO band so far
+       */
+      virtual size_t nband_crossings() const = 0;
+    };
+
+  } // namespace usrpcalibrator
+} // namespace gr
+
+#endif /* INCLUDED_USRPCALIBRATOR_SIM_TUNER_SOURCE_C_H */
@@ -22,8 +22,10 @@
 #ifndef INCLUDED_USRPCALIBRATOR_STITCH_FFT_SEGMENTS_FF_H
 #define INCLUDED_USRPCALIBRATOR_STITCH_FFT_SEGMENTS_FF_H
 
+#include <vector>
+
 #include <usrpcalibrator/api.h>
-#include <gnuradio/sync_block.h>
+#include <gnuradio/block.h>
 
 namespace gr {
   namespace usrpcalibrator {
@@ -32,8 +34,35 @@ namespace gr {
      * \brief Given an input vector of fft_size segments, overlap them
      * \ingroup usrpcalibrator
      *
+     * Each input item holds nsegments spectra of fft_size bins whose center
+     * frequencies are nvalid_bins bins apart. Each output item holds the
+     * nvalid_bins center bins of every segment, i.e., a single spectrum of
+     * nsegments * nvalid_bins bins.
+     *
+     * By default the bins outside the center of each segment are
+     * discarded. With set_average_overlap(true), every output bin is instead
+     * the power average of the segments that cover its frequency: bins are
+     * converted from dB, weighted by their bin weight, averaged and
+     * converted back. Bins on the edges of a segment are on the roll-off
+     * of the USRP's anti-aliasing filter, so by default only bins within
+     * half the discarded margin of the center bins have weight 1 and the
+     * rest 0. set_bin_weights can instead give e.g. the filter's measured
+     * power response.
+     *
+     * With segment_input, each input item is a single segment of fft_size
+     * bins instead. Its position in the span is read from the "index" of a
+     * "segment_start" tag on the item (see controller_cc), or is the one
+     * after the previous segment if the item is untagged. An output item is
+     * produced once every segment of the span has been received. This only
+     * shrinks the buffers upstream of the block, which hold single
+     * segments instead of whole spans: the block itself still keeps a
+     * span of nsegments * fft_size bins, and its output items are
+     * nsegments * nvalid_bins bins, so memory use is still O(nsegments).
+     * A segment tagged with a different "span" than the segments received
+     * so far means the earlier span lost a segment, so its partial
+     * spectrum is dropped rather than completed with bins from two sweeps.
      */
-    class USRPCALIBRATOR_API stitch_fft_segments_ff : virtual public gr::sync_block
+    class USRPCALIBRATOR_API stitch_fft_segments_ff : virtual public gr::block
     {
      public:
       typedef boost::shared_ptr<stitch_fft_segments_ff> sptr;
@@ -49,7 +78,32 @@ namespace gr {
       static sptr make(size_t fft_size,
                        size_t nsegments,
                        float overlap,
-                       size_t nvalid_bins);
+                       size_t nvalid_bins,
+                       bool segment_input=false);
+
+      /*!
+       * \brief Average bins shared by neighbouring segments
+       */
+      virtual void set_average_overlap(bool average_overlap) = 0;
+
+      /*!
+       * \brief Return true if bins shared by neighbouring segments are averaged
+       */
+      virtual bool average_overlap() const = 0;
+
+      /*!
+       * \brief Set the weight of each of the fft_size bins of a segment
+       * when averaging overlap.
+       *
+       * Weights must not be negative, and every output bin must be covered
+       * by a bin of non-zero weight, e.g., the center nvalid_bins bins.
+       */
+      virtual void set_bin_weights(const std::vector<float> &weights) = 0;
+
+      /*!
+       * \brief Return the weight of each bin of a segment
+       */
+      virtual std::vector<float> bin_weights() const = 0;
     };
 
   } // namespace usrpcalibrator
@@ -22,7 +22,9 @@
 #include "config.h"
 #endif
 
-#include <algorithm> /* copy */
+#include <algorithm> /* copy, fill, max, min */
+#include <cassert>
+#include <stdexcept> /* invalid_argument */
 
 #include <gnuradio/io_signature.h>
 #include <volk/volk.h>
@@ -32,65 +34,250 @@ namespace gr {
   namespace usrpcalibrator {
 
     bin_statistics_ff::sptr
-    bin_statistics_ff::make(size_t vlen, size_t meas_interval)
+    bin_statistics_ff::make(size_t vlen, size_t meas_interval, float alpha)
     {
       return gnuradio::get_initial_sptr
-        (new bin_statistics_ff_impl(vlen, meas_interval));
+        (new bin_statistics_ff_impl(vlen, meas_interval, alpha));
     }
 
     /*
      * The private constructor
      */
-    bin_statistics_ff_impl::bin_statistics_ff_impl(size_t vlen, size_t meas_interval)
-      : gr::sync_decimator("bin_statistics_ff",
-                           gr::io_signature::make(1, 1, vlen * sizeof(float)),
-                           gr::io_signature::make(1, 1, vlen * sizeof(float)), meas_interval),
-        d_vlen(vlen), d_meas_interval(meas_interval)
+    bin_statistics_ff_impl::bin_statistics_ff_impl(size_t vlen,
+                                                   size_t meas_interval,
+                                                   float alpha)
+      : gr::block("bin_statistics_ff",
+                  gr::io_signature::make(1, 1, vlen * sizeof(float)),
+                  gr::io_signature::make(1, 4, vlen * sizeof(float))),
+        d_vlen(vlen), d_meas_interval(meas_interval),
+        d_delta(vlen), d_delta_sum(vlen),
+        d_ema(vlen), d_ema_valid(false),
+        d_segment_key(pmt::intern("segment_start"))
     {
       assert(d_meas_interval > 0);
 
+      set_alpha(alpha);
+
+      set_relative_rate(1.0 / d_meas_interval);
+      set_tag_propagation_policy(TPP_DONT);
+
       const int alignment_multiple = volk_get_alignment() / sizeof(float);
       set_alignment(std::max(1, alignment_multiple));
     }
 
-    int
-    bin_statistics_ff_impl::work(int noutput_items,
-                                 gr_vector_const_void_star &input_items,
-                                 gr_vector_void_star &output_items)
+    void
+    bin_statistics_ff_impl::set_alpha(float alpha)
     {
-      const float *in = (const float *) input_items[0];
-      float *out = (float *) output_items[0];
+      if (alpha < 0 || alpha > 1)
+        throw std::invalid_argument("bin_statistics_ff: alpha must be in [0, 1]");
+
+      gr::thread::scoped_lock lock(d_mutex);
+      d_alpha = alpha;
+      d_ema_valid = false;
+    }
+
+    float
+    bin_statistics_ff_impl::alpha() const
+    {
+      gr::thread::scoped_lock lock(d_mutex);
+      return d_alpha;
+    }
 
-      if (d_meas_interval == 1)
+    void
+    bin_statistics_ff_impl::update_ema(const float *x)
+    /* d_ema += d_alpha * (x - d_ema) */
+    {
+      if (!d_ema_valid)
       {
-        // No averaging required, copy all
-        std::copy(in, &in[d_vlen * noutput_items], out);
+        std::copy(x, x + d_vlen, d_ema.begin());
+        d_ema_valid = true;
+        return;
       }
+
+      float *delta = &d_delta[0];
+      volk_32f_x2_subtract_32f(delta, x, &d_ema[0], d_vlen);
+      volk_32f_s32f_multiply_32f(delta, delta, d_alpha, d_vlen);
+      volk_32f_x2_add_32f(&d_ema[0], &d_ema[0], delta, d_vlen);
+    }
+
+    void
+    bin_statistics_ff_impl::compute_statistics(const float *in,
+                                               float *mean,
+                                               float *max,
+                                               float *min,
+                                               float *var)
+    /* Reduce d_meas_interval vectors at in. max, min and var may be NULL.
+     *
+     * The variance is accumulated relative to the first vector so that
+     * squaring large dB values doesn't swamp the float precision.
+     */
+    {
+      const float *first = in;
+
+      if (d_alpha > 0)
+        update_ema(first);
+
+      std::copy(first, first + d_vlen, mean);
+      if (max)
+        std::copy(first, first + d_vlen, max);
+      if (min)
+        std::copy(first, first + d_vlen, min);
+      if (var)
+      {
+        std::fill(var, var + d_vlen, 0);
+        std::fill(d_delta_sum.begin(), d_delta_sum.end(), 0);
+      }
+
+      for (size_t i = 1; i < d_meas_interval; ++i)
+      {
+        const float *x = &in[i * d_vlen];
+
+        if (d_alpha == 0)
+          volk_32f_x2_add_32f(mean, mean, x, d_vlen);
+        if (max)
+          volk_32f_x2_max_32f(max, max, x, d_vlen);
+        if (min)
+          volk_32f_x2_min_32f(min, min, x, d_vlen);
+        if (var)
+        {
+          float *delta = &d_delta[0];
+          volk_32f_x2_subtract_32f(delta, x, first, d_vlen);
+          volk_32f_x2_add_32f(&d_delta_sum[0], &d_delta_sum[0], delta, d_vlen);
+          volk_32f_x2_multiply_32f(delta, delta, delta, d_vlen);
+          volk_32f_x2_add_32f(var, var, delta, d_vlen);
+        }
+        if (d_alpha > 0)
+          update_ema(x);
+      }
+
+      // divide by d_meas_interval = multiply by 1/d_meas_interval
+      const float scalar = 1 / static_cast<float>(d_meas_interval);
+      if (d_alpha > 0)
+        std::copy(d_ema.begin(), d_ema.end(), mean);
       else
+        volk_32f_s32f_multiply_32f(mean, mean, scalar, d_vlen);
+
+      if (var)
       {
-        // Average the input vectors in the measurement interval
-        for (size_t n = 0; n < noutput_items; ++n)
+        // var = (sum(delta^2) - sum(delta)^2 / N) / N
+        float *sq_sum = &d_delta[0];
+        volk_32f_x2_multiply_32f(sq_sum, &d_delta_sum[0], &d_delta_sum[0], d_vlen);
+        volk_32f_s32f_multiply_32f(sq_sum, sq_sum, scalar, d_vlen);
+        volk_32f_x2_subtract_32f(var, var, sq_sum, d_vlen);
+        volk_32f_s32f_multiply_32f(var, var, scalar, d_vlen);
+      }
+    }
+
+    void
+    bin_statistics_ff_impl::forecast(int noutput_items,
+                                     gr_vector_int &ninput_items_required)
+    {
+      ninput_items_required[0] = noutput_items * d_meas_interval;
+    }
+
+    bool
+    bin_statistics_ff_impl::find_segment_start(uint64_t start,
+                                               uint64_t stop,
+                                               uint64_t &offset)
+    /* Set offset to the first segment_start tag in [start, stop) */
+    {
+      get_tags_in_range(d_tags, 0, start, stop, d_segment_key);
+      if (d_tags.empty())
+        return false;
+
+      offset = d_tags[0].offset;
+      for (size_t i = 1; i < d_tags.size(); ++i)
+        offset = std::min(offset, d_tags[i].offset);
+      return true;
+    }
+
+    void
+    bin_statistics_ff_impl::move_tags(uint64_t start,
+                                      uint64_t stop,
+                                      uint64_t out_offset,
+                                      size_t noutputs)
+    /* Put the tags on input vectors [start, stop) on each output at out_offset */
+    {
+      get_tags_in_range(d_tags, 0, start, stop);
+      for (size_t i = 0; i < d_tags.size(); ++i)
+      {
+        for (size_t port = 0; port < noutputs; ++port)
+          add_item_tag(port, out_offset,
+                       d_tags[i].key, d_tags[i].value, d_tags[i].srcid);
+      }
+    }
+
+    int
+    bin_statistics_ff_impl::general_work(int noutput_items,
+                                         gr_vector_int &ninput_items,
+                                         gr_vector_const_void_star &input_items,
+                                         gr_vector_void_star &output_items)
+    {
+      const float *in = (const float *) input_items[0];
+      float *out = (float *) output_items[0];
+
+      const size_t noutputs = output_items.size();
+      float *max = noutputs > 1 ? (float *) output_items[1] : NULL;
+      float *min = noutputs > 2 ? (float *) output_items[2] : NULL;
+      float *var = noutputs > 3 ? (float *) output_items[3] : NULL;
+
+      const uint64_t nread = nitems_read(0);
+      const size_t ninput = ninput_items[0];
+      size_t nconsumed = 0;
+      size_t nproduced = 0;
+
+      // d_alpha and d_ema stay as they are while this call's vectors are reduced
+      gr::thread::scoped_lock lock(d_mutex);
+
+      while (nproduced < (size_t)noutput_items &&
+             nconsumed + d_meas_interval <= ninput)
+      {
+        const uint64_t start = nread + nconsumed;
+        const uint64_t stop = start + d_meas_interval;
+
+        // A segment starting inside this interval begins a new one, so
+        // drop the vectors before it rather than mixing two segments
+        uint64_t seg_offset;
+        if (find_segment_start(start + 1, stop, seg_offset))
         {
-          std::copy(&in[n * d_vlen * d_meas_interval],
-                    &in[n * d_vlen * d_meas_interval + d_vlen],
-                    &out[n * d_vlen]);
-
-          for (size_t i = 1; i < d_meas_interval; ++i)
-          {
-            volk_32f_x2_add_32f(&out[n * d_vlen],
-                                &out[n * d_vlen],
-                                &in[(n * d_meas_interval + i) * d_vlen],
-                                d_vlen);
-          }
+          nconsumed = seg_offset - nread;
+          continue;
         }
 
-        // divide by d_meas_interval = multiply by 1/d_meas_interval
-        const float scalar = 1 / static_cast<float>(d_meas_interval);
-        volk_32f_s32f_multiply_32f(out, out, scalar, d_vlen * noutput_items);
+        if (find_segment_start(start, start + 1, seg_offset))
+          d_ema_valid = false;
+
+        if (d_meas_interval == 1 && !var && d_alpha == 0)
+        {
+          // No averaging required, copy
+          const float *x = &in[nconsumed * d_vlen];
+          const size_t offset = nproduced * d_vlen;
+          std::copy(x, x + d_vlen, &out[offset]);
+          if (max)
+            std::copy(x, x + d_vlen, &max[offset]);
+          if (min)
+            std::copy(x, x + d_vlen, &min[offset]);
+        }
+        else
+        {
+          const size_t offset = nproduced * d_vlen;
+          compute_statistics(&in[nconsumed * d_vlen],
+                             &out[offset],
+                             max ? &max[offset] : NULL,
+                             min ? &min[offset] : NULL,
+                             var ? &var[offset] : NULL);
+        }
+
+        move_tags(start, stop, nitems_written(0) + nproduced, noutputs);
+
+        nconsumed += d_meas_interval;
+        nproduced++;
       }
 
+      consume_each(nconsumed);
+
       // Tell runtime system how many output items we produced.
-      return noutput_items;
+      return nproduced;
     }
 
   } /* namespace usrpcalibrator */
@@ -21,6 +21,10 @@
 #ifndef INCLUDED_USRPCALIBRATOR_BIN_STATISTICS_FF_IMPL_H
 #define INCLUDED_USRPCALIBRATOR_BIN_STATISTICS_FF_IMPL_H
 
+#include <vector>
+
+#include <gnuradio/thread/thread.h>
+#include <pmt/pmt.h>
 #include <usrpcalibrator/bin_statistics_ff.h>
 
 namespace gr {
@@ -32,13 +36,41 @@ namespace gr {
       unsigned int d_vlen;
       unsigned int d_meas_interval;
 
+      std::vector<float> d_delta;     // scratch: one vector minus the first
+      std::vector<float> d_delta_sum; // running sum of d_delta
+
+      float d_alpha;                  // 0 selects the block mean
+      std::vector<float> d_ema;       // exponential moving average
+      bool d_ema_valid;               // false until d_ema is seeded
+      mutable gr::thread::mutex d_mutex;  // set_alpha() is called from Python
+
+      pmt::pmt_t d_segment_key;
+      std::vector<gr::tag_t> d_tags;
+
+      void update_ema(const float *x);
+      bool find_segment_start(uint64_t start, uint64_t stop, uint64_t &offset);
+      void move_tags(uint64_t start, uint64_t stop,
+                     uint64_t out_offset, size_t noutputs);
+
+      void compute_statistics(const float *in,
+                              float *mean,
+                              float *max,
+                              float *min,
+                              float *var);
+
      public:
-      bin_statistics_ff_impl(size_t vlen, size_t meas_interval);
+      bin_statistics_ff_impl(size_t vlen, size_t meas_interval, float alpha);
+
+      void set_alpha(float alpha);
+      float alpha() const;
+
+      void forecast(int noutput_items, gr_vector_int &ninput_items_required);
 
       // Where all the action really happens
-      int work(int noutput_items,
-               gr_vector_const_void_star &input_items,
-               gr_vector_void_star &output_items);
+      int general_work(int noutput_items,
+                       gr_vector_int &ninput_items,
+                       gr_vector_const_void_star &input_items,
+                       gr_vector_void_star &output_items);
     };
 
   } // namespace usrpcalibrator
@@ -22,16 +22,21 @@
 #include "config.h"
 #endif
 
-#include <algorithm> /* min */
+#include <algorithm> /* min, reverse, sort, upper_bound */
+#include <cmath>     /* abs */
 #include <cstring>   /* memcpy */
 #include <cassert>   /* assert */
-#include <deque>
+#include <numeric>   /* accumulate */
+#include <stdexcept>
+#include <utility>   /* pair */
 #include <vector>
 
+#include <boost/bind.hpp>
 #include <gnuradio/io_signature.h>
 #include <gnuradio/uhd/usrp_source.h>
 #include <pmt/pmt.h>
 #include <uhd/types/tune_request.hpp>
+#include <volk/volk.h>
 //#include <uhd/types/device_addr.hpp>
 #include "controller_cc_impl.h"
 
@@ -57,10 +62,28 @@ namespace gr {
                                 use_integer_tuning));
     }
 
+    controller_cc::sptr
+    controller_cc::make(std::vector<double> center_freqs,
+                        double lo_offset,
+                        size_t nskip_init,
+                        size_t nskip_tune,
+                        size_t ncopy,
+                        bool use_integer_tuning)
+    {
+      return gnuradio::get_initial_sptr
+        (new controller_cc_impl(boost::shared_ptr<gr::uhd::usrp_source>(),
+                                center_freqs,
+                                lo_offset,
+                                nskip_init,
+                                nskip_tune,
+                                ncopy,
+                                use_integer_tuning));
+    }
+
     /*
      * The private constructor
      */
-    controller_cc_impl::controller_cc_impl(boost::shared_ptr<gr::uhd::usrp_source> &usrp,
+    controller_cc_impl::controller_cc_impl(const boost::shared_ptr<gr::uhd::usrp_source> &usrp,
                                            std::vector<double> center_freqs,
                                            double lo_offset,
                                            size_t nskip_init,
@@ -74,25 +97,55 @@ namespace gr {
     {
       d_nskip_init = nskip_init;
       d_nskip_tune = nskip_tune;
-      d_nskip_total = nskip_init + nskip_tune;
-      d_cfreqs_orig = center_freqs;
-      d_cfreqs_iter = std::deque<double>(center_freqs.begin(),
-                                         center_freqs.end());
-      d_nsegments = center_freqs.size();
+
+      d_span = 0;
       d_current_segment = 1;
-      d_nskipped = 0;
       d_ncopied = 0;
+      d_retries = 0;
+      d_nretries = 0;
+      d_lo_band_order = false;
+      d_order_stale = false;
+      d_auto_integer_tuning = false;
+      d_integer_n_tolerance = 0;
+      d_integer_n_step = 0;
+      set_center_freqs(center_freqs);
 
-      st.state = ST_INIT_TUNE;
-
-      d_retune = d_nsegments > 1;
       d_exit_after_complete = false;
       d_use_integer_tuning = use_integer_tuning;
+      d_integer_n = use_integer_tuning;
 
       d_tag_key = pmt::intern("rx_freq");
+      d_segment_key = pmt::intern("segment_start");
+      d_time_key = pmt::intern("rx_time");
+      d_rate_key = pmt::intern("rx_rate");
+      d_have_time = false;
+      d_time_offset = 0;
+      d_time_secs = 0;
+      d_time_value = pmt::PMT_NIL;
+      d_samp_rate = 0;
+      d_rx_freq = 0;
+
+      d_command_port = pmt::intern("command");
+      message_port_register_out(d_command_port);
+
+      d_have_pending_freqs = false;
+      d_segment_info = pmt::PMT_NIL;
+      d_freqs_port = pmt::intern("freqs");
+      message_port_register_in(d_freqs_port);
+      set_msg_handler(d_freqs_port,
+                      boost::bind(&controller_cc_impl::handle_freqs, this, _1));
+      d_segment_port = pmt::intern("segment");
+      message_port_register_out(d_segment_port);
 
       set_tag_propagation_policy(TPP_DONT);
       d_verify_tag_freq = true;
+      d_tag_freq_tolerance = 1.0;
+
+      d_adaptive_settle = false;
+      d_settle_window = 0;
+      d_settle_tolerance = 0.0;
+      d_nskip_min = 0;
+      reset_settle_detector();
     }
 
     void
@@ -120,7 +173,10 @@ namespace gr {
           delay_for_rx_freq(ninput_items[0], st);
           break;
         case ST_TUNE_DELAY:
-          delay_for_usrp_tune(noutput_items, st);
+          if (d_adaptive_settle)
+            delay_until_settled(noutput_items, (const gr_complex *) input_items[0], st);
+          else
+            delay_for_usrp_tune(noutput_items, st);
           break;
         case ST_COPY:
           copy_samples(noutput_items, input_items, output_items, st);
@@ -131,6 +187,9 @@ namespace gr {
         }
       }
 
+      if (st.nconsume > 0)
+        read_time_tags(nitems_read(0), nitems_read(0) + st.nconsume);
+
       this->consume(0, st.nconsume);
       return st.retval;
     }
@@ -149,6 +208,7 @@ namespace gr {
     void
     controller_cc_impl::tune_initial_fc(int& noutput_items, WorkState& st)
     {
+      apply_pending_freqs();
       set_next_fc();
       tune_usrp();
       st.nconsume = noutput_items;
@@ -173,11 +233,11 @@ namespace gr {
       bool got_target_freq = false;
       while (!d_tags.empty() && !got_target_freq)
       {
-        // For some reason rx_freq's value is not part of tune_result_t
-        double trfreq = d_tune_result.actual_rf_freq - d_tune_result.actual_dsp_freq;
-        if (pmt::to_double(d_tags[0].value) == trfreq || !d_verify_tag_freq)
+        double freq_error = pmt::to_double(d_tags[0].value) - expected_rx_freq();
+        if (std::abs(freq_error) <= d_tag_freq_tolerance || !d_verify_tag_freq)
         {
           rel_offset = d_tags[0].offset - range_start;
+          d_rx_freq = pmt::to_double(d_tags[0].value);
           got_target_freq = true;
         }
 
@@ -189,6 +249,7 @@ namespace gr {
       {
         //assert(usrp_ptr->get_sensor("lo_locked").to_bool());
         st.state = ST_TUNE_DELAY;
+        reset_settle_detector();
 
         if (rel_offset != 0)
         {
@@ -230,14 +291,129 @@ namespace gr {
       }
     }
 
+    void
+    controller_cc_impl::delay_until_settled(int noutput_items,
+                                            const gr_complex *in,
+                                            WorkState& st)
+    /* Skip samples until the window statistics settle, bounded by
+     * nskip_min and nskip_tune */
+    {
+      // the initial sample delay after usrp initialization is not adaptive
+      const size_t nskip_tune = current_segment().nskip_tune;
+      size_t nskip_fixed = d_nskip_total - nskip_tune;
+      size_t nskip_min = nskip_fixed + std::min(d_nskip_min, nskip_tune);
+      size_t skips_left = d_nskip_total - d_nskipped;
+
+      if (skips_left == 0 || (d_settled && d_nskipped >= nskip_min))
+      {
+        st.done = false;
+        st.state = ST_COPY;
+        return;
+      }
+
+      size_t nskip_this_time = std::min((size_t)noutput_items, skips_left);
+      if (d_nskipped < nskip_fixed)
+        nskip_this_time = std::min(nskip_this_time, nskip_fixed - d_nskipped);
+      else if (d_settled)
+        nskip_this_time = std::min(nskip_this_time, nskip_min - d_nskipped);
+      else
+        nskip_this_time = update_settle_detector(in, nskip_this_time);
+
+      d_nskipped += nskip_this_time;
+
+      st.nconsume = nskip_this_time;
+      st.retval = 0;
+      st.done = true;
+    }
+
+    size_t
+    controller_cc_impl::update_settle_detector(const gr_complex *in, size_t n)
+    /* Accumulate window statistics over up to n samples, stopping early at
+     * the sample where the signal is declared settled. Returns the number
+     * of samples examined. */
+    {
+      size_t i = 0;
+      while (i < n && !d_settled)
+      {
+        size_t nwin = std::min(n - i, d_settle_window - d_win_n);
+
+        gr_complex power;
+        volk_32fc_x2_conjugate_dot_prod_32fc(&power, in + i, in + i, nwin);
+        d_win_power += power.real();
+        d_win_dc = std::accumulate(in + i, in + i + nwin, d_win_dc);
+
+        d_win_n += nwin;
+        i += nwin;
+
+        if (d_win_n < d_settle_window)
+          break;
+
+        double mean_power = d_win_power / d_win_n;
+        gr_complex mean_dc = d_win_dc / (float)d_win_n;
+
+        if (d_have_prev)
+        {
+          // guard log10 against windows of all zeros
+          double power_change = 10 * std::log10((mean_power + 1e-30) /
+                                                (d_prev_power + 1e-30));
+          double rms = std::sqrt(std::max(mean_power, d_prev_power));
+          double dc_limit = (std::pow(10.0, d_settle_tolerance / 20) - 1) * rms;
+
+          bool agree = (std::abs(power_change) <= d_settle_tolerance &&
+                        std::abs(mean_dc - d_prev_dc) <= dc_limit);
+          d_nagree = agree ? d_nagree + 1 : 0;
+        }
+
+        d_prev_power = mean_power;
+        d_prev_dc = mean_dc;
+        d_have_prev = true;
+        d_win_n = 0;
+        d_win_power = 0.0;
+        d_win_dc = gr_complex(0, 0);
+
+        d_settled = d_nagree >= 2;
+      }
+
+      return i;
+    }
+
+    void
+    controller_cc_impl::reset_settle_detector()
+    {
+      d_win_n = 0;
+      d_win_power = 0.0;
+      d_win_dc = gr_complex(0, 0);
+      d_prev_power = 0.0;
+      d_prev_dc = gr_complex(0, 0);
+      d_have_prev = false;
+      d_nagree = 0;
+      d_settled = false;
+    }
+
     void
     controller_cc_impl::copy_samples(int noutput_items,
                                      gr_vector_const_void_star &in,
                                      gr_vector_void_star &out,
                                      WorkState& st)
     {
+      if (d_ncopied == 0)
+        tag_segment_start();
+
       // copy samples
-      size_t ncopy_this_time = std::min((size_t)noutput_items, d_ncopy - d_ncopied);
+      const size_t ncopy = current_segment().ncopy;
+      size_t ncopy_this_time = std::min((size_t)noutput_items, ncopy - d_ncopied);
+
+      // samples were dropped, so copy this segment again from the gap
+      size_t ngood = nsamples_before_gap(ncopy_this_time);
+      if (ngood == 0)
+      {
+        d_ncopied = 0;
+        d_retries++;
+        d_nretries++;
+        st.done = false;
+        return;
+      }
+      ncopy_this_time = ngood;
 
       memcpy(out[0],
              in[0],
@@ -245,30 +421,37 @@ namespace gr {
 
       d_ncopied += ncopy_this_time;
 
-      bool done_copying = d_ncopied == d_ncopy;
+      bool done_copying = d_ncopied == ncopy;
       bool last_segment = d_current_segment == d_nsegments;
 
       // retune and advance to next segment or set exit_flowgraph
       if (done_copying)
       {
-        d_ncopied = 0;
+        message_port_pub(d_segment_port, d_segment_info);
 
+        d_ncopied = 0;
+        d_retries = 0;
+        d_current_segment = last_segment ? 1 : d_current_segment + 1;
         if (last_segment)
         {
-          d_current_segment = 1;
+          d_span++;
+          if (d_order_stale)
+            update_order();
+          else if (d_lo_band_order)
+            std::reverse(d_order.begin(), d_order.end());
         }
 
         if (last_segment && d_exit_after_complete)
         {
           st.state = ST_EXIT;
         }
-        else if (d_retune)
+        else if (apply_pending_freqs() || d_retune)
         {
           set_next_fc();
           tune_usrp();
           d_nskipped = 0;
-          ++d_current_segment;
-          d_nskip_total = d_nskip_tune; // don't redo initial sample delay
+          // don't redo initial sample delay
+          d_nskip_total = current_segment().nskip_tune;
           st.state = ST_WAIT_RX_FREQ;
         }
       }
@@ -278,34 +461,376 @@ namespace gr {
       st.done = true;
     }
 
+    void
+    controller_cc_impl::tag_segment_start()
+    /* Tag the first sample of a segment with its index in the span, how it
+     * was tuned and when it was received */
+    {
+      const uint64_t offset = nitems_read(0);
+      const Segment &seg = current_segment();
+
+      pmt::pmt_t value = pmt::make_dict();
+      value = pmt::dict_add(value,
+                            pmt::intern("index"),
+                            pmt::from_uint64(current_index()));
+      value = pmt::dict_add(value,
+                            pmt::intern("span"),
+                            pmt::from_uint64(d_span));
+      value = pmt::dict_add(value,
+                            pmt::intern("nskip"),
+                            pmt::from_uint64(d_nskipped));
+      value = pmt::dict_add(value,
+                            pmt::intern("ncopy"),
+                            pmt::from_uint64(seg.ncopy));
+      value = pmt::dict_add(value,
+                            pmt::intern("retries"),
+                            pmt::from_uint64(d_retries));
+      value = pmt::dict_add(value,
+                            pmt::intern("freq"),
+                            pmt::from_double(seg.freq));
+      value = pmt::dict_add(value,
+                            pmt::intern("rx_freq"),
+                            pmt::from_double(d_rx_freq));
+      value = pmt::dict_add(value,
+                            pmt::intern("integer_n"),
+                            pmt::from_bool(d_integer_n));
+      if (d_set_gain)
+        value = pmt::dict_add(value,
+                              pmt::intern("gain"),
+                              pmt::from_double(seg.gain));
+
+      if (usrp_ptr)
+      {
+        value = pmt::dict_add(value,
+                              pmt::intern("rf_freq"),
+                              pmt::from_double(d_tune_result.actual_rf_freq));
+        value = pmt::dict_add(value,
+                              pmt::intern("dsp_freq"),
+                              pmt::from_double(d_tune_result.actual_dsp_freq));
+      }
+
+      // an rx_time tag may sit on this very sample
+      read_time_tags(offset, offset + 1);
+      if (d_have_time && d_samp_rate > 0)
+      {
+        double t = d_time_secs + (offset - d_time_offset) / d_samp_rate;
+        double full_secs = std::floor(t);
+        value = pmt::dict_add(value,
+                              d_time_key,
+                              pmt::make_tuple(pmt::from_uint64((uint64_t)full_secs),
+                                              pmt::from_double(t - full_secs)));
+      }
+
+      this->add_item_tag(0, this->nitems_written(0), d_segment_key, value);
+
+      d_segment_info = pmt::dict_add(value,
+                                     pmt::intern("offset"),
+                                     pmt::from_uint64(this->nitems_written(0)));
+    }
+
+    void
+    controller_cc_impl::handle_freqs(pmt::pmt_t msg)
+    /* Queue a new list of center frequencies, or a single one to hop to */
+    {
+      std::vector<double> freqs;
+
+      if (pmt::is_f64vector(msg))
+      {
+        freqs = pmt::f64vector_elements(msg);
+      }
+      else if (pmt::is_number(msg))
+      {
+        freqs.push_back(pmt::to_double(msg));
+      }
+      else if (pmt::is_pair(msg))
+      {
+        for (size_t i = 0; i < pmt::length(msg); ++i)
+        {
+          pmt::pmt_t freq = pmt::nth(i, msg);
+          if (!pmt::is_number(freq))
+            return;
+          freqs.push_back(pmt::to_double(freq));
+        }
+      }
+
+      if (freqs.empty())
+        return;
+
+      d_pending_freqs = freqs;
+      d_have_pending_freqs = true;
+    }
+
+    bool
+    controller_cc_impl::apply_pending_freqs()
+    /* Start sweeping queued center frequencies, if any. Returns true if the
+     * schedule was replaced */
+    {
+      if (!d_have_pending_freqs)
+        return false;
+
+      d_have_pending_freqs = false;
+      set_center_freqs(d_pending_freqs);
+      return true;
+    }
+
+    void
+    controller_cc_impl::read_time_tags(uint64_t start, uint64_t stop)
+    /* Keep the most recent rx_time/rx_rate up to date */
+    {
+      get_tags_in_range(d_tags, 0, start, stop, d_rate_key);
+      if (!d_tags.empty())
+        d_samp_rate = pmt::to_double(d_tags.back().value);
+
+      get_tags_in_range(d_tags, 0, start, stop, d_time_key);
+      if (!d_tags.empty())
+      {
+        const pmt::pmt_t &value = d_tags.back().value;
+        d_time_offset = d_tags.back().offset;
+        d_time_secs = pmt::to_uint64(pmt::tuple_ref(value, 0)) +
+                      pmt::to_double(pmt::tuple_ref(value, 1));
+        d_time_value = value;
+        d_have_time = true;
+      }
+    }
+
+    size_t
+    controller_cc_impl::nsamples_before_gap(size_t n)
+    /* Return how many of the next n samples precede an rx_time tag that
+     * does not follow on from the last one, i.e. samples were dropped, or
+     * n if there is no such tag */
+    {
+      const uint64_t start = nitems_read(0);
+      // the first sample of a segment may carry the time it starts at
+      const uint64_t from = d_ncopied == 0 ? start + 1 : start;
+
+      get_tags_in_range(d_tags, 0, from, start + n, d_time_key);
+      for (size_t i = 0; i < d_tags.size(); ++i)
+      {
+        if (d_have_time && d_samp_rate > 0)
+        {
+          // compare whole and fractional seconds apart, as the absolute
+          // time in a double is too coarse for one sample at high rates
+          const pmt::pmt_t &value = d_tags[i].value;
+          double elapsed =
+            (double)pmt::to_uint64(pmt::tuple_ref(value, 0)) -
+            (double)pmt::to_uint64(pmt::tuple_ref(d_time_value, 0)) +
+            pmt::to_double(pmt::tuple_ref(value, 1)) -
+            pmt::to_double(pmt::tuple_ref(d_time_value, 1));
+          double nsamples = (double)(d_tags[i].offset - d_time_offset);
+          if (std::abs(elapsed * d_samp_rate - nsamples) < 0.5)
+            continue;
+        }
+        return d_tags[i].offset - start;
+      }
+      return n;
+    }
+
     void
     controller_cc_impl::reset()
     {
+      // a span abandoned part way is not continued by the next segment
+      if (d_current_segment != 1 || d_ncopied > 0)
+        d_span++;
+
       d_current_segment = 1;
       d_nskipped = 0;
       d_ncopied = 0;
-      d_nskip_total = d_nskip_init + d_nskip_tune;
-      if (d_retune)
-      {
-        d_cfreqs_iter = std::deque<double>(d_cfreqs_orig.begin(), d_cfreqs_orig.end());
-      }
+      d_retries = 0;
+      d_nskip_total = d_nskip_init + current_segment().nskip_tune;
+      reset_settle_detector();
     }
 
     void
     controller_cc_impl::tune_usrp()
     {
-      ::uhd::tune_request_t tune_req(d_current_freq, d_lo_offset);
-      if (d_use_integer_tuning)
+      Segment &seg = d_schedule[current_index()];
+      bool integer_n = use_integer_tuning(seg);
+
+      if (!usrp_ptr)
+      {
+        // No usrp, ask whoever is listening to tune
+        pmt::pmt_t cmd = pmt::make_dict();
+        cmd = pmt::dict_add(cmd, pmt::intern("freq"), pmt::from_double(d_current_freq));
+        cmd = pmt::dict_add(cmd, pmt::intern("lo_offset"), pmt::from_double(seg.lo_offset));
+        if (d_set_gain)
+          cmd = pmt::dict_add(cmd, pmt::intern("gain"), pmt::from_double(seg.gain));
+        if (integer_n)
+          cmd = pmt::dict_add(cmd, pmt::intern("args"), pmt::intern("mode_n=integer"));
+        message_port_pub(d_command_port, cmd);
+        d_integer_n = integer_n;
+        return;
+      }
+
+      if (d_set_gain)
+        usrp_ptr->set_gain(seg.gain);
+
+      d_tune_result = tune(seg, integer_n);
+
+      if (d_auto_integer_tuning && seg.integer_n < 0)
+      {
+        // First time for this segment, keep integer-N only if accurate
+        double lo_error = d_tune_result.actual_rf_freq - d_tune_result.target_rf_freq;
+        if (integer_n && std::abs(lo_error) > d_integer_n_tolerance)
+        {
+          integer_n = false;
+          d_tune_result = tune(seg, integer_n);
+        }
+        seg.integer_n = integer_n;
+      }
+      d_integer_n = integer_n;
+    }
+
+    bool
+    controller_cc_impl::use_integer_tuning(Segment &seg)
+    /* Return true if seg should be tuned integer-N (to be checked against
+     * the tune result if undecided and there is a usrp) */
+    {
+      if (!d_auto_integer_tuning)
+        return d_use_integer_tuning;
+
+      if (seg.integer_n >= 0)
+        return seg.integer_n;
+
+      if (!usrp_ptr)
+      {
+        // predict the LO error on the integer-N grid
+        double lo_freq = seg.freq + seg.lo_offset;
+        double lo_error = lo_freq - std::floor(lo_freq / d_integer_n_step + 0.5) * d_integer_n_step;
+        seg.integer_n = std::abs(lo_error) <= d_integer_n_tolerance;
+        return seg.integer_n;
+      }
+
+      return true;
+    }
+
+    ::uhd::tune_result_t
+    controller_cc_impl::tune(const Segment &seg, bool integer_n)
+    {
+      ::uhd::tune_request_t tune_req(d_current_freq, seg.lo_offset);
+      if (integer_n)
         tune_req.args = ::uhd::device_addr_t("mode_n=integer");
-      d_tune_result = usrp_ptr->set_center_freq(tune_req);
+      return usrp_ptr->set_center_freq(tune_req);
+    }
+
+    double
+    controller_cc_impl::expected_rx_freq()
+    {
+      if (!usrp_ptr)
+        return d_current_freq;
+
+      // For some reason rx_freq's value is not part of tune_result_t
+      return d_tune_result.actual_rf_freq - d_tune_result.actual_dsp_freq;
     }
 
     void
     controller_cc_impl::set_next_fc()
     {
-      d_current_freq = d_cfreqs_iter.front();
-      d_cfreqs_iter.pop_front();
-      d_cfreqs_iter.push_back(d_current_freq);
+      d_current_freq = current_segment().freq;
+    }
+
+    const Segment&
+    controller_cc_impl::current_segment() const
+    {
+      return d_schedule[current_index()];
+    }
+
+    size_t
+    controller_cc_impl::current_index() const
+    /* Index in center_freqs of the segment being swept */
+    {
+      return d_order[d_current_segment - 1];
+    }
+
+    void
+    controller_cc_impl::update_order()
+    /* Sweep in schedule order, or by LO band then LO frequency */
+    {
+      d_order_stale = false;
+      d_order.resize(d_schedule.size());
+      for (size_t i = 0; i < d_order.size(); ++i)
+        d_order[i] = i;
+
+      if (!d_lo_band_order)
+        return;
+
+      std::vector<std::pair<std::pair<size_t, double>, size_t> > keys;
+      for (size_t i = 0; i < d_schedule.size(); ++i)
+      {
+        double lo_freq = d_schedule[i].freq + d_schedule[i].lo_offset;
+        size_t band = std::upper_bound(d_lo_band_edges.begin(),
+                                       d_lo_band_edges.end(),
+                                       lo_freq) - d_lo_band_edges.begin();
+        keys.push_back(std::make_pair(std::make_pair(band, lo_freq), i));
+      }
+      std::stable_sort(keys.begin(), keys.end());
+
+      for (size_t i = 0; i < keys.size(); ++i)
+        d_order[i] = keys[i].second;
+    }
+
+    void
+    controller_cc_impl::set_center_freqs(const std::vector<double> &center_freqs)
+    {
+      set_schedule(center_freqs,
+                   std::vector<size_t>(),
+                   std::vector<size_t>(),
+                   std::vector<double>(),
+                   std::vector<double>());
+    }
+
+    void
+    controller_cc_impl::set_schedule(const std::vector<double> &center_freqs,
+                                     const std::vector<size_t> &nskip_tune,
+                                     const std::vector<size_t> &ncopy,
+                                     const std::vector<double> &gains,
+                                     const std::vector<double> &lo_offsets)
+    {
+      assert(!center_freqs.empty());
+
+      const size_t n = center_freqs.size();
+      if ((!nskip_tune.empty() && nskip_tune.size() != n) ||
+          (!ncopy.empty() && ncopy.size() != n) ||
+          (!gains.empty() && gains.size() != n) ||
+          (!lo_offsets.empty() && lo_offsets.size() != n))
+        throw std::invalid_argument("controller_cc: schedule vectors must "
+                                    "be empty or match center_freqs");
+
+      d_schedule.resize(n);
+      for (size_t i = 0; i < n; ++i)
+      {
+        Segment &seg = d_schedule[i];
+        seg.freq = center_freqs[i];
+        seg.nskip_tune = nskip_tune.empty() ? d_nskip_tune : nskip_tune[i];
+        seg.ncopy = ncopy.empty() ? d_ncopy : ncopy[i];
+        seg.gain = gains.empty() ? 0.0 : gains[i];
+        seg.lo_offset = lo_offsets.empty() ? d_lo_offset : lo_offsets[i];
+        seg.integer_n = -1;
+
+        if (seg.ncopy == 0)
+          throw std::invalid_argument("controller_cc: ncopy must be > 0");
+      }
+      d_set_gain = !gains.empty();
+
+      d_cfreqs_orig = center_freqs;
+      d_nsegments = n;
+      d_retune = d_nsegments > 1;
+      update_order();
+      reset();
+      st.state = ST_INIT_TUNE;
+    }
+
+    std::vector<double>
+    controller_cc_impl::center_freqs() const
+    {
+      return d_cfreqs_orig;
+    }
+
+    void
+    controller_cc_impl::set_nskip_init(size_t nskip_init)
+    {
+      d_nskip_init = nskip_init;
+      if (st.state == ST_INIT_TUNE)
+        d_nskip_total = d_nskip_init + current_segment().nskip_tune;
     }
 
     bool
@@ -326,5 +851,123 @@ namespace gr {
       d_verify_tag_freq = false;
     }
 
+    void
+    controller_cc_impl::set_tag_freq_tolerance(double tolerance)
+    {
+      d_tag_freq_tolerance = tolerance;
+    }
+
+    double
+    controller_cc_impl::tag_freq_tolerance() const
+    {
+      return d_tag_freq_tolerance;
+    }
+
+    void
+    controller_cc_impl::set_samp_rate(double samp_rate)
+    {
+      d_samp_rate = samp_rate;
+    }
+
+    double
+    controller_cc_impl::samp_rate() const
+    {
+      return d_samp_rate;
+    }
+
+    void
+    controller_cc_impl::set_adaptive_settle(size_t window,
+                                            double tolerance_db,
+                                            size_t nskip_min)
+    {
+      if (window == 0)
+        throw std::invalid_argument("controller_cc: settle window must be > 0");
+      if (tolerance_db <= 0)
+        throw std::invalid_argument("controller_cc: settle tolerance must be > 0");
+
+      d_settle_window = window;
+      d_settle_tolerance = tolerance_db;
+      d_nskip_min = nskip_min;
+      d_adaptive_settle = true;
+      reset_settle_detector();
+    }
+
+    void
+    controller_cc_impl::disable_adaptive_settle()
+    {
+      d_adaptive_settle = false;
+    }
+
+    void
+    controller_cc_impl::set_lo_band_order(const std::vector<double> &edges)
+    {
+      d_lo_band_edges = edges;
+      std::sort(d_lo_band_edges.begin(), d_lo_band_edges.end());
+      d_lo_band_order = true;
+
+      // Changing the order mid-span would skip or repeat segments
+      if (st.state == ST_INIT_TUNE)
+        update_order();
+      else
+        d_order_stale = true;
+    }
+
+    void
+    controller_cc_impl::disable_lo_band_order()
+    {
+      d_lo_band_order = false;
+      if (st.state == ST_INIT_TUNE)
+        update_order();
+      else
+        d_order_stale = true;
+    }
+
+    bool
+    controller_cc_impl::lo_band_order() const
+    {
+      return d_lo_band_order;
+    }
+
+    void
+    controller_cc_impl::set_auto_integer_tuning(double tolerance, double lo_step)
+    {
+      if (tolerance < 0)
+        throw std::invalid_argument("controller_cc: integer-N tolerance must be >= 0");
+      if (!usrp_ptr && lo_step <= 0)
+        throw std::invalid_argument("controller_cc: lo_step must be > 0 without a usrp");
+
+      d_integer_n_tolerance = tolerance;
+      d_integer_n_step = lo_step;
+      d_auto_integer_tuning = true;
+
+      // decide every segment again with the new tolerance
+      for (size_t i = 0; i < d_schedule.size(); ++i)
+        d_schedule[i].integer_n = -1;
+    }
+
+    void
+    controller_cc_impl::disable_auto_integer_tuning()
+    {
+      d_auto_integer_tuning = false;
+    }
+
+    bool
+    controller_cc_impl::auto_integer_tuning() const
+    {
+      return d_auto_integer_tuning;
+    }
+
+    bool
+    controller_cc_impl::adaptive_settle() const
+    {
+      return d_adaptive_settle;
+    }
+
+    uint64_t
+    controller_cc_impl::nretries() const
+    {
+      return d_nretries;
+    }
+
   } /* namespace usrpcalibrator */
 } /* namespace gr */
@@ -21,7 +21,6 @@
 #ifndef INCLUDED_USRPCALIBRATOR_CONTROLLER_CC_IMPL_H
 #define INCLUDED_USRPCALIBRATOR_CONTROLLER_CC_IMPL_H
 
-#include <deque>
 #include <vector>
 
 #include <pmt/pmt.h>
@@ -49,6 +48,16 @@ namespace gr {
       int retval;
     };
 
+    struct Segment
+    {
+      double freq;
+      size_t nskip_tune;          // samples to skip after rx_freq tag/before copy
+      size_t ncopy;               // samples to copy
+      double gain;                // only applied if d_set_gain
+      double lo_offset;
+      int integer_n;              // -1 undecided, else 1 if tuned integer-N
+    };
+
     class controller_cc_impl : public controller_cc
     {
     private:
@@ -56,42 +65,108 @@ namespace gr {
       pmt::pmt_t d_tag_key;
       std::vector<gr::tag_t> d_tags;
 
+      // used for tagging the first sample of each segment
+      pmt::pmt_t d_segment_key;
+
+      // used for time stamping segments
+      pmt::pmt_t d_time_key;
+      pmt::pmt_t d_rate_key;
+      bool d_have_time;           // an rx_time tag has been seen
+      uint64_t d_time_offset;     // offset of the last rx_time tag
+      double d_time_secs;         // its device time
+      pmt::pmt_t d_time_value;    // its value, for exact continuity checks
+      double d_samp_rate;         // from rx_rate or set_samp_rate, 0 if unknown
+      double d_rx_freq;           // value of this segment's rx_freq tag
+
+      // used for publishing tune commands when there is no usrp
+      pmt::pmt_t d_command_port;
+
+      // used for changing center freqs and reporting segments at runtime
+      pmt::pmt_t d_freqs_port;
+      pmt::pmt_t d_segment_port;
+      std::vector<double> d_pending_freqs; // applied at next segment boundary
+      bool d_have_pending_freqs;
+      pmt::pmt_t d_segment_info;  // dict reported when the segment completes
+
       // used for skipping samples
       size_t d_nskip_init;        // samples to skip after usrp initialization
-      size_t d_nskip_tune;        // samples to skip after rx_freq tag/before copy
+      size_t d_nskip_tune;        // default samples to skip after rx_freq tag
       size_t d_nskip_total;       // total samples to skip
       size_t d_nskipped;          // total samples skipped so far this segment
 
+      // used for adaptive settle detection
+      bool d_adaptive_settle;     // if true, stop skipping once settled
+      size_t d_settle_window;     // samples per statistics window
+      double d_settle_tolerance;  // dB, allowed change between windows
+      size_t d_nskip_min;         // samples to skip at least after rx_freq tag
+      size_t d_win_n;             // samples accumulated in current window
+      double d_win_power;         // running sum of |x|^2 in current window
+      gr_complex d_win_dc;        // running sum of x in current window
+      double d_prev_power;        // mean power of previous window
+      gr_complex d_prev_dc;       // mean of previous window
+      bool d_have_prev;           // true once a window has completed
+      size_t d_nagree;            // successive windows agreeing so far
+      bool d_settled;             // true once the signal has settled
+
       // used for copying
-      size_t d_ncopy;             // samples to copy per segment
+      size_t d_ncopy;             // default samples to copy per segment
       size_t d_ncopied;           // total samples copied so far this segment
+      size_t d_retries;           // times this segment was re-acquired
+      uint64_t d_nretries;        // re-acquisitions since the block was made
 
       // used for general flow control
       boost::shared_ptr<gr::uhd::usrp_source> usrp_ptr;      // USRP source pointer
       ::uhd::tune_result_t d_tune_result;
       std::vector<double> d_cfreqs_orig;
-      std::deque<double> d_cfreqs_iter;
+      std::vector<Segment> d_schedule;
+      std::vector<size_t> d_order;  // schedule indices in sweep order
+      bool d_lo_band_order;         // if true, sort d_order by LO band
+      std::vector<double> d_lo_band_edges; // sorted LO band edges
+      bool d_order_stale;           // if true, update d_order at next span
       size_t d_nsegments;         // number of center frequencies in span
       size_t d_current_segment;   // incremented from 1 to nsegments
-      double d_lo_offset;
+      uint64_t d_span;            // spans completed since the block was made
+      double d_lo_offset;         // default LO offset
+      bool d_set_gain;            // if true, set each segment's gain
       double d_current_freq;      // holds return fc
       bool d_retune;              // convenience variable for "nsegments > 1"
       bool d_exit_after_complete; // if true, exit at end of span
 
       bool d_use_integer_tuning;  // if true, use integerN tuning
+      bool d_auto_integer_tuning; // if true, choose integerN per segment
+      double d_integer_n_tolerance; // Hz, allowed integerN LO error
+      double d_integer_n_step;    // Hz, integerN LO grid without a usrp
+      bool d_integer_n;           // mode the current segment was tuned with
 
       bool d_verify_tag_freq;     // if true, verify rx_freq's value is correct
+      double d_tag_freq_tolerance; // Hz, allowed rx_freq error
 
       WorkState st;
 
       void reset();               // helper function called at end of span
       void tune_usrp();
+      bool use_integer_tuning(Segment &seg);
+      ::uhd::tune_result_t tune(const Segment &seg, bool integer_n);
+      double expected_rx_freq();
       void set_next_fc();
+      const Segment& current_segment() const;
+      size_t current_index() const;
+      void update_order();
+      void tag_segment_start();
+      void read_time_tags(uint64_t start, uint64_t stop);
+      size_t nsamples_before_gap(size_t n);
+      void handle_freqs(pmt::pmt_t msg);
+      bool apply_pending_freqs();
+      void reset_settle_detector();
+      size_t update_settle_detector(const gr_complex *in, size_t n);
 
       void exit_flowgraph(WorkState& st);
       void tune_initial_fc(int& noutput_items, WorkState& st);
       void delay_for_rx_freq(int ninput_items, WorkState& st);
       void delay_for_usrp_tune(int noutput_items, WorkState& st);
+      void delay_until_settled(int noutput_items,
+                               const gr_complex *in,
+                               WorkState& st);
 
       void copy_samples(int noutput_items,
                         gr_vector_const_void_star &in,
@@ -99,7 +174,7 @@ namespace gr {
                         WorkState& st);
 
     public:
-      controller_cc_impl(boost::shared_ptr<gr::uhd::usrp_source> &usrp,
+      controller_cc_impl(const boost::shared_ptr<gr::uhd::usrp_source> &usrp,
                          std::vector<double> center_freqs,
                          double lo_offset,
                          size_t nskip_init,
@@ -115,10 +190,33 @@ namespace gr {
                        gr_vector_const_void_star &input_items,
                        gr_vector_void_star &output_items);
 
-      void reset_initial_delay();
       bool exit_after_complete();
       void set_exit_after_complete(bool exit_after_complete);
+      void set_center_freqs(const std::vector<double> &center_freqs);
+      std::vector<double> center_freqs() const;
+      void set_schedule(const std::vector<double> &center_freqs,
+                        const std::vector<size_t> &nskip_tune,
+                        const std::vector<size_t> &ncopy,
+                        const std::vector<double> &gains,
+                        const std::vector<double> &lo_offsets);
+      void set_nskip_init(size_t nskip_init);
       void disable_verify_tag_freq();
+      void set_tag_freq_tolerance(double tolerance);
+      double tag_freq_tolerance() const;
+      void set_samp_rate(double samp_rate);
+      double samp_rate() const;
+      void set_adaptive_settle(size_t window,
+                               double tolerance_db,
+                               size_t nskip_min);
+      void disable_adaptive_settle();
+      void set_lo_band_order(const std::vector<double> &edges);
+      void disable_lo_band_order();
+      bool lo_band_order() const;
+      bool adaptive_settle() const;
+      uint64_t nretries() const;
+      void set_auto_integer_tuning(double tolerance, double lo_step);
+      void disable_auto_integer_tuning();
+      bool auto_integer_tuning() const;
     };
 
   } // namespace usrpcalibrator
@@ -0,0 +1,226 @@
+/* -*- c++ -*- */
+/*
+ * Copyright 2016 Douglas Anderson
+ *
+ * This is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 3, or (at your option)
+ * any later version.
+ *
+ * This software is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this software; see the file COPYING.  If not, write to
+ * the Free Software Foundation, Inc., 51 Franklin Street,
+ * Boston, MA 02110-1301, USA.
+ */
+
+#ifdef HAVE_CONFIG_H
+#include "config.h"
+#endif
+
+#include <algorithm> /* min */
+#include <cmath>     /* log10 */
+#include <limits>
+
+#include <gnuradio/io_signature.h>
+#include <volk/volk.h>
+#include "mean_power_cf_impl.h"
+
+namespace gr {
+  namespace usrpcalibrator {
+
+    mean_power_cf::sptr
+    mean_power_cf::make()
+    {
+      return gnuradio::get_initial_sptr
+        (new mean_power_cf_impl());
+    }
+
+    /*
+     * The private constructor
+     */
+    mean_power_cf_impl::mean_power_cf_impl()
+      : gr::sync_block("mean_power_cf",
+                       gr::io_signature::make(1, 1, sizeof(gr_complex)),
+                       gr::io_signature::make(0, 0, 0)),
+        d_armed(false), d_done(false),
+        d_nskip_left(0), d_nintegrate(0), d_nintegrate_left(0),
+        d_first_offset(0), d_accum(0),
+        d_power_dbm(std::numeric_limits<double>::quiet_NaN()),
+        d_have_time(false), d_time_offset(0), d_time_secs(0), d_samp_rate(0),
+        d_timed(false), d_start_time(0), d_late(false)
+    {
+      d_power_port = pmt::intern("power");
+      message_port_register_out(d_power_port);
+
+      d_time_key = pmt::intern("rx_time");
+      d_rate_key = pmt::intern("rx_rate");
+
+      const int alignment_multiple = volk_get_alignment() / sizeof(gr_complex);
+      set_alignment(std::max(1, alignment_multiple));
+    }
+
+    /*
+     * Our virtual destructor.
+     */
+    mean_power_cf_impl::~mean_power_cf_impl()
+    {
+    }
+
+    void
+    mean_power_cf_impl::arm(uint64_t nskip, uint64_t nintegrate)
+    {
+      gr::thread::scoped_lock lock(d_mutex);
+      start_measurement(nskip, nintegrate);
+    }
+
+    void
+    mean_power_cf_impl::arm_at_time(double time_secs, uint64_t nintegrate)
+    {
+      gr::thread::scoped_lock lock(d_mutex);
+      start_measurement(0, nintegrate);
+      d_timed = d_armed;
+      d_start_time = time_secs;
+    }
+
+    void
+    mean_power_cf_impl::start_measurement(uint64_t nskip, uint64_t nintegrate)
+    /* Caller must hold d_mutex */
+    {
+      d_nskip_left = nskip;
+      d_nintegrate = nintegrate;
+      d_nintegrate_left = nintegrate;
+      d_accum = 0;
+      d_done = false;
+      d_timed = false;
+      d_late = false;
+      d_armed = nintegrate > 0;
+    }
+
+    void
+    mean_power_cf_impl::read_time_tags(int ninput_items)
+    /* Keep the most recent rx_time/rx_rate up to date */
+    {
+      const uint64_t start = nitems_read(0);
+
+      get_tags_in_range(d_tags, 0, start, start + ninput_items, d_rate_key);
+      if (!d_tags.empty())
+        d_samp_rate = pmt::to_double(d_tags.back().value);
+
+      get_tags_in_range(d_tags, 0, start, start + ninput_items, d_time_key);
+      if (!d_tags.empty())
+      {
+        const pmt::pmt_t &value = d_tags.back().value;
+        d_time_offset = d_tags.back().offset;
+        d_time_secs = pmt::to_uint64(pmt::tuple_ref(value, 0)) +
+                      pmt::to_double(pmt::tuple_ref(value, 1));
+        d_have_time = true;
+      }
+    }
+
+    bool
+    mean_power_cf_impl::locate_start_time()
+    /* Turn d_start_time into samples to skip, false if not yet possible */
+    {
+      if (!d_have_time || d_samp_rate <= 0)
+        return false;
+
+      const double dt = d_start_time - d_time_secs;
+      const int64_t start_offset = d_time_offset + (int64_t)(dt * d_samp_rate + 0.5);
+      const int64_t now = nitems_read(0);
+
+      d_late = start_offset < now;
+      d_nskip_left = d_late ? 0 : start_offset - now;
+      d_timed = false;
+      return true;
+    }
+
+    bool
+    mean_power_cf_impl::done() const
+    {
+      gr::thread::scoped_lock lock(d_mutex);
+      return d_done;
+    }
+
+    double
+    mean_power_cf_impl::power_dbm() const
+    {
+      gr::thread::scoped_lock lock(d_mutex);
+      return d_power_dbm;
+    }
+
+    bool
+    mean_power_cf_impl::late() const
+    {
+      gr::thread::scoped_lock lock(d_mutex);
+      return d_late;
+    }
+
+    void
+    mean_power_cf_impl::finish()
+    /* Convert the accumulated power to dBm and publish it */
+    {
+      const double mean_power = d_accum / d_nintegrate;
+      d_power_dbm = 30 + 10 * std::log10(mean_power / 50);
+      d_armed = false;
+      d_done = true;
+
+      pmt::pmt_t msg = pmt::make_dict();
+      msg = pmt::dict_add(msg, pmt::intern("power_dbm"), pmt::from_double(d_power_dbm));
+      msg = pmt::dict_add(msg, pmt::intern("nsamples"), pmt::from_uint64(d_nintegrate));
+      msg = pmt::dict_add(msg, pmt::intern("offset"), pmt::from_uint64(d_first_offset));
+      msg = pmt::dict_add(msg, pmt::intern("late"), pmt::from_bool(d_late));
+      message_port_pub(d_power_port, msg);
+    }
+
+    int
+    mean_power_cf_impl::work(int noutput_items,
+                             gr_vector_const_void_star &input_items,
+                             gr_vector_void_star &output_items)
+    {
+      const gr_complex *in = (const gr_complex *) input_items[0];
+
+      gr::thread::scoped_lock lock(d_mutex);
+
+      read_time_tags(noutput_items);
+
+      if (!d_armed)
+        return noutput_items;  // discard
+
+      if (d_timed && !locate_start_time())
+        return noutput_items;  // device time unknown, keep waiting
+
+      uint64_t nskip = std::min((uint64_t)noutput_items, d_nskip_left);
+      d_nskip_left -= nskip;
+
+      uint64_t navailable = noutput_items - nskip;
+      if (d_nskip_left == 0 && navailable > 0)
+      {
+        if (d_nintegrate_left == d_nintegrate)
+          d_first_offset = nitems_read(0) + nskip;
+
+        uint64_t nintegrate = std::min(navailable, d_nintegrate_left);
+
+        // sum(x * conj(x)) = sum(|x|^2)
+        gr_complex sum_mag_sq;
+        volk_32fc_x2_conjugate_dot_prod_32fc(&sum_mag_sq,
+                                             &in[nskip],
+                                             &in[nskip],
+                                             nintegrate);
+        d_accum += sum_mag_sq.real();
+        d_nintegrate_left -= nintegrate;
+
+        if (d_nintegrate_left == 0)
+          finish();
+      }
+
+      // Tell runtime system how many output items we produced.
+      return noutput_items;
+    }
+
+  } /* namespace usrpcalibrator */
+} /* namespace gr */
@@ -0,0 +1,85 @@
+/* -*- c++ -*- */
+/*
+ * Copyright 2016 Douglas Anderson
+ *
+ * This is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 3, or (at your option)
+ * any later version.
+ *
+ * This software is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this software; see the file COPYING.  If not, write to
+ * the Free Software Foundation, Inc., 51 Franklin Street,
+ * Boston, MA 02110-1301, USA.
+ */
+
+#ifndef INCLUDED_USRPCALIBRATOR_MEAN_POWER_CF_IMPL_H
+#define INCLUDED_USRPCALIBRATOR_MEAN_POWER_CF_IMPL_H
+
+#include <vector>
+
+#include <gnuradio/thread/thread.h>
+#include <pmt/pmt.h>
+#include <usrpcalibrator/mean_power_cf.h>
+
+namespace gr {
+  namespace usrpcalibrator {
+
+    class mean_power_cf_impl : public mean_power_cf
+    {
+    private:
+      mutable gr::thread::mutex d_mutex;  // arm() is called from Python
+
+      pmt::pmt_t d_power_port;
+
+      // used for locating a device time in the stream
+      pmt::pmt_t d_time_key;
+      pmt::pmt_t d_rate_key;
+      std::vector<gr::tag_t> d_tags;
+      bool d_have_time;           // an rx_time tag has been seen
+      uint64_t d_time_offset;     // offset of the last rx_time tag
+      double d_time_secs;         // its device time
+      double d_samp_rate;         // from rx_rate, 0 until seen
+
+      bool d_timed;               // armed to start at d_start_time
+      double d_start_time;
+      bool d_late;                // started after d_start_time
+
+      bool d_armed;               // measurement in progress
+      bool d_done;                // measurement complete
+      uint64_t d_nskip_left;      // samples still to skip
+      uint64_t d_nintegrate;      // samples to integrate this measurement
+      uint64_t d_nintegrate_left; // samples still to integrate
+      uint64_t d_first_offset;    // offset of first integrated sample
+      double d_accum;             // sum of |x|^2 so far
+      double d_power_dbm;         // last completed measurement
+
+      void start_measurement(uint64_t nskip, uint64_t nintegrate);
+      void finish();
+      void read_time_tags(int ninput_items);
+      bool locate_start_time();
+
+    public:
+      mean_power_cf_impl();
+      ~mean_power_cf_impl();
+
+      void arm(uint64_t nskip, uint64_t nintegrate);
+      void arm_at_time(double time_secs, uint64_t nintegrate);
+      bool done() const;
+      double power_dbm() const;
+      bool late() const;
+
+      int work(int noutput_items,
+               gr_vector_const_void_star &input_items,
+               gr_vector_void_star &output_items);
+    };
+
+  } // namespace usrpcalibrator
+} // namespace gr
+
+#endif /* INCLUDED_USRPCALIBRATOR_MEAN_POWER_CF_IMPL_H */
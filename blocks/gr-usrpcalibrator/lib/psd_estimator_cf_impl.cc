@@ -0,0 +1,324 @@
+/* -*- c++ -*- */
+/*
+ * Copyright 2016 Douglas Anderson
+ *
+ * This is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 3, or (at your option)
+ * any later version.
+ *
+ * This software is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this software; see the file COPYING.  If not, write to
+ * the Free Software Foundation, Inc., 51 Franklin Street,
+ * Boston, MA 02110-1301, USA.
+ */
+
+#ifdef HAVE_CONFIG_H
+#include "config.h"
+#endif
+
+#include <algorithm> /* fill, max */
+#include <cassert>
+#include <cmath>     /* log10 */
+#include <stdexcept>
+
+#include <gnuradio/io_signature.h>
+#include <volk/volk.h>
+#include "psd_estimator_cf_impl.h"
+
+namespace gr {
+  namespace usrpcalibrator {
+
+    psd_estimator_cf::sptr
+    psd_estimator_cf::make(size_t fft_len,
+                           size_t naverages,
+                           const std::vector<float> &window,
+                           float scale_factor)
+    {
+      return gnuradio::get_initial_sptr
+        (new psd_estimator_cf_impl(fft_len, naverages, window, scale_factor));
+    }
+
+    /*
+     * The private constructor
+     */
+    psd_estimator_cf_impl::psd_estimator_cf_impl(size_t fft_len,
+                                                 size_t naverages,
+                                                 const std::vector<float> &window,
+                                                 float scale_factor)
+      : gr::block("psd_estimator_cf",
+                  gr::io_signature::make(1, 1, sizeof(gr_complex)),
+                  gr::io_signature::make(1, 3, fft_len * sizeof(float))),
+        d_fft_len(fft_len), d_naverages(naverages), d_navgd(0),
+        d_navg_target(naverages), d_have_reference_gain(false),
+        d_reference_gain(0)
+    {
+      assert(d_naverages > 0);
+
+      if (window.empty())
+        d_window = std::vector<float>(fft_len, 1.0);
+      else if (window.size() == fft_len)
+        d_window = window;
+      else
+        throw std::invalid_argument("psd_estimator_cf: window must be fft_len taps");
+
+      // Window power is taken before the scale factor is folded in
+      double window_pwr = 0;
+      for (size_t i = 0; i < fft_len; ++i)
+        window_pwr += d_window[i] * d_window[i];
+      window_pwr *= fft_len;
+
+      const double impedance = 50; // ohms
+      d_power_offset = 30 - 10 * std::log10(window_pwr * impedance);
+
+      for (size_t i = 0; i < fft_len; ++i)
+        d_window[i] *= scale_factor;
+
+      d_fft = new gr::fft::fft_complex(fft_len, true);
+
+      const size_t alignment = volk_get_alignment();
+      d_mag_sq = (float *) volk_malloc(fft_len * sizeof(float), alignment);
+      d_accum = (float *) volk_malloc(fft_len * sizeof(float), alignment);
+      d_accum_sq = (float *) volk_malloc(fft_len * sizeof(float), alignment);
+      d_max = (float *) volk_malloc(fft_len * sizeof(float), alignment);
+      discard_average();
+
+      set_relative_rate(1.0 / (fft_len * naverages));
+      set_tag_propagation_policy(TPP_DONT);
+      d_segment_key = pmt::intern("segment_start");
+    }
+
+    /*
+     * Our virtual destructor.
+     */
+    psd_estimator_cf_impl::~psd_estimator_cf_impl()
+    {
+      delete d_fft;
+      volk_free(d_mag_sq);
+      volk_free(d_accum);
+      volk_free(d_accum_sq);
+      volk_free(d_max);
+    }
+
+    void
+    psd_estimator_cf_impl::set_reference_gain(double gain)
+    {
+      gr::thread::scoped_lock lock(d_mutex);
+      d_reference_gain = gain;
+      d_have_reference_gain = true;
+    }
+
+    void
+    psd_estimator_cf_impl::forecast(int noutput_items,
+                                    gr_vector_int &ninput_items_required)
+    {
+      // Frames are accumulated across calls, so one frame is always enough
+      ninput_items_required[0] = d_fft_len;
+    }
+
+    void
+    psd_estimator_cf_impl::produce_average(gr_vector_void_star &output_items,
+                                           size_t nproduced)
+    /* Write the accumulated frames to item nproduced of each connected
+     * output and move their tags there */
+    {
+      const size_t half = d_fft_len / 2;
+      const float navgd = d_navgd;
+      const float gain_offset = gain_correction();
+      const float offset = d_power_offset + gain_offset - 10 * std::log10(navgd);
+
+      // fft shift while converting the accumulated power to dBm
+      float *out = (float *) output_items[0] + nproduced * d_fft_len;
+      for (size_t i = 0; i < d_fft_len; ++i)
+      {
+        out[i] = 10 * std::log10(d_accum[(i + half) % d_fft_len]) + offset;
+      }
+
+      if (output_items.size() > 1)
+      {
+        float *max_out = (float *) output_items[1] + nproduced * d_fft_len;
+        for (size_t i = 0; i < d_fft_len; ++i)
+        {
+          max_out[i] = 10 * std::log10(d_max[(i + half) % d_fft_len]) +
+                       d_power_offset + gain_offset;
+        }
+      }
+
+      if (output_items.size() > 2)
+      {
+        // var / (mean^2 * n) = (n * sum(p^2) / sum(p)^2 - 1) / n
+        float *var_out = (float *) output_items[2] + nproduced * d_fft_len;
+        for (size_t i = 0; i < d_fft_len; ++i)
+        {
+          const size_t j = (i + half) % d_fft_len;
+          const double sum = d_accum[j];
+          const double rel_var = navgd * d_accum_sq[j] / (sum * sum) - 1;
+          var_out[i] = std::max(0.0, rel_var) / navgd;
+        }
+      }
+
+      const uint64_t out_offset = nitems_written(0) + nproduced;
+      for (size_t port = 0; port < output_items.size(); ++port)
+      {
+        for (size_t i = 0; i < d_pending_tags.size(); ++i)
+        {
+          add_item_tag(port, out_offset,
+                       d_pending_tags[i].key,
+                       d_pending_tags[i].value,
+                       d_pending_tags[i].srcid);
+        }
+      }
+
+      discard_average();
+    }
+
+    void
+    psd_estimator_cf_impl::discard_average()
+    /* Drop the accumulated frames and their tags */
+    {
+      std::fill(d_accum, d_accum + d_fft_len, 0);
+      std::fill(d_accum_sq, d_accum_sq + d_fft_len, 0);
+      std::fill(d_max, d_max + d_fft_len, 0);
+      d_navgd = 0;
+      d_pending_tags.clear();
+    }
+
+    float
+    psd_estimator_cf_impl::gain_correction()
+    /* Return dB to add to the accumulated frames' spectrum to bring it to
+     * the reference gain, from the "gain" of their segment_start tag */
+    {
+      gr::thread::scoped_lock lock(d_mutex);
+      if (!d_have_reference_gain)
+        return 0;
+
+      for (size_t i = 0; i < d_pending_tags.size(); ++i)
+      {
+        if (!pmt::eq(d_pending_tags[i].key, d_segment_key) ||
+            !pmt::is_dict(d_pending_tags[i].value))
+          continue;
+
+        pmt::pmt_t gain = pmt::dict_ref(d_pending_tags[i].value,
+                                        pmt::intern("gain"),
+                                        pmt::PMT_NIL);
+        if (!pmt::is_null(gain))
+          return d_reference_gain - pmt::to_double(gain);
+      }
+      return 0;
+    }
+
+    bool
+    psd_estimator_cf_impl::segment_naverages(size_t &naverages, bool &retry)
+    /* If d_tags holds a segment_start tag with a copy count, set
+     * naverages to the number of frames in the segment and retry to true
+     * if the segment is being copied again after dropped samples */
+    {
+      for (size_t i = 0; i < d_tags.size(); ++i)
+      {
+        if (!pmt::eq(d_tags[i].key, d_segment_key) ||
+            !pmt::is_dict(d_tags[i].value))
+          continue;
+
+        pmt::pmt_t ncopy = pmt::dict_ref(d_tags[i].value,
+                                         pmt::intern("ncopy"),
+                                         pmt::PMT_NIL);
+        if (pmt::is_null(ncopy))
+          continue;
+
+        naverages = std::max((size_t) 1, (size_t) pmt::to_uint64(ncopy) / d_fft_len);
+
+        pmt::pmt_t retries = pmt::dict_ref(d_tags[i].value,
+                                           pmt::intern("retries"),
+                                           pmt::PMT_NIL);
+        retry = !pmt::is_null(retries) && pmt::to_uint64(retries) > 0;
+        return true;
+      }
+      return false;
+    }
+
+    int
+    psd_estimator_cf_impl::general_work(int noutput_items,
+                                        gr_vector_int &ninput_items,
+                                        gr_vector_const_void_star &input_items,
+                                        gr_vector_void_star &output_items)
+    {
+      const gr_complex *in = (const gr_complex *) input_items[0];
+      const bool statistics = output_items.size() > 1;
+
+      const size_t ninput = ninput_items[0];
+      size_t nproduced = 0;
+      size_t nread = 0;
+
+      while (nread + d_fft_len <= ninput && nproduced < (size_t)noutput_items)
+      {
+        const uint64_t frame_start = nitems_read(0) + nread;
+
+        // Frames never straddle two segments, e.g. when a segment is
+        // abandoned part way after dropped samples
+        get_tags_in_range(d_tags, 0, frame_start + 1,
+                          frame_start + d_fft_len, d_segment_key);
+        if (!d_tags.empty())
+        {
+          nread += d_tags[0].offset - frame_start;
+          continue;
+        }
+
+        get_tags_in_range(d_tags, 0, frame_start, frame_start + d_fft_len);
+
+        size_t naverages;
+        bool retry = false;
+        if (segment_naverages(naverages, retry))
+        {
+          if (retry)
+          {
+            // the previous attempt at this segment is incomplete
+            discard_average();
+          }
+          else if (d_navgd > 0)
+          {
+            // a new segment starts, so finish the previous one early
+            produce_average(output_items, nproduced);
+            if (++nproduced == (size_t)noutput_items)
+              break;
+          }
+          d_navg_target = naverages;
+        }
+
+        d_pending_tags.insert(d_pending_tags.end(), d_tags.begin(), d_tags.end());
+
+        volk_32fc_32f_multiply_32fc(d_fft->get_inbuf(),
+                                    &in[nread],
+                                    &d_window[0],
+                                    d_fft_len);
+        d_fft->execute();
+        volk_32fc_magnitude_squared_32f(d_mag_sq, d_fft->get_outbuf(), d_fft_len);
+        volk_32f_x2_add_32f(d_accum, d_accum, d_mag_sq, d_fft_len);
+        if (statistics)
+        {
+          volk_32f_x2_max_32f(d_max, d_max, d_mag_sq, d_fft_len);
+          volk_32f_x2_multiply_32f(d_mag_sq, d_mag_sq, d_mag_sq, d_fft_len);
+          volk_32f_x2_add_32f(d_accum_sq, d_accum_sq, d_mag_sq, d_fft_len);
+        }
+
+        if (++d_navgd == d_navg_target)
+        {
+          produce_average(output_items, nproduced);
+          ++nproduced;
+        }
+
+        nread += d_fft_len;
+      }
+
+      consume_each(nread);
+
+      // Tell runtime system how many output items we produced.
+      return nproduced;
+    }
+
+  } /* namespace usrpcalibrator */
+} /* namespace gr */
@@ -0,0 +1,82 @@
+/* -*- c++ -*- */
+/*
+ * Copyright 2016 Douglas Anderson
+ *
+ * This is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 3, or (at your option)
+ * any later version.
+ *
+ * This software is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this software; see the file COPYING.  If not, write to
+ * the Free Software Foundation, Inc., 51 Franklin Street,
+ * Boston, MA 02110-1301, USA.
+ */
+
+#ifndef INCLUDED_USRPCALIBRATOR_PSD_ESTIMATOR_CF_IMPL_H
+#define INCLUDED_USRPCALIBRATOR_PSD_ESTIMATOR_CF_IMPL_H
+
+#include <vector>
+
+#include <gnuradio/fft/fft.h>
+#include <gnuradio/thread/thread.h>
+#include <pmt/pmt.h>
+#include <usrpcalibrator/psd_estimator_cf.h>
+
+namespace gr {
+  namespace usrpcalibrator {
+
+    class psd_estimator_cf_impl : public psd_estimator_cf
+    {
+    private:
+      size_t d_fft_len;
+      size_t d_naverages;
+      size_t d_navgd;             // frames accumulated so far this output
+      size_t d_navg_target;       // frames to accumulate for this output
+      float d_power_offset;       // dBm offset for window power and impedance
+      bool d_have_reference_gain;
+      double d_reference_gain;    // dB gain scale factor was measured at
+      gr::thread::mutex d_mutex;  // set_reference_gain() is called from Python
+
+      std::vector<float> d_window;  // window taps * scale factor
+      gr::fft::fft_complex *d_fft;
+      float *d_mag_sq;            // magnitude squared of current frame
+      float *d_accum;             // accumulated magnitude squared
+      float *d_accum_sq;          // accumulated magnitude squared, squared
+      float *d_max;               // max-hold magnitude squared
+
+      std::vector<gr::tag_t> d_tags;
+      std::vector<gr::tag_t> d_pending_tags; // tags on frames in d_accum
+      pmt::pmt_t d_segment_key;
+
+      void produce_average(gr_vector_void_star &output_items, size_t nproduced);
+      void discard_average();
+      bool segment_naverages(size_t &naverages, bool &retry);
+      float gain_correction();
+
+    public:
+      psd_estimator_cf_impl(size_t fft_len,
+                            size_t naverages,
+                            const std::vector<float> &window,
+                            float scale_factor);
+      ~psd_estimator_cf_impl();
+
+      void set_reference_gain(double gain);
+
+      void forecast(int noutput_items, gr_vector_int &ninput_items_required);
+
+      int general_work(int noutput_items,
+                       gr_vector_int &ninput_items,
+                       gr_vector_const_void_star &input_items,
+                       gr_vector_void_star &output_items);
+    };
+
+  } // namespace usrpcalibrator
+} // namespace gr
+
+#endif /* INCLUDED_USRPCALIBRATOR_PSD_ESTIMATOR_CF_IMPL_H */
@@ -0,0 +1,151 @@
+/* -*- c++ -*- */
+/*
+ * Copyright 2016 Douglas Anderson
+ *
+ * This is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 3, or (at your option)
+ * any later version.
+ *
+ * This software is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this software; see the file COPYING.  If not, write to
+ * the Free Software Foundation, Inc., 51 Franklin Street,
+ * Boston, MA 02110-1301, USA.
+ */
+
+#ifdef HAVE_CONFIG_H
+#include "config.h"
+#endif
+
+#include <algorithm> /* max, sort, upper_bound */
+
+#include <boost/bind.hpp>
+
+#include <gnuradio/io_signature.h>
+#include "sim_tuner_source_c_impl.h"
+
+namespace gr {
+  namespace usrpcalibrator {
+
+    sim_tuner_source_c::sptr
+    sim_tuner_source_c::make(size_t tune_latency)
+    {
+      return gnuradio::get_initial_sptr
+        (new sim_tuner_source_c_impl(tune_latency));
+    }
+
+    /*
+     * The private constructor
+     */
+    sim_tuner_source_c_impl::sim_tuner_source_c_impl(size_t tune_latency)
+      : gr::sync_block("sim_tuner_source_c",
+                       gr::io_signature::make(0, 0, 0),
+                       gr::io_signature::make(1, 1, sizeof(gr_complex))),
+        d_tune_latency(tune_latency),
+        d_crossing_latency(0),
+        d_last_band(-1),
+        d_nband_crossings(0)
+    {
+      d_tag_key = pmt::intern("rx_freq");
+      d_freq_key = pmt::intern("freq");
+      d_lo_offset_key = pmt::intern("lo_offset");
+
+      message_port_register_in(pmt::intern("command"));
+      set_msg_handler(pmt::intern("command"),
+                      boost::bind(&sim_tuner_source_c_impl::handle_command, this, _1));
+    }
+
+    /*
+     * Our virtual destructor.
+     */
+    sim_tuner_source_c_impl::~sim_tuner_source_c_impl()
+    {
+    }
+
+    void
+    sim_tuner_source_c_impl::set_tune_latency(size_t tune_latency)
+    {
+      d_tune_latency = tune_latency;
+    }
+
+    size_t
+    sim_tuner_source_c_impl::tune_latency() const
+    {
+      return d_tune_latency;
+    }
+
+    void
+    sim_tuner_source_c_impl::set_lo_band_edges(const std::vector<double> &edges,
+                                               size_t crossing_latency)
+    {
+      d_lo_band_edges = edges;
+      std::sort(d_lo_band_edges.begin(), d_lo_band_edges.end());
+      d_crossing_latency = crossing_latency;
+      d_last_band = -1;
+    }
+
+    size_t
+    sim_tuner_source_c_impl::nband_crossings() const
+    {
+      return d_nband_crossings;
+    }
+
+    void
+    sim_tuner_source_c_impl::handle_command(pmt::pmt_t msg)
+    /* Schedule an rx_freq tag for a tune dict. Runs between calls to work. */
+    {
+      if (!pmt::is_dict(msg) || !pmt::dict_has_key(msg, d_freq_key))
+        return;
+
+      double freq = pmt::to_double(pmt::dict_ref(msg, d_freq_key, pmt::PMT_NIL));
+      double lo_offset = pmt::to_double(pmt::dict_ref(msg,
+                                                      d_lo_offset_key,
+                                                      pmt::from_double(0)));
+
+      size_t latency = d_tune_latency;
+      long band = std::upper_bound(d_lo_band_edges.begin(),
+                                   d_lo_band_edges.end(),
+                                   freq + lo_offset) - d_lo_band_edges.begin();
+      if (d_last_band >= 0 && band != d_last_band)
+      {
+        latency += d_crossing_latency;
+        d_nband_crossings++;
+      }
+      d_last_band = band;
+
+      d_pending.push_back(std::make_pair(nitems_written(0) + latency, freq));
+    }
+
+    int
+    sim_tuner_source_c_impl::work(int noutput_items,
+                                  gr_vector_const_void_star &input_items,
+                                  gr_vector_void_star &output_items)
+    {
+      gr_complex *out = (gr_complex *) output_items[0];
+
+      const uint64_t start = nitems_written(0);
+      const uint64_t stop = start + noutput_items;
+
+      for (int i = 0; i < noutput_items; ++i)
+        out[i] = gr_complex(start + i, 0);
+
+      while (!d_pending.empty() && d_pending.front().first < stop)
+      {
+        add_item_tag(0,
+                     std::max(d_pending.front().first, start),
+                     d_tag_key,
+                     pmt::from_double(d_pending.front().second));
+        d_pending.pop_front();
+      }
+
+      // Tell runtime system how many output items we produced.
+      return noutput_items;
+    }
+
+  } /* namespace usrpcalibrator */
+} /* namespace gr */
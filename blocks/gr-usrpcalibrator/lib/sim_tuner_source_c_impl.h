@@ -0,0 +1,71 @@
+/* -*- c++ -*- */
+/*
+ * Copyright 2016 Douglas Anderson
+ *
+ * This is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 3, or (at your option)
+ * any later version.
+ *
+ * This software is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this software; see the file COPYING.  If not, write to
+ * the Free Software Foundation, Inc., 51 Franklin Street,
+ * Boston, MA 02110-1301, USA.
+ */
+
+#ifndef INCLUDED_USRPCALIBRATOR_SIM_TUNER_SOURCE_C_IMPL_H
+#define INCLUDED_USRPCALIBRATOR_SIM_TUNER_SOURCE_C_IMPL_H
+
+#include <deque>
+#include <utility>
+#include <vector>
+
+#include <pmt/pmt.h>
+#include <usrpcalibrator/sim_tuner_source_c.h>
+
+namespace gr {
+  namespace usrpcalibrator {
+
+    class sim_tuner_source_c_impl : public sim_tuner_source_c
+    {
+    private:
+      size_t d_tune_latency;
+      pmt::pmt_t d_tag_key;
+      pmt::pmt_t d_freq_key;
+      pmt::pmt_t d_lo_offset_key;
+
+      // used for modelling slow relocks across LO bands
+      std::vector<double> d_lo_band_edges; // sorted
+      size_t d_crossing_latency;
+      long d_last_band;           // band of the previous tune, -1 if none
+      size_t d_nband_crossings;
+
+      // (offset, freq) of rx_freq tags not yet written
+      std::deque<std::pair<uint64_t, double> > d_pending;
+
+      void handle_command(pmt::pmt_t msg);
+
+    public:
+      sim_tuner_source_c_impl(size_t tune_latency);
+      ~sim_tuner_source_c_impl();
+
+      void set_tune_latency(size_t tune_latency);
+      size_t tune_latency() const;
+      void set_lo_band_edges(const std::vector<double> &edges,
+                             size_t crossing_latency);
+      size_t nband_crossings() const;
+
+      int work(int noutput_items,
+               gr_vector_const_void_star &input_items,
+               gr_vector_void_star &output_items);
+    };
+
+  } // namespace usrpcalibrator
+} // namespace gr
+
+#endif /* INCLUDED_USRPCALIBRATOR_SIM_TUNER_SOURCE_C_IMPL_H */
@@ -22,10 +22,13 @@
 #include "config.h"
 #endif
 
-#include <algorithm> /* copy */
+#include <algorithm> /* copy, fill, max, min */
 #include <cassert>
+#include <cmath>     /* log10, pow */
+#include <stdexcept>
 
 #include <gnuradio/io_signature.h>
+#include <volk/volk.h>
 #include "stitch_fft_segments_ff_impl.h"
 
 namespace gr {
@@ -35,10 +38,12 @@ namespace gr {
     stitch_fft_segments_ff::make(size_t fft_size,
                                  size_t nsegments,
                                  float overlap,
-                                 size_t nvalid_bins)
+                                 size_t nvalid_bins,
+                                 bool segment_input)
     {
       return gnuradio::get_initial_sptr
-        (new stitch_fft_segments_ff_impl(fft_size, nsegments, overlap, nvalid_bins));
+        (new stitch_fft_segments_ff_impl(fft_size, nsegments, overlap,
+                                         nvalid_bins, segment_input));
     }
 
     /*
@@ -47,20 +52,43 @@ namespace gr {
     stitch_fft_segments_ff_impl::stitch_fft_segments_ff_impl(size_t fft_size,
                                                              size_t nsegments,
                                                              float overlap,
-                                                             size_t nvalid_bins)
-      : gr::sync_block("stitch_fft_segments_ff",
-                       gr::io_signature::make(1, 1, fft_size * nsegments * sizeof(float)),
-                       gr::io_signature::make(1, 1, nsegments * nvalid_bins * sizeof(float))),
+                                                             size_t nvalid_bins,
+                                                             bool segment_input)
+      : gr::block("stitch_fft_segments_ff",
+                  gr::io_signature::make(1, 1, (segment_input ? 1 : nsegments) * fft_size * sizeof(float)),
+                  gr::io_signature::make(1, 1, nsegments * nvalid_bins * sizeof(float))),
         d_fft_size(fft_size),
         d_nsegments(nsegments),
         d_overlap(overlap),
-        d_nvalid_bins(nvalid_bins)
+        d_nvalid_bins(nvalid_bins),
+        d_average_overlap(false),
+        d_segment_input(segment_input),
+        d_segment_key(pmt::intern("segment_start")),
+        d_segments(segment_input ? nsegments * fft_size : 0, 0),
+        d_received(segment_input ? nsegments : 0, false),
+        d_nreceived(0),
+        d_next_index(0),
+        d_span(pmt::PMT_NIL)
     {
       assert(nvalid_bins == static_cast<int>(fft_size * (1 - overlap)) / 2 * 2);
 
+      d_nin = nsegments * fft_size;
       d_nout = nsegments * nvalid_bins;
       d_bin_start = fft_size * (overlap / 2); // d_overlap is float
       d_bin_stop = fft_size - d_bin_start;
+
+      // Leave out the outer half of the margin, on the filter's roll-off
+      const size_t edge = d_bin_start / 2;
+      d_bin_weights.assign(d_fft_size, 0);
+      std::fill(d_bin_weights.begin() + edge, d_bin_weights.end() - edge, 1);
+      d_power.resize(d_fft_size);
+      update_weights();
+
+      if (d_segment_input)
+      {
+        set_relative_rate(1.0 / d_nsegments);
+        set_tag_propagation_policy(TPP_DONT);
+      }
     }
 
     /*
@@ -70,24 +98,240 @@ namespace gr {
     {
     }
 
-    int
-    stitch_fft_segments_ff_impl::work(int noutput_items,
-                                      gr_vector_const_void_star &input_items,
-                                      gr_vector_void_star &output_items)
+    void
+    stitch_fft_segments_ff_impl::set_average_overlap(bool average_overlap)
     {
-      const float *in = (const float *) input_items[0];
-      float *out = (float *) output_items[0];
+      d_average_overlap = average_overlap;
+    }
+
+    bool
+    stitch_fft_segments_ff_impl::average_overlap() const
+    {
+      return d_average_overlap;
+    }
+
+    void
+    stitch_fft_segments_ff_impl::set_bin_weights(const std::vector<float> &weights)
+    {
+      if (weights.size() != d_fft_size)
+        throw std::invalid_argument("stitch_fft_segments_ff: need fft_size bin weights");
+      for (size_t bin = 0; bin < d_fft_size; ++bin)
+      {
+        if (weights[bin] < 0)
+          throw std::invalid_argument("stitch_fft_segments_ff: bin weights must not be negative");
+      }
+
+      gr::thread::scoped_lock lock(d_mutex);
+      std::vector<float> old_weights = d_bin_weights;
+      d_bin_weights = weights;
+      try
+      {
+        update_weights();
+      }
+      catch (std::invalid_argument &)
+      {
+        d_bin_weights = old_weights;
+        update_weights();
+        throw;
+      }
+    }
 
+    std::vector<float>
+    stitch_fft_segments_ff_impl::bin_weights() const
+    {
+      gr::thread::scoped_lock lock(d_mutex);
+      return d_bin_weights;
+    }
+
+    void
+    stitch_fft_segments_ff_impl::update_weights()
+    /* Total the weight of the bins covering each output bin */
+    {
+      std::vector<float> totals(d_nout, 0);
+      for (size_t seg = 0; seg < d_nsegments; ++seg)
+      {
+        for (size_t bin = 0; bin < d_fft_size; ++bin)
+        {
+          long pos = (long)(seg * d_nvalid_bins + bin) - (long)d_bin_start;
+          if (pos >= 0 && pos < (long)d_nout)
+            totals[pos] += d_bin_weights[bin];
+        }
+      }
+
+      d_weights.resize(d_nout);
+      for (size_t pos = 0; pos < d_nout; ++pos)
+      {
+        if (totals[pos] <= 0)
+          throw std::invalid_argument("stitch_fft_segments_ff: every output bin needs a bin of non-zero weight");
+        d_weights[pos] = 1 / totals[pos];
+      }
+    }
+
+    void
+    stitch_fft_segments_ff_impl::copy_valid_bins(const float *in, float *out)
+    {
       size_t in_idx = d_bin_start;
       size_t out_idx = 0;
-      size_t bytes_to_copy = d_nvalid_bins * sizeof(float);
-      for (in_idx, out_idx; out_idx < d_nout; in_idx += d_fft_size, out_idx += d_nvalid_bins)
+      for (; out_idx < d_nout; in_idx += d_fft_size, out_idx += d_nvalid_bins)
       {
         std::copy(&in[in_idx], &in[in_idx + d_nvalid_bins], &out[out_idx]);
       }
+    }
+
+    void
+    stitch_fft_segments_ff_impl::average_bins(const float *in, float *out)
+    /* Weighted mean in linear power of the bins covering each output bin,
+     * in dB. Caller must hold d_mutex */
+    {
+      std::fill(out, out + d_nout, 0);
+
+      // Bin b of segment s lands on output bin s * nvalid_bins + b - bin_start
+      for (size_t seg = 0; seg < d_nsegments; ++seg)
+      {
+        long seg_start = (long)(seg * d_nvalid_bins) - (long)d_bin_start;
+        long first_bin = std::max(0L, -seg_start);
+        long last_bin = std::min((long)d_fft_size, (long)d_nout - seg_start);
+
+        const float *seg_in = &in[seg * d_fft_size];
+        for (long bin = first_bin; bin < last_bin; ++bin)
+          d_power[bin] = d_bin_weights[bin] * std::pow(10.0f, seg_in[bin] / 10);
+
+        volk_32f_x2_add_32f(&out[seg_start + first_bin],
+                            &out[seg_start + first_bin],
+                            &d_power[first_bin],
+                            last_bin - first_bin);
+      }
+
+      volk_32f_x2_multiply_32f(out, out, &d_weights[0], d_nout);
+      for (size_t pos = 0; pos < d_nout; ++pos)
+        out[pos] = 10 * std::log10(out[pos]);
+    }
+
+    void
+    stitch_fft_segments_ff_impl::stitch(const float *in, float *out)
+    {
+      if (d_average_overlap)
+        average_bins(in, out);
+      else
+        copy_valid_bins(in, out);
+    }
+
+    size_t
+    stitch_fft_segments_ff_impl::segment_index(uint64_t offset)
+    {
+      for (size_t i = 0; i < d_tags.size(); ++i)
+      {
+        if (d_tags[i].offset != offset)
+          continue;
+
+        pmt::pmt_t index = pmt::dict_ref(d_tags[i].value,
+                                         pmt::intern("index"),
+                                         pmt::PMT_NIL);
+        if (pmt::is_integer(index) || pmt::is_uint64(index))
+        {
+          size_t idx = pmt::to_uint64(index);
+          if (idx < d_nsegments)
+            return idx;
+        }
+      }
+
+      // Untagged, or tagged without a usable index
+      return d_next_index;
+    }
+
+    void
+    stitch_fft_segments_ff_impl::resync_span(uint64_t offset)
+    /* Drop a partial span if the segment at offset belongs to a new one */
+    {
+      for (size_t i = 0; i < d_tags.size(); ++i)
+      {
+        if (d_tags[i].offset != offset)
+          continue;
+
+        pmt::pmt_t span = pmt::dict_ref(d_tags[i].value,
+                                        pmt::intern("span"),
+                                        pmt::PMT_NIL);
+        if (pmt::is_null(span))
+          continue;
+
+        if (!pmt::is_null(d_span) && !pmt::equal(span, d_span) && d_nreceived > 0)
+        {
+          std::fill(d_received.begin(), d_received.end(), false);
+          d_nreceived = 0;
+        }
+        d_span = span;
+      }
+    }
+
+    int
+    stitch_fft_segments_ff_impl::stitch_segments(int noutput_items,
+                                                 int ninput_items,
+                                                 const float *in,
+                                                 float *out)
+    {
+      get_tags_in_range(d_tags, 0, nitems_read(0), nitems_read(0) + ninput_items,
+                        d_segment_key);
+
+      int nproduced = 0;
+      int nconsumed = 0;
+      for (; nconsumed < ninput_items && nproduced < noutput_items; ++nconsumed)
+      {
+        resync_span(nitems_read(0) + nconsumed);
+        size_t idx = segment_index(nitems_read(0) + nconsumed);
+
+        // A repeated index overwrites the earlier copy of that segment
+        const float *seg = &in[nconsumed * d_fft_size];
+        std::copy(seg, seg + d_fft_size, &d_segments[idx * d_fft_size]);
+        if (!d_received[idx])
+        {
+          d_received[idx] = true;
+          d_nreceived++;
+        }
+        d_next_index = (idx + 1) % d_nsegments;
+
+        if (d_nreceived == d_nsegments)
+        {
+          stitch(&d_segments[0], &out[nproduced * d_nout]);
+          nproduced++;
+
+          std::fill(d_received.begin(), d_received.end(), false);
+          d_nreceived = 0;
+        }
+      }
+
+      consume_each(nconsumed);
+
+      return nproduced;
+    }
+
+    void
+    stitch_fft_segments_ff_impl::forecast(int noutput_items,
+                                          gr_vector_int &ninput_items_required)
+    {
+      ninput_items_required[0] = d_segment_input ? 1 : noutput_items;
+    }
+
+    int
+    stitch_fft_segments_ff_impl::general_work(int noutput_items,
+                                              gr_vector_int &ninput_items,
+                                              gr_vector_const_void_star &input_items,
+                                              gr_vector_void_star &output_items)
+    {
+      const float *in = (const float *) input_items[0];
+      float *out = (float *) output_items[0];
+
+      gr::thread::scoped_lock lock(d_mutex);
+      if (d_segment_input)
+        return stitch_segments(noutput_items, ninput_items[0], in, out);
+
+      int nitems = std::min(noutput_items, ninput_items[0]);
+      for (int n = 0; n < nitems; ++n)
+        stitch(&in[n * d_nin], &out[n * d_nout]);
+
+      consume_each(nitems);
 
       // Tell runtime system how many output items we produced.
-      return noutput_items;
+      return nitems;
     }
 
   } /* namespace usrpcalibrator */
@@ -21,6 +21,10 @@
 #ifndef INCLUDED_USRPCALIBRATOR_STITCH_FFT_SEGMENTS_FF_IMPL_H
 #define INCLUDED_USRPCALIBRATOR_STITCH_FFT_SEGMENTS_FF_IMPL_H
 
+#include <vector>
+
+#include <gnuradio/thread/thread.h>
+#include <pmt/pmt.h>
 #include <usrpcalibrator/stitch_fft_segments_ff.h>
 
 namespace gr {
@@ -38,17 +42,54 @@ namespace gr {
       size_t d_bin_start;
       size_t d_bin_stop;
 
+      bool d_average_overlap;
+      std::vector<float> d_bin_weights; // weight of each bin of a segment
+      std::vector<float> d_weights;     // 1 / total bin weight of each output bin
+      std::vector<float> d_power;       // bins of a segment in linear power
+      mutable gr::thread::mutex d_mutex; // set_bin_weights() is called from Python
+
+      // used in segment_input mode
+      bool d_segment_input;
+      pmt::pmt_t d_segment_key;
+      std::vector<gr::tag_t> d_tags;
+      std::vector<float> d_segments;   // nsegments * fft_size received bins
+      std::vector<bool> d_received;    // true if segment received this span
+      size_t d_nreceived;              // distinct segments received this span
+      size_t d_next_index;             // index assumed for an untagged segment
+      pmt::pmt_t d_span;               // "span" of segments received, or PMT_NIL
+
+      void update_weights();
+      void copy_valid_bins(const float *in, float *out);
+      void average_bins(const float *in, float *out);
+      void stitch(const float *in, float *out);
+
+      size_t segment_index(uint64_t offset);
+      void resync_span(uint64_t offset);
+      int stitch_segments(int noutput_items,
+                          int ninput_items,
+                          const float *in,
+                          float *out);
+
     public:
       stitch_fft_segments_ff_impl(size_t fft_size,
                                   size_t nsegments,
                                   float overlap,
-                                  size_t nvalid_bins);
+                                  size_t nvalid_bins,
+                                  bool segment_input);
       ~stitch_fft_segments_ff_impl();
 
+      void set_average_overlap(bool average_overlap);
+      bool average_overlap() const;
+      void set_bin_weights(const std::vector<float> &weights);
+      std::vector<float> bin_weights() const;
+
+      void forecast(int noutput_items, gr_vector_int &ninput_items_required);
+
       // Where all the action really happens
-      int work(int noutput_items,
-               gr_vector_const_void_star &input_items,
-               gr_vector_void_star &output_items);
+      int general_work(int noutput_items,
+                       gr_vector_int &ninput_items,
+                       gr_vector_const_void_star &input_items,
+                       gr_vector_void_star &output_items);
     };
 
   } // namespace usrpcalibrator
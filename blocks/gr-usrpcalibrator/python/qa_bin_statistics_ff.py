@@ -21,6 +21,7 @@
 
 from gnuradio import gr, gr_unittest
 from gnuradio import blocks
+import pmt
 import usrpcalibrator_swig as usrpcalibrator
 
 class qa_bin_statistics_ff (gr_unittest.TestCase):
@@ -74,6 +75,71 @@ class qa_bin_statistics_ff (gr_unittest.TestCase):
         result_data = dst.data()
         self.assertFloatTuplesAlmostEqual(expected_result, result_data, 6)
 
+    def test_004_t (self):
+        """Test max-hold, min-hold and variance outputs"""
+        # set up fg
+        src_data = (1, 2.1, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20)
+        expected_mean = (8.5, 9.525, 10.5, 11.5, 12.5)
+        expected_max = (16, 17, 18, 19, 20)
+        expected_min = (1, 2.1, 3, 4, 5)
+        expected_var = (31.25, 30.876875, 31.25, 31.25, 31.25)
+        src = blocks.vector_source_f(src_data)
+        s2v = blocks.stream_to_vector(gr.sizeof_float, 5)
+        stats = usrpcalibrator.bin_statistics_ff(5, 4)
+        dst_mean = blocks.vector_sink_f(5)
+        dst_max = blocks.vector_sink_f(5)
+        dst_min = blocks.vector_sink_f(5)
+        dst_var = blocks.vector_sink_f(5)
+        self.tb.connect(src, s2v, stats)
+        self.tb.connect((stats, 0), dst_mean)
+        self.tb.connect((stats, 1), dst_max)
+        self.tb.connect((stats, 2), dst_min)
+        self.tb.connect((stats, 3), dst_var)
+        self.tb.run ()
+        # check data
+        self.assertFloatTuplesAlmostEqual(expected_mean, dst_mean.data(), 6)
+        self.assertFloatTuplesAlmostEqual(expected_max, dst_max.data(), 6)
+        self.assertFloatTuplesAlmostEqual(expected_min, dst_min.data(), 6)
+        self.assertFloatTuplesAlmostEqual(expected_var, dst_var.data(), 4)
+
+    def test_005_t (self):
+        """Test exponential averaging carries across intervals"""
+        # set up fg
+        src_data = (0, 10, 4, 4, 8, 0, 0, 6)
+        alpha = 0.5
+        # ema: 0,10 -> 2,7 -> 5,3.5 -> 2.5,4.75, output every 2nd vector
+        expected_result = (2, 7, 2.5, 4.75)
+        src = blocks.vector_source_f(src_data)
+        s2v = blocks.stream_to_vector(gr.sizeof_float, 2)
+        stats = usrpcalibrator.bin_statistics_ff(2, 2, alpha)
+        self.assertAlmostEqual(stats.alpha(), alpha)
+        dst = blocks.vector_sink_f(2)
+        self.tb.connect(src, s2v, stats, dst)
+        self.tb.run ()
+        # check data
+        result_data = dst.data()
+        self.assertFloatTuplesAlmostEqual(expected_result, result_data, 6)
+
+    def test_006_t (self):
+        """Test a segment_start tag restarts the measurement interval"""
+        # set up fg
+        src_data = (0, 0, 2, 2, 100, 100, 4, 4, 6, 6)
+        # vector 2 is cut short by the segment starting at vector 3
+        expected_result = (1, 1, 5, 5)
+        tag = gr.tag_utils.python_to_tag({
+            "offset": 3,
+            "key": pmt.intern("segment_start"),
+            "value": pmt.make_dict(),
+            "srcid": pmt.intern("qa")})
+        src = blocks.vector_source_f(src_data, False, 2, [tag])
+        stats = usrpcalibrator.bin_statistics_ff(2, 2)
+        dst = blocks.vector_sink_f(2)
+        self.tb.connect(src, stats, dst)
+        self.tb.run ()
+        # check data
+        self.assertFloatTuplesAlmostEqual(expected_result, dst.data(), 6)
+        self.assertEqual([t.offset for t in dst.tags()], [1])
+
 if __name__ == '__main__':
     #import os
     #print("pid = {}".format(os.getpid()))
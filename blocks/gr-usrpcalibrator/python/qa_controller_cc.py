@@ -21,7 +21,7 @@
 
 import numpy as np
 
-from gnuradio import gr, gr_unittest, uhd
+from gnuradio import gr, gr_unittest
 from gnuradio import blocks
 import pmt
 import usrpcalibrator_swig as usrpcalibrator
@@ -30,18 +30,12 @@ import usrpcalibrator_swig as usrpcalibrator
 class qa_controller_cc(gr_unittest.TestCase):
     def setUp(self):
         self.tb = gr.top_block()
-        self.tb_null = gr.top_block()
-        self.usrp = uhd.usrp_source(device_addr="",
-                                 stream_args=uhd.stream_args("fc32"))
-        null = blocks.null_sink(gr.sizeof_gr_complex)
-        self.tb_null.connect(self.usrp, null)
         self.tag_debug = blocks.tag_debug(gr.sizeof_gr_complex, "Tag debug")
         self.tag_debug.set_display(False)
         self.vsink = blocks.vector_sink_c()
 
     def tearDown(self):
         self.tb = None
-        self.tb_null = None
         self.tab_debug = None
         self.vsink = None
 
@@ -51,21 +45,20 @@ class qa_controller_cc(gr_unittest.TestCase):
         tag1_dict["offset"] = 10000
         tag1_dict["key"] = pmt.intern("rx_freq")
         tag1_dict["value"] = pmt.from_double(0.0)
-        tag1_dict["srcid"] = pmt.intern(self.usrp.name())
+        tag1_dict["srcid"] = pmt.intern("qa")
         tag1 = gr.tag_utils.python_to_tag(tag1_dict)
 
         nsamples = 10100
         src_data = np.array([complex(x) for x in range(nsamples)])
         src = blocks.vector_source_c(data=src_data, tags=[tag1])
 
-        usrp_ptr = self.usrp
         cfreqs = np.array([ 0.])
         lo_offset = 0
         initial_delay = 0
         tune_delay = 0
         ncopy = 100
 
-        ctrl = usrpcalibrator.controller_cc(usrp_ptr, cfreqs, lo_offset,
+        ctrl = usrpcalibrator.controller_cc(cfreqs, lo_offset,
                                           initial_delay, tune_delay, ncopy)
         ctrl.disable_verify_tag_freq()
 
@@ -84,21 +77,20 @@ class qa_controller_cc(gr_unittest.TestCase):
         tag1_dict["offset"] = 10000
         tag1_dict["key"] = pmt.intern("rx_freq")
         tag1_dict["value"] = pmt.from_double(0.0)
-        tag1_dict["srcid"] = pmt.intern(self.usrp.name())
+        tag1_dict["srcid"] = pmt.intern("qa")
         tag1 = gr.tag_utils.python_to_tag(tag1_dict)
 
         nsamples = 10101
         src_data = np.array([complex(x) for x in range(nsamples)])
         src = blocks.vector_source_c(data=src_data, tags=[tag1])
 
-        usrp_ptr = self.usrp
         cfreqs = np.array([ 0.])
         lo_offset = 0
         initial_delay = 0
         tune_delay = 0
         ncopy = 100
 
-        ctrl = usrpcalibrator.controller_cc(usrp_ptr, cfreqs, lo_offset,
+        ctrl = usrpcalibrator.controller_cc(cfreqs, lo_offset,
                                           initial_delay, tune_delay, ncopy)
         ctrl.set_exit_after_complete(True)
         ctrl.disable_verify_tag_freq() # for unittesting
@@ -118,35 +110,34 @@ class qa_controller_cc(gr_unittest.TestCase):
         tag1_dict["offset"] = 10000
         tag1_dict["key"] = pmt.intern("rx_freq")
         tag1_dict["value"] = pmt.from_double(0.0)
-        tag1_dict["srcid"] = pmt.intern(self.usrp.name())
+        tag1_dict["srcid"] = pmt.intern("qa")
         tag1 = gr.tag_utils.python_to_tag(tag1_dict)
 
         tag2_dict = dict()
         tag2_dict["offset"] = 20000
         tag2_dict["key"] = pmt.intern("rx_freq")
         tag2_dict["value"] = pmt.from_double(1.0)
-        tag2_dict["srcid"] = pmt.intern(self.usrp.name())
+        tag2_dict["srcid"] = pmt.intern("qa")
         tag2 = gr.tag_utils.python_to_tag(tag2_dict)
 
         tag3_dict = dict()
         tag3_dict["offset"] = 30000
         tag3_dict["key"] = pmt.intern("rx_freq")
         tag3_dict["value"] = pmt.from_double(2.0)
-        tag3_dict["srcid"] = pmt.intern(self.usrp.name())
+        tag3_dict["srcid"] = pmt.intern("qa")
         tag3 = gr.tag_utils.python_to_tag(tag3_dict)
 
         nsamples = 30100
         src_data = np.array([complex(x) for x in range(nsamples)])
         src = blocks.vector_source_c(data=src_data, tags=[tag1, tag2, tag3])
 
-        usrp_ptr = self.usrp
         cfreqs = np.array([ 0.,  1.,  2.])
         lo_offset = 0
         initial_delay = 0
         tune_delay = 0
         ncopy = 100
 
-        ctrl = usrpcalibrator.controller_cc(usrp_ptr, cfreqs, lo_offset,
+        ctrl = usrpcalibrator.controller_cc(cfreqs, lo_offset,
                                           initial_delay, tune_delay, ncopy)
         ctrl.disable_verify_tag_freq()
 
@@ -167,21 +158,20 @@ class qa_controller_cc(gr_unittest.TestCase):
         tag1_dict["offset"] = 10000
         tag1_dict["key"] = pmt.intern("rx_freq")
         tag1_dict["value"] = pmt.from_double(0.0)
-        tag1_dict["srcid"] = pmt.intern(self.usrp.name())
+        tag1_dict["srcid"] = pmt.intern("qa")
         tag1 = gr.tag_utils.python_to_tag(tag1_dict)
 
         nsamples = 10100
         src_data = np.array([complex(x) for x in range(nsamples)])
         src = blocks.vector_source_c(data=src_data, tags=[tag1])
 
-        usrp_ptr = self.usrp
         cfreqs = np.array([ 0.])
         lo_offset = 0
         initial_delay = 50
         tune_delay = 20
         ncopy = 30
 
-        ctrl = usrpcalibrator.controller_cc(usrp_ptr, cfreqs, lo_offset,
+        ctrl = usrpcalibrator.controller_cc(cfreqs, lo_offset,
                                           initial_delay, tune_delay, ncopy)
         ctrl.disable_verify_tag_freq()
 
@@ -196,6 +186,340 @@ class qa_controller_cc(gr_unittest.TestCase):
 
         self.assertEqual(ctrl.nitems_read(0) - ctrl.nitems_written(0), 10070)
 
+    def test005(self):
+        """Test rerunning with new center freqs"""
+        tag1_dict = dict()
+        tag1_dict["offset"] = 10000
+        tag1_dict["key"] = pmt.intern("rx_freq")
+        tag1_dict["value"] = pmt.from_double(0.0)
+        tag1_dict["srcid"] = pmt.intern("qa")
+        tag1 = gr.tag_utils.python_to_tag(tag1_dict)
+
+        tag2_dict = dict()
+        tag2_dict["offset"] = 20000
+        tag2_dict["key"] = pmt.intern("rx_freq")
+        tag2_dict["value"] = pmt.from_double(1.0)
+        tag2_dict["srcid"] = pmt.intern("qa")
+        tag2 = gr.tag_utils.python_to_tag(tag2_dict)
+
+        nsamples = 20100
+        src_data = np.array([complex(x) for x in range(nsamples)])
+        src = blocks.vector_source_c(data=src_data, tags=[tag1, tag2])
+
+        cfreqs = np.array([ 0.])
+        lo_offset = 0
+        initial_delay = 0
+        tune_delay = 0
+        ncopy = 100
+
+        ctrl = usrpcalibrator.controller_cc(cfreqs, lo_offset,
+                                          initial_delay, tune_delay, ncopy)
+        ctrl.set_exit_after_complete(True)
+        ctrl.disable_verify_tag_freq()
+
+        self.tb.connect((src, 0), ctrl, self.vsink)
+        self.tb.run()
+
+        result = self.vsink.data()
+        expected_result = np.arange(10000, 10100)
+
+        np.testing.assert_array_equal(result, expected_result)
+
+        ctrl.set_center_freqs([0., 1.])
+        self.assertEqual(tuple(ctrl.center_freqs()), (0., 1.))
+        src.rewind()
+        self.vsink.reset()
+        self.tb.run()
+
+        result = self.vsink.data()
+        expected_result = np.concatenate((np.arange(10000, 10100),
+                                          np.arange(20000, 20100)))
+
+        np.testing.assert_array_equal(result, expected_result)
+
+    def test006(self):
+        """Test sweep driven through the command port"""
+        tune_latency = 5000
+        cfreqs = np.array([ 1e9,  2e9,  3e9])
+        lo_offset = 0
+        initial_delay = 0
+        tune_delay = 100
+        ncopy = 1000
+
+        src = usrpcalibrator.sim_tuner_source_c(tune_latency)
+        ctrl = usrpcalibrator.controller_cc(cfreqs, lo_offset,
+                                          initial_delay, tune_delay, ncopy)
+        ctrl.set_exit_after_complete(True)
+
+        self.tb.msg_connect(ctrl, "command", src, "command")
+        self.tb.connect(src, ctrl, self.vsink)
+        self.tb.run()
+
+        result = np.real(self.vsink.data())
+        self.assertEqual(len(result), len(cfreqs) * ncopy)
+
+        # Each segment is contiguous and starts after its tune delay
+        segments = result.reshape(len(cfreqs), ncopy)
+        for segment in segments:
+            np.testing.assert_array_equal(np.diff(segment), np.ones(ncopy - 1))
+        self.assertTrue(np.all(np.diff(segments[:, 0]) >= tune_latency + tune_delay))
+
+    def test007(self):
+        """Test adaptive settle stops skipping once the transient decays"""
+        tag1_dict = dict()
+        tag1_dict["offset"] = 10000
+        tag1_dict["key"] = pmt.intern("rx_freq")
+        tag1_dict["value"] = pmt.from_double(0.0)
+        tag1_dict["srcid"] = pmt.intern("qa")
+        tag1 = gr.tag_utils.python_to_tag(tag1_dict)
+
+        # Amplitude ramps from 5 down to 1 over the 5000 samples after the tag
+        nsamples = 20000
+        n = np.arange(nsamples) - 10000
+        src_data = np.maximum(1, 5 - np.maximum(n, 0) / 1250.).astype(complex)
+        src = blocks.vector_source_c(data=src_data, tags=[tag1])
+
+        cfreqs = np.array([ 0.])
+        lo_offset = 0
+        initial_delay = 0
+        tune_delay = 9000
+        ncopy = 100
+
+        ctrl = usrpcalibrator.controller_cc(cfreqs, lo_offset,
+                                          initial_delay, tune_delay, ncopy)
+        ctrl.disable_verify_tag_freq()
+        ctrl.set_exit_after_complete(True)
+        ctrl.set_adaptive_settle(500, 0.1, 100)
+        self.assertTrue(ctrl.adaptive_settle())
+
+        self.tb.connect(src, ctrl, self.tag_debug)
+        self.tb.run()
+
+        # Windows ending at 5500 and 6000 samples past the tag match their
+        # predecessors, so the segment settles 6500 samples after the tag
+        self.assertEqual(ctrl.nitems_read(0) - ctrl.nitems_written(0), 16500)
+
+        tags = self.tag_debug.current_tags()
+        self.assertEqual(len(tags), 1)
+        nskip = pmt.dict_ref(tags[0].value, pmt.intern("nskip"), pmt.PMT_NIL)
+        self.assertEqual(pmt.to_uint64(nskip), 6500)
+
+    def test008(self):
+        """Test per-segment skip and copy counts and gains from a schedule"""
+        tags = []
+        for offset, freq in [(10000, 0.0), (20000, 1.0)]:
+            tags.append(gr.tag_utils.python_to_tag({
+                "offset": offset,
+                "key": pmt.intern("rx_freq"),
+                "value": pmt.from_double(freq),
+                "srcid": pmt.intern("qa")}))
+
+        nsamples = 20100
+        src_data = np.array([complex(x) for x in range(nsamples)])
+        src = blocks.vector_source_c(data=src_data, tags=tags)
+
+        lo_offset = 0
+        initial_delay = 0
+        tune_delay = 0
+        ncopy = 100
+
+        ctrl = usrpcalibrator.controller_cc([0.], lo_offset,
+                                          initial_delay, tune_delay, ncopy)
+        ctrl.set_schedule([0., 1.], [10, 20], [100, 50], [30., 20.], [])
+        ctrl.set_exit_after_complete(True)
+        ctrl.disable_verify_tag_freq()
+        self.assertEqual(tuple(ctrl.center_freqs()), (0., 1.))
+
+        self.tb.connect(src, ctrl, self.vsink)
+        self.tb.run()
+
+        result = self.vsink.data()
+        expected_result = np.concatenate((np.arange(10010, 10110),
+                                          np.arange(20020, 20070)))
+        np.testing.assert_array_equal(result, expected_result)
+
+        ncopies = [pmt.to_uint64(pmt.dict_ref(tag.value,
+                                              pmt.intern("ncopy"),
+                                              pmt.PMT_NIL))
+                   for tag in self.vsink.tags()]
+        self.assertEqual(ncopies, [100, 50])
+
+        gains = [pmt.to_double(pmt.dict_ref(tag.value,
+                                            pmt.intern("gain"),
+                                            pmt.PMT_NIL))
+                 for tag in self.vsink.tags()]
+        self.assertEqual(gains, [30., 20.])
+
+    def test009(self):
+        """Test segment_start carries center freq, span and rx_time"""
+        time_tag = gr.tag_utils.python_to_tag({
+            "offset": 0,
+            "key": pmt.intern("rx_time"),
+            "value": pmt.make_tuple(pmt.from_uint64(10), pmt.from_double(0.5)),
+            "srcid": pmt.intern("qa")})
+        freq_tag = gr.tag_utils.python_to_tag({
+            "offset": 10000,
+            "key": pmt.intern("rx_freq"),
+            "value": pmt.from_double(1e9),
+            "srcid": pmt.intern("qa")})
+
+        nsamples = 10300
+        src_data = np.array([complex(x) for x in range(nsamples)])
+        src = blocks.vector_source_c(data=src_data, tags=[time_tag, freq_tag])
+
+        ctrl = usrpcalibrator.controller_cc([1e9], 0, 0, 200, 100)
+        ctrl.set_exit_after_complete(True)
+        ctrl.set_samp_rate(1000)
+        self.assertEqual(ctrl.samp_rate(), 1000)
+
+        self.tb.connect(src, ctrl, self.vsink)
+        self.tb.run()
+
+        tags = self.vsink.tags()
+        self.assertEqual(len(tags), 1)
+        value = tags[0].value
+
+        def ref(key):
+            return pmt.dict_ref(value, pmt.intern(key), pmt.PMT_NIL)
+
+        self.assertEqual(pmt.to_uint64(ref("index")), 0)
+        self.assertEqual(pmt.to_uint64(ref("span")), 0)
+        self.assertEqual(pmt.to_double(ref("freq")), 1e9)
+        self.assertEqual(pmt.to_double(ref("rx_freq")), 1e9)
+
+        # The first copied sample is 10200 samples at 1 kS/s after 10.5 s
+        rx_time = ref("rx_time")
+        self.assertEqual(pmt.to_uint64(pmt.tuple_ref(rx_time, 0)), 20)
+        self.assertAlmostEqual(pmt.to_double(pmt.tuple_ref(rx_time, 1)), 0.7)
+
+    def test010(self):
+        """Test center freqs posted to the freqs port, segments reported"""
+        tune_latency = 500
+        ncopy = 1000
+
+        src = usrpcalibrator.sim_tuner_source_c(tune_latency)
+        ctrl = usrpcalibrator.controller_cc([1e9], 0, 0, 100, ncopy)
+        ctrl.set_exit_after_complete(True)
+        dbg = blocks.message_debug()
+
+        self.tb.msg_connect(ctrl, "command", src, "command")
+        self.tb.msg_connect(ctrl, "segment", dbg, "store")
+        self.tb.connect(src, ctrl, self.vsink)
+
+        # Queued before the run, so applied before the first tune
+        ctrl.to_basic_block()._post(pmt.intern("freqs"),
+                                    pmt.init_f64vector(2, [3e9, 4e9]))
+        self.tb.run()
+
+        self.assertEqual(tuple(ctrl.center_freqs()), (3e9, 4e9))
+        self.assertEqual(len(self.vsink.data()), 2 * ncopy)
+
+        self.assertEqual(dbg.num_messages(), 2)
+        for n, freq in enumerate((3e9, 4e9)):
+            msg = dbg.get_message(n)
+            self.assertEqual(pmt.to_double(pmt.dict_ref(msg,
+                                                        pmt.intern("freq"),
+                                                        pmt.PMT_NIL)), freq)
+            self.assertEqual(pmt.to_uint64(pmt.dict_ref(msg,
+                                                        pmt.intern("offset"),
+                                                        pmt.PMT_NIL)), n * ncopy)
+
+    def test011(self):
+        """Test LO band ordering groups bands and alternates direction"""
+        cfreqs = [3e9, 1e9, 2e9, 4e9]
+        edges = [2.5e9]
+        ncopy = 1000
+
+        src = usrpcalibrator.sim_tuner_source_c(500)
+        src.set_lo_band_edges(edges, 5000)
+        ctrl = usrpcalibrator.controller_cc(cfreqs, 0, 0, 100, ncopy)
+        ctrl.set_exit_after_complete(True)
+        ctrl.set_lo_band_order(edges)
+        self.assertTrue(ctrl.lo_band_order())
+
+        self.tb.msg_connect(ctrl, "command", src, "command")
+        self.tb.connect(src, ctrl, self.vsink)
+        self.tb.run()
+        self.tb.run()
+
+        indices = [pmt.to_uint64(pmt.dict_ref(tag.value,
+                                              pmt.intern("index"),
+                                              pmt.PMT_NIL))
+                   for tag in self.vsink.tags()]
+        self.assertEqual(indices, [1, 2, 0, 3, 3, 0, 2, 1])
+
+        # Only 2e9 <-> 3e9 crosses the band edge, once per span
+        self.assertEqual(src.nband_crossings(), 2)
+
+    def test012(self):
+        """Test integer-N is chosen only where the LO error is tolerable"""
+        cfreqs = [1e9, 1.0005e9, 2.0000004e9]
+        ncopy = 1000
+
+        src = usrpcalibrator.sim_tuner_source_c(500)
+        ctrl = usrpcalibrator.controller_cc(cfreqs, 0, 0, 100, ncopy)
+        ctrl.set_exit_after_complete(True)
+        ctrl.set_auto_integer_tuning(1e3, 1e6)
+        self.assertTrue(ctrl.auto_integer_tuning())
+
+        self.tb.msg_connect(ctrl, "command", src, "command")
+        self.tb.connect(src, ctrl, self.vsink)
+        self.tb.run()
+
+        modes = [pmt.to_bool(pmt.dict_ref(tag.value,
+                                          pmt.intern("integer_n"),
+                                          pmt.PMT_NIL))
+                 for tag in self.vsink.tags()]
+        self.assertEqual(modes, [True, False, True])
+
+    def test013(self):
+        """Test a segment is re-acquired after an rx_time discontinuity"""
+        def tag(offset, key, value):
+            return gr.tag_utils.python_to_tag({
+                "offset": offset,
+                "key": pmt.intern(key),
+                "value": value,
+                "srcid": pmt.intern("qa")})
+
+        def rx_time(full_secs, frac_secs):
+            return pmt.make_tuple(pmt.from_uint64(full_secs),
+                                  pmt.from_double(frac_secs))
+
+        # Copying starts at 200; 100 samples are dropped before sample 300
+        tags = [tag(0, "rx_time", rx_time(10, 0.0)),
+                tag(100, "rx_freq", pmt.from_double(1e9)),
+                tag(250, "rx_time", rx_time(10, 0.25)),
+                tag(300, "rx_time", rx_time(10, 0.4))]
+
+        nsamples = 700
+        src_data = np.array([complex(x) for x in range(nsamples)])
+        src = blocks.vector_source_c(data=src_data, tags=tags)
+
+        ctrl = usrpcalibrator.controller_cc([1e9], 0, 0, 100, 300)
+        ctrl.set_exit_after_complete(True)
+        ctrl.set_samp_rate(1000)
+
+        self.tb.connect(src, ctrl, self.vsink)
+        self.tb.run()
+
+        # The abandoned attempt is followed by a full copy from the gap
+        expected_data = np.array([complex(x) for x in range(200, 600)])
+        self.assertComplexTuplesAlmostEqual(expected_data, self.vsink.data())
+        self.assertEqual(ctrl.nretries(), 1)
+
+        tags = self.vsink.tags()
+        self.assertEqual([tag.offset for tag in tags], [0, 100])
+
+        def ref(tag, key):
+            return pmt.dict_ref(tag.value, pmt.intern(key), pmt.PMT_NIL)
+
+        self.assertEqual([pmt.to_uint64(ref(tag, "index")) for tag in tags],
+                         [0, 0])
+        self.assertEqual([pmt.to_uint64(ref(tag, "retries")) for tag in tags],
+                         [0, 1])
+        self.assertAlmostEqual(
+            pmt.to_double(pmt.tuple_ref(ref(tags[1], "rx_time"), 1)), 0.4)
+
 
 if __name__ == '__main__':
     #import os
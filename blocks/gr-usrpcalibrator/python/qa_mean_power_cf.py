@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Douglas Anderson
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+import numpy as np
+
+from gnuradio import gr, gr_unittest
+from gnuradio import blocks
+import pmt
+import usrpcalibrator_swig as usrpcalibrator
+
+
+class qa_mean_power_cf(gr_unittest.TestCase):
+    def setUp(self):
+        self.tb = gr.top_block()
+
+    def tearDown(self):
+        self.tb = None
+
+    def test_001(self):
+        """Test skipped samples don't contribute to the measurement"""
+        nskip = 1000
+        nintegrate = 5000
+        # 1 V into 50 ohms is 10*log10(1/50) + 30 = 13.0103 dBm
+        src_data = np.concatenate((np.ones(nskip) * 10,
+                                   np.ones(nintegrate) * (0.6 + 0.8j),
+                                   np.ones(1000) * 10))
+        src = blocks.vector_source_c(src_data.tolist())
+        power = usrpcalibrator.mean_power_cf()
+        msg_debug = blocks.message_debug()
+        self.tb.connect(src, power)
+        self.tb.msg_connect(power, "power", msg_debug, "store")
+
+        self.assertFalse(power.done())
+        power.arm(nskip, nintegrate)
+        self.tb.run()
+
+        self.assertTrue(power.done())
+        expected_dbm = 10 * np.log10(1 / 50.) + 30
+        self.assertAlmostEqual(power.power_dbm(), expected_dbm, 4)
+
+        self.assertEqual(msg_debug.num_messages(), 1)
+        msg = msg_debug.get_message(0)
+        power_dbm = pmt.to_double(pmt.dict_ref(msg, pmt.intern("power_dbm"), pmt.PMT_NIL))
+        offset = pmt.to_uint64(pmt.dict_ref(msg, pmt.intern("offset"), pmt.PMT_NIL))
+        self.assertAlmostEqual(power_dbm, expected_dbm, 4)
+        self.assertEqual(offset, nskip)
+
+    def test_002(self):
+        """Test nothing is measured until armed"""
+        src = blocks.vector_source_c([1j] * 1000)
+        power = usrpcalibrator.mean_power_cf()
+        self.tb.connect(src, power)
+        self.tb.run()
+        self.assertFalse(power.done())
+
+    def test_003(self):
+        """Test arming at a device time located from rx_time/rx_rate tags"""
+        samp_rate = 1000.
+        nintegrate = 200
+        tags = []
+        for key, value in (("rx_time", pmt.make_tuple(pmt.from_uint64(100),
+                                                      pmt.from_double(0.25))),
+                           ("rx_rate", pmt.from_double(samp_rate))):
+            tag_dict = dict()
+            tag_dict["offset"] = 0
+            tag_dict["key"] = pmt.intern(key)
+            tag_dict["value"] = value
+            tag_dict["srcid"] = pmt.intern("qa")
+            tags.append(gr.tag_utils.python_to_tag(tag_dict))
+        # Device time 100.75 s is sample 500
+        src_data = np.concatenate((np.ones(500) * 10,
+                                   np.ones(nintegrate) * (0.6 + 0.8j),
+                                   np.ones(1000) * 10))
+        src = blocks.vector_source_c(src_data.tolist(), tags=tags)
+        power = usrpcalibrator.mean_power_cf()
+        msg_debug = blocks.message_debug()
+        self.tb.connect(src, power)
+        self.tb.msg_connect(power, "power", msg_debug, "store")
+
+        power.arm_at_time(100.75, nintegrate)
+        self.tb.run()
+
+        self.assertTrue(power.done())
+        self.assertAlmostEqual(power.power_dbm(), 10 * np.log10(1 / 50.) + 30, 4)
+        msg = msg_debug.get_message(0)
+        offset = pmt.to_uint64(pmt.dict_ref(msg, pmt.intern("offset"), pmt.PMT_NIL))
+        late = pmt.to_bool(pmt.dict_ref(msg, pmt.intern("late"), pmt.PMT_NIL))
+        self.assertEqual(offset, 500)
+        self.assertFalse(late)
+        self.assertFalse(power.late())
+
+    def test_004(self):
+        """Test a measurement armed for a device time already past is late"""
+        samp_rate = 1000.
+        nintegrate = 200
+        tags = []
+        for key, value in (("rx_time", pmt.make_tuple(pmt.from_uint64(100),
+                                                      pmt.from_double(0.25))),
+                           ("rx_rate", pmt.from_double(samp_rate))):
+            tag_dict = dict()
+            tag_dict["offset"] = 0
+            tag_dict["key"] = pmt.intern(key)
+            tag_dict["value"] = value
+            tag_dict["srcid"] = pmt.intern("qa")
+            tags.append(gr.tag_utils.python_to_tag(tag_dict))
+        src = blocks.vector_source_c([0.6 + 0.8j] * 1000, tags=tags)
+        power = usrpcalibrator.mean_power_cf()
+        self.tb.connect(src, power)
+
+        # Device time 100.0 s is before the first sample
+        power.arm_at_time(100.0, nintegrate)
+        self.tb.run()
+
+        self.assertTrue(power.done())
+        self.assertTrue(power.late())
+
+
+if __name__ == '__main__':
+    gr_unittest.run(qa_mean_power_cf, "qa_mean_power_cf.xml")
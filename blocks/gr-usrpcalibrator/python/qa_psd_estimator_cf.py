@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Douglas Anderson
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+import numpy as np
+
+from gnuradio import gr, gr_unittest
+from gnuradio import blocks
+import pmt
+import usrpcalibrator_swig as usrpcalibrator
+
+
+def expected_psd(data, fft_len, naverages, window, scale_factor):
+    """Reference implementation of the chain psd_estimator_cf replaces"""
+    window = np.array(window)
+    window_pwr = fft_len * np.sum(window**2)
+    power_scalar = -10.0 * np.log10(window_pwr * 50)
+    frames = np.reshape(data * scale_factor, (-1, fft_len)) * window
+    mag_sq = np.abs(np.fft.fftshift(np.fft.fft(frames), axes=1))**2
+    avgs = np.mean(np.reshape(mag_sq, (-1, naverages, fft_len)), axis=1)
+    return (10 * np.log10(avgs) + 30 + power_scalar).flatten()
+
+
+class qa_psd_estimator_cf(gr_unittest.TestCase):
+    def setUp(self):
+        self.tb = gr.top_block()
+        np.random.seed(0)
+
+    def tearDown(self):
+        self.tb = None
+
+    def run_psd(self, src_data, fft_len, naverages, window, scale_factor):
+        src = blocks.vector_source_c(src_data)
+        psd = usrpcalibrator.psd_estimator_cf(fft_len,
+                                              naverages,
+                                              window,
+                                              scale_factor)
+        dst = blocks.vector_sink_f(fft_len)
+        self.tb.connect(src, psd, dst)
+        self.tb.run()
+        return dst.data()
+
+    def test_001(self):
+        """Test single average, rectangular window"""
+        fft_len = 16
+        naverages = 1
+        src_data = (np.random.randn(fft_len * 4) +
+                    1j*np.random.randn(fft_len * 4))
+        window = [1.0] * fft_len
+        expected_result = expected_psd(src_data, fft_len, naverages, window, 1)
+        result_data = self.run_psd(src_data, fft_len, naverages, [], 1)
+        self.assertFloatTuplesAlmostEqual(expected_result, result_data, 3)
+
+    def test_002(self):
+        """Test averaging with window and scale factor"""
+        fft_len = 64
+        naverages = 5
+        nsamples = fft_len * naverages * 3
+        src_data = (np.random.randn(nsamples) + 1j*np.random.randn(nsamples))
+        window = np.hanning(fft_len)
+        scale_factor = 0.0028
+        expected_result = expected_psd(src_data, fft_len, naverages, window,
+                                       scale_factor)
+        result_data = self.run_psd(src_data, fft_len, naverages, window,
+                                   scale_factor)
+        self.assertEqual(len(result_data), fft_len * 3)
+        self.assertFloatTuplesAlmostEqual(expected_result, result_data, 3)
+
+    def test_003(self):
+        """Test partial average at end of stream is not produced"""
+        fft_len = 32
+        naverages = 4
+        nsamples = fft_len * (naverages * 2 + 1)
+        src_data = (np.random.randn(nsamples) + 1j*np.random.randn(nsamples))
+        result_data = self.run_psd(src_data, fft_len, naverages, [], 1)
+        self.assertEqual(len(result_data), fft_len * 2)
+
+    def test_004(self):
+        """Test segment_start tags set the frames in each average"""
+        fft_len = 32
+        naverages = 4
+        nsamples = fft_len * 5
+        src_data = (np.random.randn(nsamples) + 1j*np.random.randn(nsamples))
+
+        # The second segment announces 3 frames, but the third starts after 2
+        tags = []
+        for index, (frame, ncopy) in enumerate([(0, 64), (2, 96), (4, 32)]):
+            value = pmt.make_dict()
+            value = pmt.dict_add(value, pmt.intern("index"),
+                                 pmt.from_uint64(index))
+            value = pmt.dict_add(value, pmt.intern("ncopy"),
+                                 pmt.from_uint64(ncopy))
+            tags.append(gr.tag_utils.python_to_tag({
+                "offset": frame * fft_len,
+                "key": pmt.intern("segment_start"),
+                "value": value,
+                "srcid": pmt.intern("qa")}))
+
+        src = blocks.vector_source_c(src_data, tags=tags)
+        psd = usrpcalibrator.psd_estimator_cf(fft_len, naverages, [], 1)
+        dst = blocks.vector_sink_f(fft_len)
+        self.tb.connect(src, psd, dst)
+        self.tb.run()
+
+        window = [1.0] * fft_len
+        expected_result = np.concatenate([
+            expected_psd(src_data[0:64], fft_len, 2, window, 1),
+            expected_psd(src_data[64:128], fft_len, 2, window, 1),
+            expected_psd(src_data[128:160], fft_len, 1, window, 1)])
+        self.assertFloatTuplesAlmostEqual(expected_result, dst.data(), 3)
+
+        offsets = [tag.offset for tag in dst.tags()]
+        self.assertEqual(offsets, [0, 1, 2])
+
+    def test_005(self):
+        """Test a retried segment discards the abandoned attempt"""
+        fft_len = 32
+        nsamples = 272
+        src_data = (np.random.randn(nsamples) + 1j*np.random.randn(nsamples))
+
+        # Segment 0 is abandoned part way through its third frame
+        tags = []
+        for offset, index, ncopy, retries in [(0, 0, 128, 0),
+                                              (80, 0, 128, 1),
+                                              (208, 1, 64, 0)]:
+            value = pmt.make_dict()
+            value = pmt.dict_add(value, pmt.intern("index"),
+                                 pmt.from_uint64(index))
+            value = pmt.dict_add(value, pmt.intern("ncopy"),
+                                 pmt.from_uint64(ncopy))
+            value = pmt.dict_add(value, pmt.intern("retries"),
+                                 pmt.from_uint64(retries))
+            tags.append(gr.tag_utils.python_to_tag({
+                "offset": offset,
+                "key": pmt.intern("segment_start"),
+                "value": value,
+                "srcid": pmt.intern("qa")}))
+
+        src = blocks.vector_source_c(src_data, tags=tags)
+        psd = usrpcalibrator.psd_estimator_cf(fft_len, 4, [], 1)
+        dst = blocks.vector_sink_f(fft_len)
+        self.tb.connect(src, psd, dst)
+        self.tb.run()
+
+        window = [1.0] * fft_len
+        expected_result = np.concatenate([
+            expected_psd(src_data[80:208], fft_len, 4, window, 1),
+            expected_psd(src_data[208:272], fft_len, 2, window, 1)])
+        self.assertFloatTuplesAlmostEqual(expected_result, dst.data(), 3)
+
+        retries = [pmt.to_uint64(pmt.dict_ref(tag.value,
+                                              pmt.intern("retries"),
+                                              pmt.PMT_NIL))
+                   for tag in dst.tags()]
+        self.assertEqual([tag.offset for tag in dst.tags()], [0, 1])
+        self.assertEqual(retries, [1, 0])
+
+    def test_006(self):
+        """Test max-hold and relative variance outputs"""
+        fft_len = 64
+        naverages = 10
+        nsamples = fft_len * naverages * 2
+        src_data = (np.random.randn(nsamples) + 1j*np.random.randn(nsamples))
+        window = np.hanning(fft_len)
+        scale_factor = 0.0028
+
+        src = blocks.vector_source_c(src_data)
+        psd = usrpcalibrator.psd_estimator_cf(fft_len, naverages, window,
+                                              scale_factor)
+        dst_mean = blocks.vector_sink_f(fft_len)
+        dst_max = blocks.vector_sink_f(fft_len)
+        dst_var = blocks.vector_sink_f(fft_len)
+        self.tb.connect(src, psd)
+        self.tb.connect((psd, 0), dst_mean)
+        self.tb.connect((psd, 1), dst_max)
+        self.tb.connect((psd, 2), dst_var)
+        self.tb.run()
+
+        # Per-frame power in dBm, grouped by average
+        frame_dbm = np.reshape(expected_psd(src_data, fft_len, 1, window,
+                                            scale_factor),
+                               (-1, naverages, fft_len))
+        frame_pwr = 10**(frame_dbm / 10)
+        mean_pwr = np.mean(frame_pwr, axis=1)
+        expected_max = np.max(frame_dbm, axis=1).flatten()
+        expected_var = (np.var(frame_pwr, axis=1) /
+                        (mean_pwr**2 * naverages)).flatten()
+
+        self.assertFloatTuplesAlmostEqual(
+            expected_psd(src_data, fft_len, naverages, window, scale_factor),
+            dst_mean.data(), 3)
+        self.assertFloatTuplesAlmostEqual(expected_max, dst_max.data(), 3)
+        self.assertFloatTuplesAlmostEqual(expected_var, dst_var.data(), 3)
+
+    def test_007(self):
+        """Test segments at other gains are corrected to the reference gain"""
+        fft_len = 32
+        nsamples = fft_len * 4
+        src_data = (np.random.randn(nsamples) + 1j*np.random.randn(nsamples))
+
+        tags = []
+        for frame, gain in [(0, 30.), (2, 20.)]:
+            value = pmt.make_dict()
+            value = pmt.dict_add(value, pmt.intern("ncopy"),
+                                 pmt.from_uint64(2 * fft_len))
+            value = pmt.dict_add(value, pmt.intern("gain"),
+                                 pmt.from_double(gain))
+            tags.append(gr.tag_utils.python_to_tag({
+                "offset": frame * fft_len,
+                "key": pmt.intern("segment_start"),
+                "value": value,
+                "srcid": pmt.intern("qa")}))
+
+        src = blocks.vector_source_c(src_data, tags=tags)
+        psd = usrpcalibrator.psd_estimator_cf(fft_len, 2, [], 1)
+        psd.set_reference_gain(30)
+        dst = blocks.vector_sink_f(fft_len)
+        self.tb.connect(src, psd, dst)
+        self.tb.run()
+
+        # The second segment was received 10 dB lower
+        expected_result = expected_psd(src_data, fft_len, 2, [1.0] * fft_len, 1)
+        expected_result[fft_len:] += 10
+        self.assertFloatTuplesAlmostEqual(expected_result, dst.data(), 3)
+
+
+if __name__ == '__main__':
+    gr_unittest.run(qa_psd_estimator_cf, "qa_psd_estimator_cf.xml")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Douglas Anderson
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+import numpy as np
+
+from gnuradio import gr, gr_unittest
+from gnuradio import blocks
+import pmt
+import usrpcalibrator_swig as usrpcalibrator
+
+
+class qa_sim_tuner_source_c(gr_unittest.TestCase):
+    def setUp(self):
+        self.tb = gr.top_block()
+
+    def tearDown(self):
+        self.tb = None
+
+    def test_001(self):
+        """Test rx_freq is tagged tune_latency samples after a command"""
+        tune_latency = 1000
+        nsamples = 5000
+        src = usrpcalibrator.sim_tuner_source_c(tune_latency)
+        self.assertEqual(src.tune_latency(), tune_latency)
+        head = blocks.head(gr.sizeof_gr_complex, nsamples)
+        tag_debug = blocks.tag_debug(gr.sizeof_gr_complex, "Tag debug")
+        tag_debug.set_display(False)
+        vsink = blocks.vector_sink_c()
+        self.tb.connect(src, head, tag_debug)
+        self.tb.connect(head, vsink)
+
+        cmd = pmt.make_dict()
+        cmd = pmt.dict_add(cmd, pmt.intern("freq"), pmt.from_double(1e9))
+        cmd = pmt.dict_add(cmd, pmt.intern("lo_offset"), pmt.from_double(0.0))
+        src.to_basic_block()._post(pmt.intern("command"), cmd)
+        self.tb.run()
+
+        result = vsink.data()
+        np.testing.assert_array_equal(result, np.arange(nsamples))
+
+        tags = [t for t in tag_debug.current_tags()
+                if pmt.symbol_to_string(t.key) == "rx_freq"]
+        self.assertEqual(len(tags), 1)
+        self.assertEqual(tags[0].offset, tune_latency)
+        self.assertEqual(pmt.to_double(tags[0].value), 1e9)
+
+
+if __name__ == '__main__':
+    gr_unittest.run(qa_sim_tuner_source_c, "qa_sim_tuner_source_c.xml")
@@ -20,6 +20,7 @@
 #
 
 import numpy as np
+import pmt
 
 from gnuradio import gr, gr_unittest
 from gnuradio import blocks
@@ -119,6 +120,174 @@ class qa_stitch_fft_segments_ff(gr_unittest.TestCase):
         self.assertFloatTuplesAlmostEqual(expected_result, result_data, 6)
         self.assertEqual(len(result_data), n_valid_bins*n_segments)
 
+    def test_003(self):
+        """Test every input item is stitched"""
+        overlap = 0.25
+        fft_size = 8
+        n_segments = 2
+        n_valid_bins = 6
+        nitems = 50
+        src_data = np.concatenate([np.arange(16) + 100*i for i in range(nitems)])
+        expected_result = np.concatenate([
+            np.concatenate((np.arange(1, 7), np.arange(9, 15))) + 100*i
+            for i in range(nitems)
+        ])
+        src = blocks.vector_source_f(src_data)
+        s2v = blocks.stream_to_vector(gr.sizeof_float, fft_size * n_segments)
+        stitch = usrpcalibrator.stitch_fft_segments_ff(fft_size,
+                                                       n_segments,
+                                                       overlap,
+                                                       n_valid_bins)
+        dst = blocks.vector_sink_f(n_valid_bins * n_segments)
+        self.tb.connect(src, s2v, stitch, dst)
+        self.tb.run()
+        result_data = dst.data()
+        self.assertEqual(len(result_data), n_valid_bins*n_segments*nitems)
+        self.assertFloatTuplesAlmostEqual(expected_result, result_data, 6)
+
+    def test_004(self):
+        """Test averaging overlapping bins in linear power"""
+        overlap = 0.25
+        fft_size = 8
+        n_segments = 2
+        n_valid_bins = 6
+        src_data = np.array([1] * fft_size + [3] * fft_size)
+        mean_db = 10 * np.log10((10**0.1 + 10**0.3) / 2)
+        expected_result = np.array([1, 1, 1, 1, 1, mean_db, mean_db,
+                                    3, 3, 3, 3, 3])
+        src = blocks.vector_source_f(src_data)
+        s2v = blocks.stream_to_vector(gr.sizeof_float, fft_size * n_segments)
+        stitch = usrpcalibrator.stitch_fft_segments_ff(fft_size,
+                                                       n_segments,
+                                                       overlap,
+                                                       n_valid_bins)
+        self.assertFalse(stitch.average_overlap())
+        stitch.set_average_overlap(True)
+        self.assertTrue(stitch.average_overlap())
+        dst = blocks.vector_sink_f(n_valid_bins * n_segments)
+        self.tb.connect(src, s2v, stitch, dst)
+        self.tb.run()
+        result_data = dst.data()
+        self.assertFloatTuplesAlmostEqual(expected_result, result_data, 6)
+
+    def test_005(self):
+        """Test stitching tagged segments that arrive out of order"""
+        overlap = 0.25
+        fft_size = 8
+        n_segments = 2
+        n_valid_bins = 6
+        # Second segment arrives first, then both segments of the next span
+        src_data = np.concatenate((np.arange(6, 14),
+                                   np.arange(0, 8),
+                                   np.arange(100, 108),
+                                   np.arange(106, 114)))
+        expected_result = np.concatenate((np.arange(1, 13),
+                                          np.arange(101, 113)))
+        tags = []
+        for offset, index in enumerate((1, 0, 0, 1)):
+            tag_dict = dict()
+            tag_dict["offset"] = offset
+            tag_dict["key"] = pmt.intern("segment_start")
+            tag_dict["value"] = pmt.dict_add(pmt.make_dict(),
+                                             pmt.intern("index"),
+                                             pmt.from_uint64(index))
+            tag_dict["srcid"] = pmt.intern("qa")
+            tags.append(gr.tag_utils.python_to_tag(tag_dict))
+        src = blocks.vector_source_f(src_data, vlen=fft_size, tags=tags)
+        stitch = usrpcalibrator.stitch_fft_segments_ff(fft_size,
+                                                       n_segments,
+                                                       overlap,
+                                                       n_valid_bins,
+                                                       True)
+        dst = blocks.vector_sink_f(n_valid_bins * n_segments)
+        self.tb.connect(src, stitch, dst)
+        self.tb.run()
+        result_data = dst.data()
+        self.assertEqual(len(result_data), n_valid_bins*n_segments*2)
+        self.assertFloatTuplesAlmostEqual(expected_result, result_data, 6)
+
+    def test_006(self):
+        """Test untagged segments are stitched in arrival order"""
+        overlap = 0.25
+        fft_size = 8
+        n_segments = 2
+        n_valid_bins = 6
+        src_data = np.array([ 0,  1,  2,  3,  4,  5,  6,  7,  6,  7,  8,  9, 10, 11, 12, 13])
+        expected_result = np.array([ 1,  2,  3,  4,  5,  6,  7,  8,  9, 10, 11, 12])
+        src = blocks.vector_source_f(src_data, vlen=fft_size)
+        stitch = usrpcalibrator.stitch_fft_segments_ff(fft_size,
+                                                       n_segments,
+                                                       overlap,
+                                                       n_valid_bins,
+                                                       True)
+        dst = blocks.vector_sink_f(n_valid_bins * n_segments)
+        self.tb.connect(src, stitch, dst)
+        self.tb.run()
+        result_data = dst.data()
+        self.assertFloatTuplesAlmostEqual(expected_result, result_data, 6)
+
+    def test_007(self):
+        """Test a partial span is dropped when the next span starts"""
+        overlap = 0.25
+        fft_size = 8
+        n_segments = 2
+        n_valid_bins = 6
+        # Span 0 lost its second segment
+        src_data = np.concatenate((np.arange(50, 58),
+                                   np.arange(0, 8),
+                                   np.arange(6, 14)))
+        expected_result = np.arange(1, 13)
+        tags = []
+        for offset, (span, index) in enumerate(((0, 0), (1, 0), (1, 1))):
+            value = pmt.make_dict()
+            value = pmt.dict_add(value, pmt.intern("index"),
+                                 pmt.from_uint64(index))
+            value = pmt.dict_add(value, pmt.intern("span"),
+                                 pmt.from_uint64(span))
+            tag_dict = dict()
+            tag_dict["offset"] = offset
+            tag_dict["key"] = pmt.intern("segment_start")
+            tag_dict["value"] = value
+            tag_dict["srcid"] = pmt.intern("qa")
+            tags.append(gr.tag_utils.python_to_tag(tag_dict))
+        src = blocks.vector_source_f(src_data, vlen=fft_size, tags=tags)
+        stitch = usrpcalibrator.stitch_fft_segments_ff(fft_size,
+                                                       n_segments,
+                                                       overlap,
+                                                       n_valid_bins,
+                                                       True)
+        dst = blocks.vector_sink_f(n_valid_bins * n_segments)
+        self.tb.connect(src, stitch, dst)
+        self.tb.run()
+        result_data = dst.data()
+        self.assertFloatTuplesAlmostEqual(expected_result, result_data, 6)
+
+
+    def test_008(self):
+        """Test overlap is averaged with the bins' weights"""
+        overlap = 0.5
+        fft_size = 8
+        n_segments = 2
+        n_valid_bins = 4
+        src_data = np.array([10] * fft_size + [20] * fft_size)
+        # The outer bins are left out, the next ones count for half
+        weights = [0, 0.5, 1, 1, 1, 1, 0.5, 0]
+        expected_result = np.array([10, 10, 10,
+                                    10 * np.log10((10 + 0.5 * 100) / 1.5),
+                                    10 * np.log10((0.5 * 10 + 100) / 1.5),
+                                    20, 20, 20])
+        src = blocks.vector_source_f(src_data, vlen=fft_size * n_segments)
+        stitch = usrpcalibrator.stitch_fft_segments_ff(fft_size,
+                                                       n_segments,
+                                                       overlap,
+                                                       n_valid_bins)
+        stitch.set_average_overlap(True)
+        stitch.set_bin_weights(weights)
+        self.assertFloatTuplesAlmostEqual(weights, stitch.bin_weights(), 6)
+        dst = blocks.vector_sink_f(n_valid_bins * n_segments)
+        self.tb.connect(src, stitch, dst)
+        self.tb.run()
+        self.assertFloatTuplesAlmostEqual(expected_result, dst.data(), 5)
 
 
 if __name__ == '__main__':
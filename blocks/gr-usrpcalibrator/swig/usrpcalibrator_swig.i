@@ -12,6 +12,9 @@
 #include "usrpcalibrator/stitch_fft_segments_ff.h"
 #include "usrpcalibrator/controller_cc.h"
 #include "usrpcalibrator/skiphead_reset.h"
+#include "usrpcalibrator/psd_estimator_cf.h"
+#include "usrpcalibrator/sim_tuner_source_c.h"
+#include "usrpcalibrator/mean_power_cf.h"
 %}
 
 %include "usrpcalibrator/bin_statistics_ff.h"
@@ -22,3 +25,9 @@ GR_SWIG_BLOCK_MAGIC2(usrpcalibrator, stitch_fft_segments_ff);
 GR_SWIG_BLOCK_MAGIC2(usrpcalibrator, controller_cc);
 %include "usrpcalibrator/skiphead_reset.h"
 GR_SWIG_BLOCK_MAGIC2(usrpcalibrator, skiphead_reset);
+%include "usrpcalibrator/psd_estimator_cf.h"
+GR_SWIG_BLOCK_MAGIC2(usrpcalibrator, psd_estimator_cf);
+%include "usrpcalibrator/sim_tuner_source_c.h"
+GR_SWIG_BLOCK_MAGIC2(usrpcalibrator, sim_tuner_source_c);
+%include "usrpcalibrator/mean_power_cf.h"
+GR_SWIG_BLOCK_MAGIC2(usrpcalibrator, mean_power_cf);
@@ -0,0 +1,33 @@
+from __future__ import print_function
+
+import sys
+
+try:
+    import visa
+except ImportError, visa_import_error:
+    msg =  "USRPCalibrator uses PyVisa-py to control test equipment\n\n"
+    msg += "$ pip install pyvisa-py"
+    print(msg, file=sys.stderr)
+
+
+# Profile key naming the VISA resource of each kind of instrument
+CONNECT_STR_KEYS = {
+    'power_meter': 'powermeter_visa_connect_str',
+    'signal_generator': 'siggen_visa_connect_str',
+    'switch': 'switchdriver_visa_connect_str',
+}
+
+
+def open_resource(connect_str):
+    """Open a VISA resource with PyVisa-py.
+
+    Raw ::SOCKET resources (e.g., the bench simulator in
+    instruments.simulator) have no message framing, so they are set up to
+    terminate reads and writes with a newline.
+    """
+    rm = visa.ResourceManager('@py')
+    resource = rm.open_resource(connect_str)
+    if connect_str.upper().endswith('::SOCKET'):
+        resource.read_termination = '\n'
+        resource.write_termination = '\n'
+    return resource
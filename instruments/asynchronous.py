@@ -0,0 +1,341 @@
+"""Asynchronous wrappers that overlap operations on independent instruments.
+
+PowerMeter, SignalGenerator, SwitchDriver and RadioInterface block on
+each SCPI write/query or USRP capture, so a test calling them one after
+another waits for the sum of their latencies. The wrappers here submit
+each call to a worker thread for its instrument and return an Operation
+(a future) at once, so e.g. the signal generator and power meter can be
+set up while the USRP retunes:
+
+    siggen = AsyncSignalGenerator(bench.signal_generator(profile), timer)
+    meter = AsyncPowerMeter(bench.power_meter(profile), timer)
+    wait_all([siggen.set_frequency(fc), meter.set_frequency(fc)])
+
+Calls on one instrument still run one at a time, in the order they were
+submitted, since a VISA session is not safe to share between threads.
+
+The scripts are Python 2, so this uses threads rather than asyncio.
+Python can't interrupt a thread blocked in an instrument read: cancelling
+an Operation (or timing out waiting for it) stops it from starting, and
+discards its result if it already has. Anything else using an instrument
+that has been wrapped, e.g. Bench.release(), must drain() it first, and
+give up on it if a stuck call never returns.
+"""
+
+from __future__ import division, print_function
+
+from collections import deque
+from contextlib import contextmanager
+import sys
+import threading
+import time
+import weakref
+
+
+class OperationTimeout(RuntimeError):
+    pass
+
+
+class OperationCancelled(RuntimeError):
+    pass
+
+
+class Operation(object):
+    """Future for one call on an instrument's worker thread.
+
+    Times are seconds since the epoch, None until the call starts/ends.
+    If sys.stdout directs each thread's output to its own target (e.g.,
+    usrp_daemon.py's ThreadLocalStream), the call's output goes to output.
+    """
+    def __init__(self, name, fn, args, timeout=None, output=None):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.timeout = timeout
+        self.output = output
+        self.cancelled = False
+        self.start_time = None
+        self.end_time = None
+        self._result = None
+        self._error = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self):
+        """Call fn on the worker thread unless cancelled first"""
+        with self._lock:
+            if self.cancelled:
+                return
+            self.start_time = time.time()
+        redirect = hasattr(sys.stdout, 'set_target')
+        if redirect:
+            sys.stdout.set_target(self.output)
+        try:
+            self._result = self.fn(*self.args)
+        except Exception:
+            self._error = sys.exc_info()
+        finally:
+            if redirect:
+                sys.stdout.set_target(None)
+        self.end_time = time.time()
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        """Keep the operation from starting, return False if it already had"""
+        with self._lock:
+            self.cancelled = True
+            if self.start_time is not None:
+                return False
+        self._done.set()
+        return True
+
+    def result(self, timeout=None):
+        """Wait for the call and return its result or raise its exception.
+
+        timeout defaults to the instrument's. If the call isn't done in
+        time, it is cancelled and OperationTimeout is raised.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if not self._done.wait(timeout):
+            self.cancel()
+            errmsg = "{} did not complete within {} s"
+            raise OperationTimeout(errmsg.format(self.name, timeout))
+        if self.start_time is None:
+            raise OperationCancelled("{} was cancelled".format(self.name))
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._result
+
+
+def wait_all(operations, timeout=None):
+    """Return the results of operations, in order.
+
+    If one fails or times out, the rest are cancelled and its exception is
+    raised.
+    """
+    try:
+        return [op.result(timeout) for op in operations]
+    except Exception:
+        for op in operations:
+            op.cancel()
+        raise
+
+
+class InstrumentWorker(object):
+    """Run one instrument's operations in submission order.
+
+    The worker thread is started when an operation is submitted and exits
+    when none are left, so idle instruments hold no threads.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.queue = deque()
+        self.thread = None
+
+    def submit(self, operation):
+        with self.lock:
+            self.queue.append(operation)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name=self.name)
+                self.thread.daemon = True
+                self.thread.start()
+        return operation
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.queue:
+                    self.thread = None
+                    return
+                operation = self.queue.popleft()
+            operation.run()
+
+    def cancel_pending(self):
+        """Cancel operations that haven't started"""
+        with self.lock:
+            for operation in self.queue:
+                operation.cancel()
+
+    def join(self, timeout=None):
+        """Wait for the worker thread to finish its operations.
+
+        Return False if it is still running after timeout seconds.
+        """
+        with self.lock:
+            thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+
+# One worker per instrument, shared by every wrapper of it
+_workers = weakref.WeakKeyDictionary()
+_workers_lock = threading.Lock()
+
+
+def instrument_worker(instrument):
+    with _workers_lock:
+        worker = _workers.get(instrument)
+        if worker is None:
+            worker = _workers[instrument] = InstrumentWorker(
+                type(instrument).__name__)
+        return worker
+
+
+def drain(instrument, timeout=None):
+    """Cancel instrument's queued operations and wait for a running one.
+
+    Call before using the instrument directly, e.g., after an operation
+    timed out while its VISA call is still running. Return False if the
+    operation is still running after timeout seconds.
+    """
+    with _workers_lock:
+        worker = _workers.get(instrument)
+    if worker is None:
+        return True
+    worker.cancel_pending()
+    return worker.join(timeout)
+
+
+class AsyncInstrument(object):
+    """Base class for an instrument whose methods return Operations.
+
+    Operations are recorded by timer (an OverlapTimer) if given. timeout is
+    the default seconds to wait in Operation.result(), None to wait forever.
+    """
+    def __init__(self, instrument, timer=None, timeout=None):
+        self.instrument = instrument
+        self.timer = timer
+        self.timeout = timeout
+        self.worker = instrument_worker(instrument)
+
+    def submit(self, method, *args):
+        name = "{}.{}".format(type(self.instrument).__name__, method)
+        # Print on the worker thread where the submitting thread would
+        output = None
+        if hasattr(sys.stdout, 'target'):
+            output = sys.stdout.target()
+        operation = Operation(name,
+                              getattr(self.instrument, method),
+                              args,
+                              self.timeout,
+                              output)
+        if self.timer is not None:
+            self.timer.record(operation)
+        return self.worker.submit(operation)
+
+    def cancel_pending(self):
+        self.worker.cancel_pending()
+
+
+class AsyncPowerMeter(AsyncInstrument):
+    def set_frequency(self, freq):
+        return self.submit('set_frequency', freq)
+
+    def take_measurement(self):
+        return self.submit('take_measurement')
+
+
+class AsyncSignalGenerator(AsyncInstrument):
+    def rf_on(self):
+        return self.submit('rf_on')
+
+    def rf_off(self):
+        return self.submit('rf_off')
+
+    def set_amplitude(self, ampl):
+        return self.submit('set_amplitude', ampl)
+
+    def set_frequency(self, freq):
+        return self.submit('set_frequency', freq)
+
+
+class AsyncSwitchDriver(AsyncInstrument):
+    def select_radio(self, profile=None):
+        return self.submit('select_radio', profile)
+
+    def select_meter(self):
+        return self.submit('select_meter')
+
+
+class AsyncRadio(AsyncInstrument):
+    """RadioInterface captures and tuning, overlapped with SCPI I/O"""
+    def set_frequency(self, freq):
+        return self.submit('set_frequency', freq)
+
+    def measure_power(self, nskip=None, nsamples=None):
+        return self.submit('measure_power', nskip, nsamples)
+
+
+def union_time(intervals):
+    """Return seconds covered by at least one (start, end) interval"""
+    total = 0
+    covered_until = None
+    for start, end in sorted(intervals):
+        if covered_until is not None:
+            start = max(start, covered_until)
+        if end > start:
+            total += end - start
+        covered_until = end if covered_until is None else max(covered_until, end)
+    return total
+
+
+class OverlapTimer(object):
+    """Report how much instrument time each loop iteration overlapped.
+
+    Operations submitted inside an iteration() block are attributed to it.
+    For each iteration, report() shows the wall-clock time, the summed
+    time instruments were busy, and the overlap: busy time that ran
+    concurrently with another operation, i.e., what running the same
+    operations one after another would have added.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.iterations = []  # (label, [start, end, operations])
+        self.current = None
+
+    def record(self, operation):
+        with self.lock:
+            if self.current is not None:
+                self.current[2].append(operation)
+
+    @contextmanager
+    def iteration(self, label):
+        iteration = [time.time(), None, []]
+        with self.lock:
+            self.iterations.append((label, iteration))
+            self.current = iteration
+        try:
+            yield
+        finally:
+            with self.lock:
+                iteration[1] = time.time()
+                self.current = None
+
+    def report(self):
+        print("Instrument overlap report:")
+        fmt = "  {:<28} {:>6} {:>9} {:>9} {:>11} {:>8}"
+        print(fmt.format("iteration", "ops", "wall (s)", "busy (s)",
+                         "overlap (s)", "of wall"))
+        with self.lock:
+            iterations = list(self.iterations)
+        for label, (start, end, operations) in iterations:
+            if end is None:
+                continue
+            intervals = [(op.start_time, op.end_time) for op in operations
+                         if op.end_time is not None]
+            busy = sum(e - s for s, e in intervals)
+            overlap = busy - union_time(intervals)
+            wall = end - start
+            print(fmt.format(label,
+                             len(intervals),
+                             "{:.3f}".format(wall),
+                             "{:.3f}".format(busy),
+                             "{:.3f}".format(overlap),
+                             "{:.0%}".format(overlap / wall if wall else 0)))
@@ -0,0 +1,153 @@
+from __future__ import print_function
+
+from contextlib import contextmanager
+import sys
+
+from instruments import CONNECT_STR_KEYS
+from instruments.asynchronous import drain
+from instruments.powermeter import PowerMeter
+from instruments.radio import RadioInterface
+from instruments.signalgenerator import SignalGenerator
+from instruments.simulator import Simulator
+from instruments.switchdriver import SwitchDriver
+
+
+class Bench(object):
+    """Instruments kept open from one test to the next.
+
+    Opening a USRP (which reloads B2xx firmware and FPGA images) and
+    presetting the signal generator take seconds each. A Bench opens an
+    instrument the first time a test asks for it and hands the same
+    instance to later tests whose profile names the same device, updated
+    with the new profile.
+
+    Tests running at the same time must each use their own session() and
+    must not share a device, see scheduler.py.
+
+    An instrument still busy drain_timeout seconds after a test ends, e.g.
+    stuck in a VISA read, is dropped from the bench rather than waited
+    for. The next test to ask for it opens it again.
+    """
+    def __init__(self, make_radio=RadioInterface, drain_timeout=10):
+        self.makers = {
+            'radio': make_radio,
+            'power_meter': PowerMeter,
+            'signal_generator': SignalGenerator,
+            'switch': SwitchDriver,
+        }
+        self.drain_timeout = drain_timeout
+        self.instruments = {}  # key -> open instrument
+        self.opened = set()    # keys opened through this Bench
+
+    @staticmethod
+    def key(kind, profile):
+        """Return the name of the device profile uses as kind.
+
+        kind is 'radio', 'power_meter', 'signal_generator' or 'switch'.
+        """
+        if kind == 'radio':
+            ids = (profile.usrp_device_type,
+                   profile.usrp_serial,
+                   profile.usrp_ip_address,
+                   profile.usrp_device_name,
+                   profile.usrp_stream_args)
+            return "USRP " + " ".join(str(i) for i in ids if i is not None)
+        return "{} {}".format(kind, getattr(profile, CONNECT_STR_KEYS[kind]))
+
+    def open(self, kind, profile):
+        key = self.key(kind, profile)
+        instrument = self.instruments.get(key)
+        if instrument is None:
+            instrument = self.instruments[key] = self.makers[kind](profile)
+        else:
+            print("Reusing open {}".format(key))
+            if kind == 'radio':
+                instrument.set_profile(profile)
+            else:
+                instrument.profile = profile
+        self.opened.add(key)
+        return instrument
+
+    def radio(self, profile):
+        return self.open('radio', profile)
+
+    def power_meter(self, profile):
+        return self.open('power_meter', profile)
+
+    def signal_generator(self, profile):
+        return self.open('signal_generator', profile)
+
+    def switch(self, profile):
+        return self.open('switch', profile)
+
+    def session(self):
+        """Return a Bench sharing these instruments for one test.
+
+        The session's release() only affects instruments the test opened.
+        """
+        session = Bench(self.makers['radio'], self.drain_timeout)
+        session.instruments = self.instruments
+        return session
+
+    def drain(self, key):
+        """Wait for operations on an instrument, return False if dropped"""
+        # An operation that timed out may still be using the instrument
+        if drain(self.instruments[key], self.drain_timeout):
+            return True
+        print("{} still busy after {} s, marking it unusable".format(
+            key, self.drain_timeout), file=sys.stderr)
+        del self.instruments[key]
+        return False
+
+    def release(self):
+        """Leave the bench safe between tests: RF off, USRPs not streaming"""
+        for key in self.opened:
+            if key not in self.instruments or not self.drain(key):
+                continue
+            instrument = self.instruments[key]
+            if isinstance(instrument, SignalGenerator):
+                instrument.rf_off()
+            elif isinstance(instrument, RadioInterface):
+                instrument.stop_power_flowgraph()
+        self.opened.clear()
+
+    def close(self):
+        """Close every instrument, e.g., presetting the signal generator"""
+        for key in list(self.instruments):
+            self.drain(key)
+        self.instruments.clear()
+        self.opened.clear()
+
+
+@contextmanager
+def test_bench(profile, bench=None, simulate=False, kinds=None):
+    """Yield the profile and Bench to run one test with.
+
+    With simulate, the instruments are served by a Simulator for this test
+    only, limited to kinds (e.g., the test's instruments()) if given so
+    that e.g. an unused switch doesn't disconnect the radio. Otherwise a
+    session of bench is used if given (e.g., by usrp_daemon.py), else a
+    Bench is opened for this test alone. A Bench opened here is closed on
+    exit; a session is only released, so the instruments stay open for
+    the next test.
+    """
+    simulator = None
+    if simulate:
+        print("Simulating test bench")
+        simulator = Simulator(profile, kinds)
+        profile = simulator.profile
+        bench = Bench(simulator.make_radio)
+        owned = True
+    else:
+        owned = bench is None
+        bench = Bench() if owned else bench.session()
+
+    try:
+        yield profile, bench
+    finally:
+        if owned:
+            bench.close()
+        else:
+            bench.release()
+        if simulator is not None:
+            simulator.shutdown()
@@ -1,19 +1,13 @@
 from gnuradio import eng_notation
 
-try:
-    import visa
-except ImportError, visa_import_error:
-    msg =  "USRPCalibrator uses PyVisa-py to control test equipment\n\n"
-    msg += "$ pip install pyvisa-py"
-    print(msg, sys.stderr)
+from instruments import open_resource
 
 
 class PowerMeter(object):
     def __init__(self, profile):
-        rm = visa.ResourceManager('@py')
         self.profile = profile
 
-        self.meter = rm.open_resource(profile.powermeter_visa_connect_str)
+        self.meter = open_resource(profile.powermeter_visa_connect_str)
 
         # Set meter to remote operating mode
         self.meter.write('SYSTem:REMote')
@@ -1,15 +1,64 @@
-from __future__ import print_function
+from __future__ import division, print_function
 
+import fcntl
+import json
+import os
 import sys
+import time
 
 import numpy as np
 
+from gnuradio import gr
 from gnuradio import uhd
+from usrpcalibrator import mean_power_cf
+
+
+# Seconds past its expected end to wait for a power measurement
+POWER_TIMEOUT_MARGIN = 1.0
+
+
+class SettleTimeTable(object):
+    """Minimum measured retune settle time of each device, persisted as JSON"""
+    def __init__(self, path):
+        self.path = path
+        self.table = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.table = json.load(f)
+
+    def get(self, device):
+        """Return settle time in seconds, or None if never measured"""
+        return self.table.get(device)
+
+    def add(self, device, settle_time):
+        """Record a measurement, return the minimum measured so far.
+
+        The file is reloaded under a lock and merged, so devices calibrated
+        at the same time by other tables (e.g., other DUTs' radios, or
+        other processes) keep their entries.
+        """
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            contents = f.read()
+            self.table = json.loads(contents) if contents else {}
+            previous = self.table.get(device)
+            if previous is not None:
+                settle_time = min(previous, settle_time)
+            self.table[device] = settle_time
+            f.seek(0)
+            f.truncate()
+            json.dump(self.table, f, indent=4, sort_keys=True)
+        return settle_time
 
 
 class RadioInterface():
     def __init__(self, profile):
-        self.profile = profile
+        self.device_key = "{} {}".format(profile.usrp_device_type,
+                                         profile.usrp_serial)
+        self.settle_from = 0  # device time of the last timed tune/gain change
+        self.frequency = None
+        self.integerN = None  # tuning mode used by the last set_frequency
 
         search_criteria = uhd.device_addr_t()
         if profile.usrp_device_name is not None:
@@ -44,31 +93,242 @@ class RadioInterface():
                                     stream_args=stream_args)
 
         self.usrp.set_auto_dc_offset(True)
-        self.usrp.set_clock_rate(profile.usrp_clock_rate)
+
+        # Started by the first measure_power() call, so that self.usrp is
+        # still free to be connected into other flowgraphs (e.g., DANL)
+        self.power_tb = None
+        self.power_probe = None
+
+        self.set_profile(profile)
+
+    def set_profile(self, profile):
+        """Configure the open USRP for profile.
+
+        Lets a USRP stay open between tests (see instruments.bench). The
+        master clock rate is only set if it changes, since that
+        reinitializes e.g. the B2xx's AD9361.
+        """
+        self.profile = profile
+        self.command_lead = getattr(profile, 'usrp_command_lead', 0.05)
+        settle_time_file = getattr(profile, 'usrp_settle_time_file',
+                                   'usrp_settle_times.json')
+        self.settle_times = SettleTimeTable(settle_time_file)
+
+        if self.usrp.get_clock_rate() != profile.usrp_clock_rate:
+            self.usrp.set_clock_rate(profile.usrp_clock_rate)
         self.usrp.set_samp_rate(profile.usrp_sample_rate)
         self.sample_rate = self.usrp.get_samp_rate()
         print("USRP actual sample rate: {} MS/s".format(self.sample_rate/1e6))
 
+        self.set_command_time()
         for gain_type, value in profile.usrp_gain.items():
             self.usrp.set_gain(value, gain_type)
+        self.usrp.clear_command_time()
         print("USRP gain: {} dB".format(self.usrp.get_gain()))
 
         if hasattr(profile, 'usrp_center_freq'):
             self.set_frequency(profile.usrp_center_freq)
 
+    def device_time(self):
+        return self.usrp.get_time_now().get_real_secs()
+
+    def set_command_time(self):
+        """Time following commands usrp_command_lead seconds from now.
+
+        Settling is measured from that time, see measure_power().
+        """
+        cmd_time = self.usrp.get_time_now() + uhd.time_spec(self.command_lead)
+        self.usrp.set_command_time(cmd_time)
+        self.settle_from = cmd_time.get_real_secs()
+
     def set_frequency(self, freq):
+        """Tune at a known device time, returned in seconds.
+
+        With profile.usrp_integerN_tolerance set, integer-N is tried first
+        and kept only if the LO lands within tolerance Hz of its target.
+        The mode used is left in self.integerN.
+        """
+        tolerance = getattr(self.profile, 'usrp_integerN_tolerance', None)
+        integerN = (tolerance is not None or
+                    self.profile.usrp_use_integerN_tuning)
+
+        tune_result = self.tune(freq, integerN)
+        if integerN and tolerance is not None:
+            lo_error = tune_result.actual_rf_freq - tune_result.target_rf_freq
+            if abs(lo_error) > tolerance:
+                integerN = False
+                tune_result = self.tune(freq, integerN)
+
+        self.frequency = freq
+        self.integerN = integerN
+        print(tune_result.to_pp_string())
+
+        return self.settle_from
+
+    def tune(self, freq, integerN):
+        """Send a timed tune request and return the tune result"""
         tune_request = uhd.tune_request(freq, self.profile.usrp_lo_offset)
-        if self.profile.usrp_use_integerN_tuning:
+        if integerN:
             tune_request.args = uhd.device_addr('mode_n=integer')
 
+        self.set_command_time()
         tune_result = self.usrp.set_center_freq(tune_request)
-        print(tune_result.to_pp_string())
+        self.usrp.clear_command_time()
 
-    def acquire_samples(self):
-        """Aquire samples for power cal"""
-        total_samples = self.profile.nskip + self.profile.nsamples
+        return tune_result
+
+    def acquire_samples(self, nskip=None, nsamples=None):
+        """Aquire samples for power cal
+
+        nskip and nsamples default to the profile's values. Not available
+        once measure_power() has started streaming.
+        """
+        if nskip is None:
+            nskip = self.profile.nskip
+        if nsamples is None:
+            nsamples = self.profile.nsamples
+        total_samples = nskip + nsamples
         acquired_samples = self.usrp.finite_acquisition(total_samples)
-        data = np.array(acquired_samples[self.profile.nskip:])
-        assert len(data) == self.profile.nsamples
+        data = np.array(acquired_samples[nskip:])
+        assert len(data) == nsamples
 
         return data
+
+    def start_power_flowgraph(self):
+        if self.power_tb is None:
+            self.power_probe = mean_power_cf()
+            self.power_tb = gr.top_block()
+            self.power_tb.connect(self.usrp, self.power_probe)
+            self.power_tb.start()
+
+    def stop_power_flowgraph(self):
+        """Stop streaming for measure_power(), freeing self.usrp"""
+        if self.power_tb is not None:
+            self.power_tb.stop()
+            self.power_tb.wait()
+            self.power_tb = None
+            self.power_probe = None
+
+    def wait_for_power(self, nsamples, delay=0):
+        """Return the armed measurement's power in dBm once it completes.
+
+        delay is seconds until the measurement starts. Raises RuntimeError
+        if it hasn't completed POWER_TIMEOUT_MARGIN seconds after it should
+        have, e.g. because the USRP stopped streaming.
+        """
+        capture_time = delay + nsamples / self.sample_rate
+        timeout = capture_time + self.command_lead + POWER_TIMEOUT_MARGIN
+        deadline = time.time() + timeout
+        poll_interval = min(0.01, nsamples / self.sample_rate)
+        while not self.power_probe.done():
+            if time.time() > deadline:
+                errmsg = "USRP power measurement did not complete within {} s"
+                raise RuntimeError(errmsg.format(timeout))
+            time.sleep(poll_interval)
+        return self.power_probe.power_dbm()
+
+    def settle_time(self):
+        """Seconds to wait after a timed tune before measuring.
+
+        Measured once per device with calibrate_settle_time() and then
+        read from usrp_settle_time_file.
+        """
+        settle_time = self.settle_times.get(self.device_key)
+        if settle_time is None:
+            settle_time = self.calibrate_settle_time()
+        return settle_time
+
+    def calibrate_settle_time(self, freq=None, nwindows=50, nretries=3):
+        """Measure how long the received power takes to settle after a retune.
+
+        Short measurements are spread over the profile's nskip samples
+        following a retune to freq, by default the current frequency. The
+        USRP is left tuned to freq. The settle time is the start of the
+        first one after which all are within settle_tolerance dB of the
+        last. The minimum of this and earlier measurements of the device
+        is stored and returned.
+
+        Each window is timed from its own retune, since Python can't arm
+        one window in the few ms after the previous one completes. The USRP
+        is tuned 2 sample rates away and back first, so the LO has to
+        relock as it would after a real retune. A window that still starts
+        late is measured again, up to nretries times.
+        """
+        if freq is None:
+            freq = self.frequency
+        if freq is None:
+            raise RuntimeError("USRP not tuned yet, set usrp_center_freq " +
+                               "in the profile or pass a frequency to " +
+                               "calibrate the settle time at")
+        if freq != self.frequency:
+            self.set_frequency(freq)
+
+        print("Measuring USRP settle time... ", end="")
+        sys.stdout.flush()
+        self.start_power_flowgraph()
+
+        tolerance = getattr(self.profile, 'settle_tolerance', 0.1)
+        spacing = self.profile.nskip / self.sample_rate / nwindows
+        nsamples = max(1, int(spacing * self.sample_rate / 2))
+
+        away_freq = freq + 2*self.sample_rate
+        if away_freq > self.usrp.get_freq_range().stop():
+            away_freq = freq - 2*self.sample_rate
+
+        powers = []
+        for i in range(nwindows):
+            for attempt in range(nretries + 1):
+                self.tune(away_freq, self.integerN)
+                # Let the LO move away before the timed tune back
+                time.sleep(self.command_lead)
+                self.tune(freq, self.integerN)
+                start_time = self.settle_from + i*spacing
+                self.power_probe.arm_at_time(start_time, nsamples)
+                power = self.wait_for_power(
+                    nsamples, max(0, start_time - self.device_time()))
+                if not self.power_probe.late():
+                    break
+            else:
+                errmsg = "settle time window {} started late {} times"
+                raise RuntimeError(errmsg.format(i, nretries + 1))
+            powers.append(power)
+
+        nsettled = 1
+        while (nsettled < nwindows and
+               abs(powers[-nsettled-1] - powers[-1]) <= tolerance):
+            nsettled += 1
+        settle_time = (nwindows - nsettled) * spacing
+
+        print("{:.6f} s".format(settle_time))
+        return self.settle_times.add(self.device_key, settle_time)
+
+    def measure_power(self, nskip=None, nsamples=None):
+        """Return mean power in dBm of nsamples received after skipping nskip.
+
+        Without nskip, the measurement starts at the device time when the
+        last timed tune or gain change has settled, or immediately if it
+        already has. nsamples defaults to the profile's value. Samples are
+        measured by a mean_power_cf block in a flowgraph that keeps
+        streaming between calls, so they are never copied into Python.
+        """
+        if nsamples is None:
+            nsamples = self.profile.nsamples
+
+        self.start_power_flowgraph()
+
+        if nskip is not None:
+            self.power_probe.arm(nskip, nsamples)
+            delay = nskip / self.sample_rate
+        else:
+            start_time = self.settle_from + self.settle_time()
+            delay = start_time - self.device_time()
+            if delay > 0:
+                self.power_probe.arm_at_time(start_time, nsamples)
+            else:
+                self.power_probe.arm(0, nsamples)
+                delay = 0
+
+        return self.wait_for_power(nsamples, delay)
+
+    def __del__(self):
+        self.stop_power_flowgraph()
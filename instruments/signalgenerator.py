@@ -1,19 +1,13 @@
 from gnuradio import eng_notation
 
-try:
-    import visa
-except ImportError, visa_import_error:
-    msg =  "USRPCalibrator uses PyVisa-py to control test equipment\n\n"
-    msg += "$ pip install pyvisa-py"
-    print(msg, sys.stderr)
+from instruments import open_resource
 
 
 class SignalGenerator(object):
     def __init__(self, profile):
-        rm = visa.ResourceManager('@py')
         self.profile = profile
 
-        self.siggen = rm.open_resource(profile.siggen_visa_connect_str)
+        self.siggen = open_resource(profile.siggen_visa_connect_str)
 
         # Preset siggen
         self.siggen.write(':SYSTem:PRESet')
@@ -0,0 +1,475 @@
+"""Simulated test bench for running the calibration scripts off-bench.
+
+The power meter, signal generator and switch driver are served as SCPI
+instruments on local TCP sockets, so PowerMeter, SignalGenerator and
+SwitchDriver talk to them through PyVisa-py exactly as they talk to the
+real equipment. SimulatedRadioInterface stands in for RadioInterface and
+sees the same simulated RF path.
+
+The model is deliberately simple, but has the properties that matter for
+scheduling and search experiments:
+
+  * every SCPI command takes sim_command_latency seconds to answer
+  * after any change to the RF path (RF on/off, amplitude, frequency,
+    switch position) readings settle exponentially with time constant
+    sim_settle_tau seconds
+  * the radio compresses with a 1 dB compression point of sim_p1db dBm at
+    USRP RF-in
+
+Any of the DEFAULTS below can be overridden by defining the same key in
+the test profile.
+
+Usage:
+    simulator = Simulator(profile)
+    profile = simulator.profile   # VISA connect strings point at simulator
+    radio = simulator.make_radio(profile)
+    ...
+    simulator.shutdown()
+"""
+
+from __future__ import division, print_function
+
+import math
+import re
+import SocketServer
+import threading
+import time
+
+import numpy as np
+
+from gnuradio import eng_notation
+
+from instruments import CONNECT_STR_KEYS
+import utils
+
+
+DEFAULTS = {
+    'sim_command_latency': 0.005,     # Seconds for an instrument to respond
+    'sim_settle_tau': 0.1,            # Seconds, RF path settling time constant
+    'sim_p1db': -25,                  # dBm at USRP RF-in
+    'sim_radio_gain': 51,             # dB from RF-in to raw USRP samples
+    'sim_radio_noise': -100,          # dBm at RF-in
+    'sim_radio_tune_time': 0.01,      # Seconds to retune the USRP
+    'sim_radio_freq_range': (50e6, 6e9),
+    'sim_meter_noise_floor': -70,     # dBm
+    'sim_meter_jitter': 0.005,        # dB standard deviation of readings
+    'sim_switch_isolation': 60,       # dB into the deselected switch port
+    'sim_splitter_loss': 3.5,         # dB from splitter input to USRP port
+}
+
+NO_SIGNAL = -200  # dBm, "nothing connected"
+
+
+def sim_param(profile, key):
+    return getattr(profile, key, DEFAULTS[key])
+
+
+def dBm_sum(*levels):
+    """Total power in dBm of uncorrelated signals given in dBm"""
+    return 10*math.log10(sum(10**(level / 10) for level in levels))
+
+
+def compression(p_in, p1db):
+    """Gain compression in dB of a soft limiter with the given P1dB"""
+    return 10*math.log10(1 + 10**((p_in - p1db) / 10) * (10**0.1 - 1))
+
+
+def scpi_pattern(command):
+    """Return a regex matching command in long or short SCPI form.
+
+    Lowercase letters of a mnemonic are optional and numeric suffixes
+    default to 1, so 'MEASure1:POWer:AC?' matches e.g. 'MEAS:POW:AC?' or
+    'measure1:power:ac?'. Parameters following the header are captured
+    as group 1.
+    """
+    regex = ''
+    for part in re.split(r'([:?*])', command):
+        match = re.match(r'^([A-Z]+)([a-z]*)(\d*)$', part)
+        if match:
+            short, rest, suffix = match.groups()
+            regex += short
+            if rest:
+                regex += '(?:' + rest.upper() + ')?'
+            if suffix:
+                regex += '(?:' + suffix + ')?'
+        else:
+            regex += re.escape(part)
+    return re.compile('^' + regex + r'(?:\s+(.*))?$', re.IGNORECASE)
+
+
+def parse_number(arg, unit):
+    """Parse an eng_notation number with a trailing unit, e.g. '1.7GHZ'"""
+    arg = arg.strip()
+    if arg.upper().endswith(unit):
+        arg = arg[:-len(unit)]
+    return eng_notation.str_to_num(arg)
+
+
+class BenchState(object):
+    """RF path shared by the simulated instruments and radio.
+
+    Signal generator -> inline attenuator -> switch -> meter or radio.
+    Without a simulated switch, the radio is always connected. With one,
+    the radio is connected while any switch channel is closed and the
+    meter while all are open.
+
+    With bench_topology = 'splitter' a splitter feeds both at once instead:
+    the radio sees sim_splitter_loss and the meter splitter_ratio_db less.
+    """
+    def __init__(self, profile):
+        self.lock = threading.Lock()
+        self.inline_attenuator = getattr(profile, 'inline_attenuator', 0)
+        self.settle_tau = sim_param(profile, 'sim_settle_tau')
+        self.isolation = sim_param(profile, 'sim_switch_isolation')
+        self.splitter = getattr(profile, 'bench_topology', None) == 'splitter'
+        self.splitter_loss = sim_param(profile, 'sim_splitter_loss')
+        self.profile = profile
+
+        self.rf_on = False
+        self.amplitude = -135
+        self.frequency = 1e9
+        self.closed_channels = None  # None without a switch
+
+        self.change_time = time.time()
+        self.start_levels = {'meter': NO_SIGNAL, 'radio': NO_SIGNAL}
+
+    def _steady_level(self, port):
+        if not self.rf_on:
+            return NO_SIGNAL
+        level = self.amplitude - self.inline_attenuator
+        if self.splitter:
+            level -= self.splitter_loss
+            if port == 'meter':
+                level -= utils.splitter_ratio(self.profile, self.frequency)
+        else:
+            radio_connected = (self.closed_channels is None or
+                               bool(self.closed_channels))
+            if (port == 'radio') != radio_connected:
+                level -= self.isolation
+        return level
+
+    def _level(self, port, now):
+        # Settle exponentially in linear power, like a detector would
+        final = 10**(self._steady_level(port) / 10)
+        start = 10**(self.start_levels[port] / 10)
+        decay = math.exp(-(now - self.change_time) / self.settle_tau)
+        return 10*math.log10(final + (start - final)*decay)
+
+    def change(self, **state):
+        """Update the RF path, restarting the settling transient"""
+        with self.lock:
+            now = time.time()
+            for port in self.start_levels:
+                self.start_levels[port] = self._level(port, now)
+            for attr, value in state.items():
+                setattr(self, attr, value)
+            self.change_time = now
+
+    def level(self, port):
+        """Power in dBm currently arriving at port ('meter' or 'radio')"""
+        with self.lock:
+            return self._level(port, time.time())
+
+
+class SimulatedInstrument(object):
+    """Base class for a SCPI instrument backed by a BenchState.
+
+    Subclasses list (command, method name) pairs in commands. Methods take
+    the parameter string (or None) and return the response to a query.
+    Unknown commands are queued as errors, readable with SYSTem:ERRor?.
+    """
+    idn = "USRPCalibrator,Simulated Instrument,0,0"
+    commands = []
+
+    def __init__(self, bench, profile):
+        self.bench = bench
+        self.latency = sim_param(profile, 'sim_command_latency')
+        self.errors = []
+        self.lock = threading.Lock()
+        common = [('*IDN?', 'query_idn'),
+                  ('*RST', 'ignore'),
+                  ('*CLS', 'clear_errors'),
+                  ('SYSTem:ERRor?', 'query_error')]
+        self.patterns = [(scpi_pattern(cmd), getattr(self, name))
+                         for cmd, name in common + self.commands]
+
+    def handle(self, line):
+        """Execute one command line, return response or None"""
+        time.sleep(self.latency)
+        # Leading colon means "from root", the only level there is here
+        line = line.strip().lstrip(':')
+        with self.lock:
+            for pattern, method in self.patterns:
+                match = pattern.match(line)
+                if match:
+                    try:
+                        return method(match.group(1))
+                    except ValueError:
+                        self.errors.append('-224,"Illegal parameter value"')
+                        return None
+            self.errors.append('-113,"Undefined header"')
+            if line.endswith('?'):
+                return ''
+            return None
+
+    def query_idn(self, arg):
+        return self.idn
+
+    def query_error(self, arg):
+        if self.errors:
+            return self.errors.pop(0)
+        return '+0,"No error"'
+
+    def clear_errors(self, arg):
+        self.errors = []
+
+    def ignore(self, arg):
+        pass
+
+
+class SimulatedPowerMeter(SimulatedInstrument):
+    idn = "USRPCalibrator,Simulated Power Meter,0,0"
+    commands = [('SYSTem:REMote', 'ignore'),
+                ('UNIT1:POWer', 'ignore'),
+                ('FORMat', 'ignore'),
+                ('FORMat:BORDer', 'ignore'),
+                ('SENSe:MRATe', 'ignore'),
+                ('SENSe1:FREQuency', 'set_frequency'),
+                ('MEASure1:POWer:AC?', 'measure'),
+                ('READ1?', 'measure'),
+                ('FETCh1?', 'measure')]
+
+    def __init__(self, bench, profile):
+        SimulatedInstrument.__init__(self, bench, profile)
+        self.noise_floor = sim_param(profile, 'sim_meter_noise_floor')
+        self.jitter = sim_param(profile, 'sim_meter_jitter')
+        self.frequency = None
+
+    def set_frequency(self, arg):
+        self.frequency = parse_number(arg, 'HZ')
+
+    def measure(self, arg):
+        level = dBm_sum(self.bench.level('meter'), self.noise_floor)
+        level += np.random.normal(0, self.jitter)
+        return "{:+.6E}".format(level)
+
+
+class SimulatedSignalGenerator(SimulatedInstrument):
+    idn = "USRPCalibrator,Simulated Signal Generator,0,0"
+    commands = [('SYSTem:PRESet', 'preset'),
+                ('OUTPut:MODulation:STATe', 'ignore'),
+                ('OUTPut:STATe', 'set_output'),
+                ('OUTPut:STATe?', 'query_output'),
+                ('POWer', 'set_amplitude'),
+                ('POWer?', 'query_amplitude'),
+                ('FREQuency', 'set_frequency'),
+                ('FREQuency?', 'query_frequency')]
+
+    def preset(self, arg):
+        self.bench.change(rf_on=False, amplitude=-135, frequency=1e9)
+
+    def set_output(self, arg):
+        state = arg.strip().upper()
+        if state not in ('ON', 'OFF', '1', '0'):
+            raise ValueError(arg)
+        self.bench.change(rf_on=state in ('ON', '1'))
+
+    def query_output(self, arg):
+        return '1' if self.bench.rf_on else '0'
+
+    def set_amplitude(self, arg):
+        self.bench.change(amplitude=parse_number(arg, 'DBM'))
+
+    def query_amplitude(self, arg):
+        return "{:+.2f}".format(self.bench.amplitude)
+
+    def set_frequency(self, arg):
+        self.bench.change(frequency=parse_number(arg, 'HZ'))
+
+    def query_frequency(self, arg):
+        return "{:.0f}".format(self.bench.frequency)
+
+
+def parse_channels(arg):
+    """Parse a SCPI channel list, e.g. '(@101,103:105)', into a set"""
+    channels = set()
+    for first, last in re.findall(r'(\d+)(?::(\d+))?', arg):
+        channels.update(range(int(first), int(last or first) + 1))
+    return channels
+
+
+class SimulatedSwitchDriver(SimulatedInstrument):
+    """Closing any channel routes the signal to the radio, all open to the meter"""
+    idn = "USRPCalibrator,Simulated Switch Driver,0,0"
+    commands = [('ROUTe:OPEn', 'open_channel'),
+                ('ROUTe:CLOSe', 'close_channel'),
+                ('ROUTe:CLOSe?', 'query_closed')]
+
+    def __init__(self, bench, profile):
+        SimulatedInstrument.__init__(self, bench, profile)
+        self.bench.change(closed_channels=set())
+
+    def open_channel(self, arg):
+        closed = self.bench.closed_channels - parse_channels(arg)
+        self.bench.change(closed_channels=closed)
+
+    def close_channel(self, arg):
+        closed = self.bench.closed_channels | parse_channels(arg)
+        self.bench.change(closed_channels=closed)
+
+    def query_closed(self, arg):
+        """1 or 0 for each channel in arg, as a real switch driver answers"""
+        closed = self.bench.closed_channels
+        return ",".join(str(int(c in closed))
+                        for c in sorted(parse_channels(arg)))
+
+
+class SCPIRequestHandler(SocketServer.StreamRequestHandler):
+    """Newline-terminated SCPI over a raw socket, as in ::SOCKET resources"""
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            for command in line.strip().split(';'):
+                if not command:
+                    continue
+                response = self.server.instrument.handle(command)
+                if response is not None:
+                    self.wfile.write(response + '\n')
+                    self.wfile.flush()
+
+
+class SCPIServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, instrument, host='127.0.0.1', port=0):
+        SocketServer.TCPServer.__init__(self, (host, port), SCPIRequestHandler)
+        self.instrument = instrument
+
+    @property
+    def connect_str(self):
+        host, port = self.server_address
+        return 'TCPIP0::{}::{}::SOCKET'.format(host, port)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+class _FreqRange(object):
+    """Minimal stand-in for uhd.freq_range_t"""
+    def __init__(self, start, stop):
+        self._start = start
+        self._stop = stop
+
+    def start(self):
+        return self._start
+
+    def stop(self):
+        return self._stop
+
+
+class SimulatedUSRP(object):
+    """The parts of uhd.usrp_source that the test scripts call directly"""
+    def __init__(self, profile):
+        self.freq_range = _FreqRange(*sim_param(profile, 'sim_radio_freq_range'))
+
+    def get_freq_range(self):
+        return self.freq_range
+
+
+class SimulatedRadioInterface(object):
+    """Drop-in for RadioInterface that receives from a BenchState.
+
+    Streaming takes as long as the real radio would, i.e.
+    (nskip + nsamples) / usrp_sample_rate seconds.
+    """
+    def __init__(self, profile, bench):
+        self.profile = profile
+        self.bench = bench
+        self.usrp = SimulatedUSRP(profile)
+        self.sample_rate = profile.usrp_sample_rate
+        self.p1db = sim_param(profile, 'sim_p1db')
+        self.gain = sim_param(profile, 'sim_radio_gain')
+        self.noise = sim_param(profile, 'sim_radio_noise')
+        self.tune_time = sim_param(profile, 'sim_radio_tune_time')
+        self.frequency = None
+
+        if hasattr(profile, 'usrp_center_freq'):
+            self.set_frequency(profile.usrp_center_freq)
+
+    def set_frequency(self, freq):
+        time.sleep(self.tune_time)
+        self.frequency = freq
+
+    def acquire_samples(self, nskip=None, nsamples=None):
+        """Aquire samples for power cal
+
+        nskip and nsamples default to the profile's values.
+        """
+        if nskip is None:
+            nskip = self.profile.nskip
+        if nsamples is None:
+            nsamples = self.profile.nsamples
+        time.sleep((nskip + nsamples) / self.sample_rate)
+
+        p_in = self.bench.level('radio')
+        p_out = p_in - compression(p_in, self.p1db) + self.gain
+        tone_amplitude = utils.dBm_to_volts(p_out)
+        noise_amplitude = utils.dBm_to_volts(self.noise + self.gain)
+
+        n = np.arange(nsamples)
+        tone = tone_amplitude * np.exp(2j*np.pi*0.1*n)
+        noise = noise_amplitude * (np.random.normal(size=nsamples) +
+                                   1j*np.random.normal(size=nsamples)) / np.sqrt(2)
+
+        return tone + noise
+
+    def measure_power(self, nskip=None, nsamples=None):
+        return utils.mean_power_dBm(self.acquire_samples(nskip, nsamples))
+
+
+class Simulator(object):
+    """Serve simulated instruments for every VISA resource in profile.
+
+    kinds optionally limits them to some kinds of instrument, as named in
+    instruments.CONNECT_STR_KEYS. Without a simulated switch, the radio is
+    always connected.
+
+    self.profile is a copy of profile whose *_visa_connect_str entries
+    point at the simulated instruments.
+    """
+    instrument_classes = {
+        'power_meter': SimulatedPowerMeter,
+        'signal_generator': SimulatedSignalGenerator,
+        'switch': SimulatedSwitchDriver,
+    }
+
+    def __init__(self, profile, kinds=None):
+        self.bench = BenchState(profile)
+        self.servers = {}
+
+        raw_profile = dict(vars(profile))
+        for kind, cls in self.instrument_classes.items():
+            key = CONNECT_STR_KEYS[kind]
+            if key not in raw_profile or (kinds is not None and
+                                          kind not in kinds):
+                continue
+            server = SCPIServer(cls(self.bench, profile))
+            server.start()
+            self.servers[key] = server
+            raw_profile[key] = server.connect_str
+            print("Simulating {} at {}".format(cls.__name__, server.connect_str))
+
+        self.profile = utils.DictDotAccessor(raw_profile)
+
+    def make_radio(self, profile):
+        return SimulatedRadioInterface(profile, self.bench)
+
+    def shutdown(self):
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
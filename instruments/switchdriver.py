@@ -1,25 +1,35 @@
-from gnuradio import eng_notation
-
-try:
-    import visa
-except ImportError, visa_import_error:
-    msg =  "USRPCalibrator uses PyVisa-py to control test equipment\n\n"
-    msg += "$ pip install pyvisa-py"
-    print(msg, sys.stderr)
+from instruments import open_resource
 
 
 class SwitchDriver(object):
     def __init__(self, profile):
-        rm = visa.ResourceManager('@py')
         self.profile = profile
 
-        self.switch = rm.open_resource(profile.switchdriver_visa_connect_str)
+        self.switch = open_resource(profile.switchdriver_visa_connect_str)
+
+        # Profiles whose route to their USRP has been closed
+        self.selected = []
 
-    def select_radio(self):
-        self.switch.write(self.profile.switchdriver_scpi_select_radio_cmd)
+    def select_radio(self, profile=None):
+        """Route the signal to the USRP in profile, by default the switch's"""
+        if profile is None:
+            profile = self.profile
+        self.switch.write(profile.switchdriver_scpi_select_radio_cmd)
+        if profile not in self.selected:
+            self.selected.append(profile)
 
     def select_meter(self):
-        self.switch.write(self.profile.switchdriver_scpi_select_meter_cmd)
+        """Route the signal to the meter, opening every route to a USRP.
+
+        Each USRP selected with select_radio() is disconnected with its own
+        profile's switchdriver_scpi_select_meter_cmd.
+        """
+        cmds = [p.switchdriver_scpi_select_meter_cmd for p in self.selected]
+        if not cmds:
+            cmds = [self.profile.switchdriver_scpi_select_meter_cmd]
+        for cmd in sorted(set(cmds), key=cmds.index):
+            self.switch.write(cmd)
+        self.selected = []
 
     def __del__(self):
         self.switch.close()
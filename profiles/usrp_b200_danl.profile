@@ -32,6 +32,14 @@ usrp_gain = {'PGA': 50}
 usrp_center_freq = 1700e6 # 1700 MHz
 usrp_lo_offset = usrp_sample_rate / 2.0
 usrp_use_integerN_tuning = False
+# Hz, if not None tune each frequency integer-N when that puts the LO this
+# close to its target, else fractional-N (overrides usrp_use_integerN_tuning).
+# The B200's AD9361 has no integer-N mode.
+usrp_integerN_tolerance = None
+# Sweep segments grouped by LO band, reversing direction every span, to
+# cross slow-to-relock PLL band edges as few times as possible.
+# These are the AD9361 RX LO divider boundaries; None sweeps in frequency order.
+usrp_lo_band_edges = [93.75e6, 187.5e6, 375e6, 750e6, 1.5e9, 3e9]
 
 # Test-specific measurement parameters
 
@@ -42,6 +50,26 @@ overlap = 0.25
 naverages = 3000
 nskip_usrp_init = int(usrp_sample_rate)
 nskip_usrp_tune = int(usrp_sample_rate / 2.0)
+# Stop skipping once 1 ms power/DC windows agree, but skip at least 10 ms.
+# Set settle_window = None to always skip nskip_usrp_tune samples.
+settle_window = int(usrp_sample_rate / 1e3)
+settle_tolerance_db = 0.2
+nskip_usrp_tune_min = int(usrp_sample_rate / 1e2)
+# Per-band overrides of nskip_usrp_tune, naverages, usrp_gain (total dB)
+# and usrp_lo_offset, as (start Hz, stop Hz, {setting: value}), e.g.
+#   band_table = [(70e6, 300e6, {'naverages': 6000})]
+band_table = []
 window = np.array(gnuradio.fft.window.flattop(fft_len))
 enbw = rbw = usrp_sample_rate * sum(window**2) / sum(window)**2
 nenbw = enbw / delta_f
+
+# Tune planning: for each octave, the sample rate (and the power of 2 FFT
+# length meeting rbw) with the shortest predicted sweep is used. Sample
+# counts above are given at usrp_sample_rate and are rescaled to the rate
+# chosen. Rates the USRP doesn't report supporting are dropped.
+# usrp_retune_cost (seconds per retune) is used until the first octave has
+# been swept, then the skip the controller measured replaces it.
+# 40 MHz master clock / 8, 4 and 2
+usrp_sample_rates = [5e6, 10e6, 20e6]
+usrp_retune_cost = nskip_usrp_tune / usrp_sample_rate
+window_func = gnuradio.fft.window.flattop
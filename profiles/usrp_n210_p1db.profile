@@ -27,8 +27,14 @@ usrp_gain = {'PGA0': 25}
 usrp_center_freq = 1700e6 # 1700 MHz
 usrp_lo_offset = usrp_sample_rate / 2.0
 usrp_use_integerN_tuning = False
+# Hz, if not None tune each frequency integer-N when that puts the LO this
+# close to its target, else fractional-N (overrides usrp_use_integerN_tuning)
+usrp_integerN_tolerance = None
+usrp_command_lead = 0.05             # Seconds ahead to schedule timed tune/gain
+usrp_settle_time_file = 'usrp_settle_times.json' # Measured settle times
 
-nskip = 1000000                    # Number of samples to drop initially
+nskip = 1000000                    # Max samples to drop after a retune, until
+                                   # the settle time is measured
 nsamples = 1000                    # Number of samples to use for power measurement
 
 inline_attenuator = 30 # dB of attenatuation inline after siggen
@@ -44,3 +50,23 @@ powermeter_scpi_measure_cmd = 'MEAS1:POW:AC? -10DBM,2,(@1)'
 switchdriver_visa_connect_str = 'TCPIP0::192.168.130.173::INSTR'
 switchdriver_scpi_select_meter_cmd = 'ROUTe:OPEn (@109)'
 switchdriver_scpi_select_radio_cmd = 'ROUTe:CLOSe (@109)'
+
+# Test-specific measurement parameters
+
+# P1dB search (all amplitudes are dBm at USRP RF-in)
+p1db_min_amplitude = -60           # Lowest amplitude, start of linear region
+p1db_max_amplitude = -16           # Highest amplitude the search may request
+p1db_nlinear_points = 4            # Coarse points used to fit linear region
+p1db_linear_step = 5               # dB between coarse linear points
+p1db_bracket_step = 2              # Initial dB step when bracketing P1dB
+p1db_resolution = 1                # Bisect until P1dB is known to this many dB
+
+# Settle detection, replaces fixed 2 s delays after instrument changes
+settle_tolerance = 0.1             # dB spread allowed between readings
+settle_nreadings = 3               # Consecutive readings within tolerance
+settle_timeout = 2                 # Seconds, fall back to old fixed delay
+settle_poll_interval = 0.05        # Seconds between readings
+settle_nsamples = 10000            # USRP samples per settle reading
+
+# Instrument operations run concurrently, see instruments/asynchronous.py
+instrument_timeout = 10            # Seconds to wait for one operation
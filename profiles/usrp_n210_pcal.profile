@@ -27,6 +27,11 @@ usrp_gain = {'PGA0': 25}
 usrp_center_freq = 1700e6 # 1700 MHz
 usrp_lo_offset = usrp_sample_rate / 2.0
 usrp_use_integerN_tuning = False
+# Hz, if not None tune each frequency integer-N when that puts the LO this
+# close to its target, else fractional-N (overrides usrp_use_integerN_tuning)
+usrp_integerN_tolerance = None
+usrp_command_lead = 0.05             # Seconds ahead to schedule timed tune/gain
+usrp_settle_time_file = 'usrp_settle_times.json' # Measured settle times
 
 inline_attenuator = 30 # dB of attenatuation inline after siggen
 siggen_visa_connect_str = 'TCPIP0::192.168.130.76::5025::INSTR'
@@ -42,10 +47,40 @@ switchdriver_visa_connect_str = 'TCPIP0::192.168.130.173::INSTR'
 switchdriver_scpi_select_meter_cmd = 'ROUTe:OPEn (@109)'
 switchdriver_scpi_select_radio_cmd = 'ROUTe:CLOSe (@109)'
 
+# 'switch' to alternate the signal between meter and USRP, or 'splitter' if
+# a power splitter feeds both at once (no switch settling, switch unused)
+bench_topology = 'switch'
+# Splitter bench only: dB more power at the USRP port than the meter port,
+# or a {freq: dB} dict of stored corrections looked up nearest the siggen
+splitter_ratio_db = 0.0
+
+# Calibrate several USRPs behind a multi-port switch at once. Each dict
+# overrides the settings above for one USRP: at least its identification
+# and the commands closing and opening the switch route to it. Empty to
+# calibrate the single USRP above.
+duts = []
+#duts = [{'usrp_serial': "F4A6C3",
+#         'switchdriver_scpi_select_radio_cmd': 'ROUTe:CLOSe (@101)',
+#         'switchdriver_scpi_select_meter_cmd': 'ROUTe:OPEn (@101)'},
+#        {'usrp_serial': "F4A6D1",
+#         'switchdriver_scpi_select_radio_cmd': 'ROUTe:CLOSe (@102)',
+#         'switchdriver_scpi_select_meter_cmd': 'ROUTe:OPEn (@102)'}]
+
 # Test-specific measurement parameters
 
 # Power Cal
-nskip = 1000000                    # Number of samples to drop initially
+nskip = 1000000                    # Max samples to drop after a retune, until
+                                   # the settle time is measured
 nsamples = 1000                    # Number of samples to use for power cal
 nmeasurements = 72                 # Number of measurements to perform
 time_between_measurements = 600    # Seconds between start of measurements
+
+# Settle detection, replaces fixed 2 s delays after instrument changes
+settle_tolerance = 0.1             # dB spread allowed between readings
+settle_nreadings = 3               # Consecutive readings within tolerance
+settle_timeout = 2                 # Seconds, fall back to old fixed delay
+settle_poll_interval = 0.05        # Seconds between readings
+settle_nsamples = 10000            # USRP samples per settle reading
+
+# Instrument operations run concurrently, see instruments/asynchronous.py
+instrument_timeout = 10            # Seconds to wait for one operation
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""P1dB search against the simulated bench, whose radio compresses at sim_p1db.
+
+    $ python qa_p1db.py
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import matplotlib
+matplotlib.use('Agg')
+
+from instruments.bench import test_bench
+import usrp_p1db
+import utils
+
+
+PROFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'profiles', 'usrp_b200_p1db.profile')
+
+
+class qa_p1db(unittest.TestCase):
+
+    def setUp(self):
+        # Figures are saved under test_results in the working directory
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        os.mkdir('test_results')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test_001_t(self):
+        # The profile names a switch, which p1db never leases; simulating
+        # it would leave the radio's route open
+        raw_profile = {}
+        execfile(PROFILE, {}, raw_profile)
+        raw_profile.update({
+            'sim_radio_freq_range': (50e6, 500e6),
+            'sim_command_latency': 0,
+            'sim_settle_tau': 0.01,
+            'nskip': 1000,
+            'nsamples': 1000,
+            'settle_nsamples': 1000,
+        })
+        profile = utils.DictDotAccessor(raw_profile)
+        sim_p1db = -25
+        profile.sim_p1db = sim_p1db
+
+        with test_bench(profile, None, True,
+                        usrp_p1db.instruments(profile)) as (profile, bench):
+            frequencies, p1db = usrp_p1db.run_test(profile, bench)
+
+        self.assertEqual(len(p1db), 2)
+        for detected in p1db:
+            self.assertLessEqual(abs(detected - sim_p1db),
+                                 profile.p1db_resolution)
+
+
+if __name__ == '__main__':
+    unittest.main()
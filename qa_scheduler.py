@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""Leasing bench resources to concurrent jobs.
+
+    $ python qa_scheduler.py
+"""
+
+import threading
+import time
+import unittest
+
+from scheduler import Job, Scheduler
+
+
+class RunningJob(object):
+    """Hold a job's lease on a thread until finish() is called"""
+
+    def __init__(self, scheduler, name, resources, fail=False):
+        self.scheduler = scheduler
+        self.job = Job(name, resources)
+        self.fail = fail
+        self.started = threading.Event()
+        self.finished = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        # Wait until queued, so jobs are submitted in creation order
+        while self.job.state == 'queued' and not self.is_queued():
+            time.sleep(0.001)
+
+    def is_queued(self):
+        with self.scheduler.cond:
+            return self.job in self.scheduler.queue
+
+    def run(self):
+        try:
+            with self.scheduler.lease(self.job):
+                self.started.set()
+                self.finished.wait()
+                if self.fail:
+                    raise RuntimeError("test failed")
+        except RuntimeError:
+            pass
+
+    def finish(self):
+        self.finished.set()
+        self.thread.join(1)
+
+
+class qa_scheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler()
+        self.jobs = []
+
+    def tearDown(self):
+        for job in self.jobs:
+            job.finish()
+
+    def start(self, name, resources, fail=False):
+        job = RunningJob(self.scheduler, name, resources, fail)
+        self.jobs.append(job)
+        return job
+
+    def test_001_t(self):
+        # Jobs on different devices run at the same time
+        a = self.start("a", ['USRP 1'])
+        b = self.start("b", ['USRP 2'])
+        self.assertTrue(a.started.wait(1))
+        self.assertTrue(b.started.wait(1))
+
+    def test_002_t(self):
+        # A job waits for a device another job holds
+        a = self.start("a", ['USRP 1', 'signal_generator'])
+        b = self.start("b", ['USRP 2', 'signal_generator'])
+        self.assertTrue(a.started.wait(1))
+        self.assertFalse(b.started.wait(0.1))
+        self.assertEqual(b.job.state, 'queued')
+        a.finish()
+        self.assertTrue(b.started.wait(1))
+        self.assertEqual(a.job.state, 'done')
+
+    def test_003_t(self):
+        # A small job can't overtake a waiting job it shares a device with,
+        # but one sharing nothing with the queue can
+        a = self.start("a", ['USRP 1'])
+        b = self.start("b", ['USRP 1', 'USRP 2'])
+        c = self.start("c", ['USRP 2'])
+        d = self.start("d", ['USRP 3'])
+        self.assertTrue(a.started.wait(1))
+        self.assertTrue(d.started.wait(1))
+        self.assertFalse(c.started.wait(0.1))
+        self.assertFalse(b.started.is_set())
+
+        a.finish()
+        self.assertTrue(b.started.wait(1))
+        self.assertFalse(c.started.wait(0.1))
+        b.finish()
+        self.assertTrue(c.started.wait(1))
+
+    def test_004_t(self):
+        # A failed job releases its leases
+        a = self.start("a", ['USRP 1'], fail=True)
+        b = self.start("b", ['USRP 1'])
+        self.assertTrue(a.started.wait(1))
+        a.finish()
+        self.assertTrue(b.started.wait(1))
+        self.assertEqual(a.job.state, 'failed')
+        self.assertEqual(self.scheduler.leases, {'USRP 1': b.job})
+
+    def test_005_t(self):
+        # metrics() reports how long each job waited and ran
+        a = self.start("a", ['USRP 1'])
+        b = self.start("b", ['USRP 1'])
+        self.assertTrue(a.started.wait(1))
+        time.sleep(0.2)
+        a.finish()
+        self.assertTrue(b.started.wait(1))
+        time.sleep(0.1)
+        b.finish()
+        self.scheduler.wait_idle()
+
+        metrics = self.scheduler.metrics()
+        self.assertEqual([m['name'] for m in metrics], ['a', 'b'])
+        self.assertEqual([m['state'] for m in metrics], ['done', 'done'])
+        self.assertLess(metrics[0]['wait_time'], 0.1)
+        self.assertGreaterEqual(metrics[0]['run_time'], 0.2)
+        self.assertGreaterEqual(metrics[1]['wait_time'], 0.2)
+        self.assertGreaterEqual(metrics[1]['run_time'], 0.1)
+
+    def test_006_t(self):
+        # Only the most recent jobs are kept
+        self.scheduler = Scheduler(history=2)
+        for name in "abc":
+            with self.scheduler.lease(Job(name, ['USRP 1'])):
+                pass
+        self.assertEqual([m['name'] for m in self.scheduler.metrics()],
+                         ['b', 'c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
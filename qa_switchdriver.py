@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""Switch routing with several USRPs, checked against the simulated bench.
+
+    $ python qa_switchdriver.py
+"""
+
+import unittest
+
+from instruments.simulator import Simulator
+from instruments.switchdriver import SwitchDriver
+import utils
+
+
+class qa_switchdriver(unittest.TestCase):
+
+    def setUp(self):
+        profile = utils.DictDotAccessor({
+            'switchdriver_visa_connect_str': 'TCPIP0::127.0.0.1::INSTR',
+            'switchdriver_scpi_select_meter_cmd': 'ROUTe:OPEn (@109)',
+            'switchdriver_scpi_select_radio_cmd': 'ROUTe:CLOSe (@109)',
+            'duts': [{'switchdriver_scpi_select_radio_cmd': 'ROUTe:CLOSe (@101)',
+                      'switchdriver_scpi_select_meter_cmd': 'ROUTe:OPEn (@101)'},
+                     {'switchdriver_scpi_select_radio_cmd': 'ROUTe:CLOSe (@102)',
+                      'switchdriver_scpi_select_meter_cmd': 'ROUTe:OPEn (@102)'}],
+            'sim_command_latency': 0,
+        })
+        self.simulator = Simulator(profile)
+        self.profile = self.simulator.profile
+        self.switch = SwitchDriver(self.profile)
+
+    def tearDown(self):
+        self.switch.switch.close()
+        self.simulator.shutdown()
+
+    def closed(self, channels):
+        return self.switch.switch.query('ROUTe:CLOSe? ' + channels).strip()
+
+    def test_001_t(self):
+        # Every route closed by select_radio is opened by select_meter
+        duts = utils.dut_profiles(self.profile)
+        for i in range(2):
+            for dut in duts:
+                self.switch.select_radio(dut)
+            self.assertEqual(self.closed('(@101,102)'), '1,1')
+            self.switch.select_meter()
+            self.assertEqual(self.closed('(@101,102,109)'), '0,0,0')
+
+    def test_002_t(self):
+        # Without duts, the profile's own route is used
+        self.switch.select_radio()
+        self.assertEqual(self.closed('(@109)'), '1')
+        self.switch.select_meter()
+        self.assertEqual(self.closed('(@109)'), '0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""Choosing sample rates and FFT lengths for a DANL sweep.
+
+    $ python qa_tuneplan.py
+"""
+
+import unittest
+
+import tuneplan
+
+
+NENBW = 3.77  # flattop window
+
+
+class FreqRange(object):
+    """Stand-in for a UHD meta_range_t"""
+
+    def __init__(self, start, stop):
+        self._start = start
+        self._stop = stop
+
+    def start(self):
+        return self._start
+
+    def stop(self):
+        return self._stop
+
+
+class qa_tuneplan(unittest.TestCase):
+
+    def test_001_t(self):
+        # An rbw met exactly by a power of 2 isn't rounded up an octave
+        rbw = NENBW * 10e6 / 4096
+        self.assertEqual(tuneplan.fft_len_for_rbw(10e6, rbw, NENBW), 4096)
+        self.assertEqual(tuneplan.fft_len_for_rbw(20e6, rbw, NENBW), 8192)
+
+    def test_002_t(self):
+        # Otherwise the next power of 2 is used, so the rbw is at most rbw
+        for rbw in (1e3, 9.2e3, 25e3):
+            fft_len = tuneplan.fft_len_for_rbw(10e6, rbw, NENBW)
+            self.assertEqual(fft_len & (fft_len - 1), 0)
+            self.assertLessEqual(NENBW * 10e6 / fft_len, rbw)
+            self.assertGreater(NENBW * 10e6 / (fft_len // 2), rbw)
+
+    def test_003_t(self):
+        # With a costly retune, the rate needing fewest segments wins
+        rbw = NENBW * 5e6 / 1024
+        plan = tuneplan.plan_band((100e6, 200e6), [5e6, 10e6, 20e6], rbw,
+                                  NENBW, 0.25, 100, 0.5)
+        self.assertEqual(plan.sample_rate, 20e6)
+        self.assertEqual(plan.fft_len, 4096)
+        self.assertAlmostEqual(plan.rbw, rbw)
+
+        # Segments cover the band
+        freqs = plan.freqs
+        self.assertLessEqual(freqs.center_freqs[0] - freqs.step / 2, 100e6)
+        self.assertGreaterEqual(freqs.center_freqs[-1] + freqs.step / 2,
+                                200e6)
+
+        slower = tuneplan.BandPlan((100e6, 200e6), 5e6, rbw, NENBW, 0.25,
+                                   100, 0.5)
+        self.assertGreater(slower.freqs.nsegments, freqs.nsegments)
+        self.assertGreater(slower.sweep_time, plan.sweep_time)
+
+    def test_004_t(self):
+        # A band one segment wide at any rate goes to the lowest rate
+        rbw = NENBW * 5e6 / 1024
+        plan = tuneplan.plan_band((100e6, 101e6), [20e6, 5e6, 10e6], rbw,
+                                  NENBW, 0.25, 100, 0.5)
+        self.assertEqual(plan.freqs.nsegments, 1)
+        self.assertEqual(plan.sample_rate, 5e6)
+
+    def test_005_t(self):
+        # Each octave is planned, and the predicted time adds up
+        rbw = NENBW * 5e6 / 1024
+        plans = tuneplan.plan_sweep(FreqRange(50e6, 6e9), [5e6, 20e6], rbw,
+                                    NENBW, 0.25, 100, 0.05)
+        self.assertEqual(plans[0].band[0], 50e6)
+        self.assertEqual(plans[-1].band[1], 6e9)
+        for plan, next_plan in zip(plans, plans[1:]):
+            self.assertEqual(plan.band[1], next_plan.band[0])
+        for plan in plans:
+            self.assertAlmostEqual(
+                plan.sweep_time,
+                plan.freqs.nsegments * (0.05 + plan.dwell_time))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+from __future__ import division, print_function
+
+from contextlib import contextmanager
+import itertools
+import threading
+import time
+
+
+class Job(object):
+    """A test that leases bench resources while it runs.
+
+    resources are names of the devices the test needs exclusively, e.g.
+    from Bench.key(). Times are seconds since the epoch.
+    """
+    ids = itertools.count(1)
+
+    def __init__(self, name, resources):
+        self.id = next(Job.ids)
+        self.name = name
+        self.resources = frozenset(resources)
+        self.state = 'queued'
+        self.submit_time = time.time()
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def wait_time(self):
+        """Seconds spent queued for leases so far"""
+        end = self.start_time if self.start_time is not None else time.time()
+        return end - self.submit_time
+
+    @property
+    def run_time(self):
+        """Seconds spent holding leases so far, or None if not started"""
+        if self.start_time is None:
+            return None
+        end = self.end_time if self.end_time is not None else time.time()
+        return end - self.start_time
+
+    def metrics(self):
+        return {'id': self.id,
+                'name': self.name,
+                'state': self.state,
+                'resources': sorted(self.resources),
+                'wait_time': self.wait_time,
+                'run_time': self.run_time}
+
+
+class Scheduler(object):
+    """Lease bench resources to jobs so that only non-conflicting jobs run.
+
+    Jobs are admitted in submission order, except that a job may start
+    ahead of earlier waiting jobs if it shares no resource with any of
+    them, so a long queue for one USRP doesn't hold up a test on another
+    while a job needing several devices isn't starved by smaller ones.
+
+    Each job runs on the caller's thread inside a lease() block:
+
+        job = Job("pcal", resources)
+        with scheduler.lease(job):
+            ...  # run the test
+
+    The most recent history jobs are kept for metrics().
+    """
+    def __init__(self, history=100):
+        self.cond = threading.Condition()
+        self.queue = []   # jobs waiting for leases, in submission order
+        self.leases = {}  # resource -> job holding it
+        self.jobs = []    # recent jobs, oldest first
+        self.history = history
+
+    def can_start(self, job):
+        blocked = set(self.leases)
+        for queued in self.queue:
+            if queued is job:
+                return not (job.resources & blocked)
+            blocked |= queued.resources
+        return False
+
+    @contextmanager
+    def lease(self, job):
+        """Wait until job can lease its resources and hold them in the block"""
+        with self.cond:
+            self.queue.append(job)
+            self.jobs.append(job)
+            del self.jobs[:-self.history]
+
+            if not self.can_start(job):
+                print("Job {} waiting for {}".format(
+                    job.id, ', '.join(sorted(job.resources))))
+            while not self.can_start(job):
+                self.cond.wait()
+
+            self.queue.remove(job)
+            for resource in job.resources:
+                self.leases[resource] = job
+            job.state = 'running'
+            job.start_time = time.time()
+            # Removing job from the queue may unblock later jobs
+            self.cond.notify_all()
+
+        try:
+            yield job
+            job.state = 'done'
+        except BaseException:
+            job.state = 'failed'
+            raise
+        finally:
+            with self.cond:
+                job.end_time = time.time()
+                for resource in job.resources:
+                    del self.leases[resource]
+                self.cond.notify_all()
+
+    def wait_idle(self):
+        """Block until no job holds or waits for a lease"""
+        with self.cond:
+            while self.leases or self.queue:
+                self.cond.wait()
+
+    def metrics(self):
+        """Return Job.metrics() of recent jobs, oldest first"""
+        with self.cond:
+            return [job.metrics() for job in self.jobs]
@@ -0,0 +1,73 @@
+from __future__ import division, print_function
+
+from collections import OrderedDict
+import time
+
+
+class SettleTimer(object):
+    """Wait for the measurement path to settle instead of sleeping blindly.
+
+    Polls a measurement function (e.g., PowerMeter.take_measurement or a
+    short USRP capture) until settle_nreadings consecutive readings are
+    within settle_tolerance dB of each other. The function may return a
+    list of readings, e.g., one per USRP, in which case each must settle.
+    If the path hasn't settled after settle_timeout seconds, the wait ends
+    there, which is the same as the fixed delay it replaces.
+
+    Every wait is recorded under a label so that report() can show where
+    the bench's wall-clock time goes.
+    """
+    def __init__(self, profile):
+        self.tolerance = profile.settle_tolerance
+        self.nreadings = profile.settle_nreadings
+        self.timeout = profile.settle_timeout
+        self.poll_interval = profile.settle_poll_interval
+        self.log = OrderedDict()  # label -> list of (seconds, settled)
+
+    def wait(self, label, measure_fn):
+        """Block until measure_fn() readings settle, return seconds waited"""
+        start_time = time.time()
+        readings = []
+        settled = False
+
+        while True:
+            reading = measure_fn()
+            if not isinstance(reading, (list, tuple)):
+                reading = [reading]
+            readings.append(reading)
+            last = readings[-self.nreadings:]
+            if (len(last) == self.nreadings and
+                    max(max(r) - min(r) for r in zip(*last)) <= self.tolerance):
+                settled = True
+                break
+
+            elapsed = time.time() - start_time
+            if elapsed + self.poll_interval >= self.timeout:
+                # Fall back to the full fixed delay
+                time.sleep(max(0, self.timeout - elapsed))
+                break
+
+            time.sleep(self.poll_interval)
+
+        settle_time = time.time() - start_time
+        self.log.setdefault(label, []).append((settle_time, settled))
+
+        msg = "{} settled in {:.3f} s" if settled else "{} timed out after {:.3f} s"
+        print(msg.format(label, settle_time))
+
+        return settle_time
+
+    def report(self):
+        print("Settle time report:")
+        fmt = "  {:<28} {:>5} {:>9} {:>9} {:>9} {:>8}"
+        print(fmt.format("step", "count", "mean (s)", "max (s)", "total (s)",
+                         "timeouts"))
+        for label, waits in self.log.items():
+            times = [t for t, _ in waits]
+            ntimeouts = sum(1 for _, settled in waits if not settled)
+            print(fmt.format(label,
+                             len(times),
+                             "{:.3f}".format(sum(times) / len(times)),
+                             "{:.3f}".format(max(times)),
+                             "{:.3f}".format(sum(times)),
+                             ntimeouts))
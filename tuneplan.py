@@ -0,0 +1,117 @@
+from __future__ import division, print_function
+
+import math
+
+import numpy as np
+
+import utils
+
+
+class Frequencies(object):
+    def __init__(self, octave, overlap, fft_len, delta_f, sample_rate):
+        """Calculate and cache frequencies used in stitching FFT segments"""
+        self.start, self.stop = octave
+
+        # Check invariants
+        assert self.start < self.stop               # low freq is lower than high freq
+        assert 0 <= overlap < 1                     # overlap is percentage
+        assert fft_len > 0 and not fft_len & (fft_len - 1) # fft_len is power of 2
+
+        self.span = self.stop - self.start
+        self.nvalid_bins = int((fft_len - (fft_len * overlap))) // 2 * 2
+
+        usable_bw = sample_rate * (1 - overlap)
+        self.step = int(round(usable_bw / delta_f) * delta_f)
+
+        self.center_freqs = self.cache_center_freqs()
+        self.nsegments = len(self.center_freqs)
+
+        self.bin_freqs = self.cache_bin_freqs(delta_f)
+
+        self.bin_start = int(fft_len * (overlap / 2))
+        self.bin_stop = int(fft_len - self.bin_start)
+        self.max_plotted_bin = utils.find_nearest(self.bin_freqs, self.stop) + 1
+        self.bin_offset = (self.bin_stop - self.bin_start) / 2
+
+    def cache_center_freqs(self):
+        min_fc = self.start + (self.step / 2)
+        tmp_nsegments = math.floor(self.span / self.step)
+        max_fc = min_fc + (tmp_nsegments * self.step)
+        return np.arange(min_fc, max_fc + 1, self.step)
+
+    def cache_bin_freqs(self, delta_f):
+        max_fc = self.center_freqs[-1]
+        max_bin_freq = max_fc + (self.step / 2)
+        return np.arange(self.start, max_bin_freq, delta_f)
+
+
+class BandPlan(object):
+    """Sample rate, FFT length and segments for sweeping one band.
+
+    sweep_time is the predicted time to sweep the band: every segment pays
+    the retune cost and then dwells for naverages FFT frames.
+    """
+    def __init__(self, band, sample_rate, rbw, nenbw, overlap, naverages,
+                 retune_cost):
+        self.band = band
+        self.sample_rate = sample_rate
+        self.fft_len = fft_len_for_rbw(sample_rate, rbw, nenbw)
+        self.delta_f = sample_rate / self.fft_len
+        self.rbw = nenbw * self.delta_f
+
+        self.freqs = Frequencies(band, overlap, self.fft_len, self.delta_f,
+                                 sample_rate)
+
+        self.dwell_time = naverages * self.fft_len / sample_rate
+        self.sweep_time = self.freqs.nsegments * (retune_cost + self.dwell_time)
+
+
+def fft_len_for_rbw(sample_rate, rbw, nenbw):
+    """Return the shortest power of 2 FFT length with an RBW of at most rbw.
+
+    nenbw is the window's equivalent noise bandwidth in bins.
+    """
+    nbins = nenbw * sample_rate / rbw
+    # Don't let float error in a profile's own rbw round up a whole octave
+    return 2**int(math.ceil(math.log(nbins, 2) - 1e-9))
+
+
+def plan_band(band, sample_rates, rbw, nenbw, overlap, naverages, retune_cost):
+    """Return the BandPlan with the shortest sweep of band.
+
+    Ties go to the lowest sample rate.
+    """
+    plans = [BandPlan(band, fs, rbw, nenbw, overlap, naverages, retune_cost)
+             for fs in sorted(sample_rates)]
+    return min(plans, key=lambda plan: plan.sweep_time)
+
+
+def plan_sweep(freq_range, sample_rates, rbw, nenbw, overlap, naverages,
+               retune_cost):
+    """Return a BandPlan for each octave of freq_range.
+
+    freq_range is a UHD meta_range_t, e.g. from usrp.get_freq_range().
+    retune_cost is the measured time in seconds from requesting a tune to
+    having settled samples, i.e., the skipped samples plus command overhead.
+    """
+    return [plan_band(octave, sample_rates, rbw, nenbw, overlap, naverages,
+                      retune_cost)
+            for octave in utils.split_octaves(freq_range)]
+
+
+def print_plan(plans):
+    print("Tune plan:")
+    fmt = "  {:>21} {:>11} {:>7} {:>9} {:>8} {:>10}"
+    print(fmt.format("band (MHz)", "rate (MS/s)", "fft_len", "rbw (kHz)",
+                     "segments", "time (s)"))
+    for plan in plans:
+        band = "{:.0f}-{:.0f}".format(plan.band[0] / 1e6, plan.band[1] / 1e6)
+        print(fmt.format(band,
+                         "{:.3f}".format(plan.sample_rate / 1e6),
+                         plan.fft_len,
+                         "{:.3f}".format(plan.rbw / 1e3),
+                         plan.freqs.nsegments,
+                         "{:.1f}".format(plan.sweep_time)))
+
+    total = sum(plan.sweep_time for plan in plans)
+    print("Predicted sweep time: {:.1f} s".format(total))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""Submit a test to usrp_daemon.py and print its output as it runs.
+
+Takes the same arguments as the test's own script, e.g.
+
+    $ ./usrp_client.py pcal profiles/usrp_b200_pcal.profile --no-plot
+    $ ./usrp_client.py status
+    $ ./usrp_client.py stop
+
+Only the standard library is imported, so submitting starts in
+milliseconds. Ctrl-C disconnects, which aborts the test in the daemon.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+
+DEFAULT_SOCKET = os.environ.get('USRPCAL_SOCKET', '/tmp/usrpcalibrator.sock')
+
+TESTS = ('danl', 'p1db', 'pcal')
+
+
+def connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    return sock
+
+
+def is_running(path):
+    """Return True if a daemon is listening on path"""
+    try:
+        connect(path).close()
+        return True
+    except socket.error:
+        return False
+
+
+def submit(path, request, out=sys.stdout):
+    """Send request to the daemon and copy its output to out.
+
+    Returns the daemon's final status message, a dict whose "status" is
+    "ok" or "error".
+    """
+    sock = connect(path)
+    try:
+        sock.sendall(json.dumps(request) + '\n')
+        for line in sock.makefile('r'):
+            msg = json.loads(line)
+            if 'output' in msg:
+                out.write(msg['output'])
+                out.flush()
+            else:
+                return msg
+    finally:
+        sock.close()
+
+    raise RuntimeError("daemon closed the connection")
+
+
+def print_jobs(jobs):
+    fmt = "{:>5} {:<6} {:<8} {:>10} {:>10}  {}"
+    print(fmt.format("job", "test", "state", "wait (s)", "run (s)", "resources"))
+    for job in jobs:
+        run_time = job['run_time']
+        print(fmt.format(job['id'],
+                         job['name'],
+                         job['state'],
+                         "{:.1f}".format(job['wait_time']),
+                         "-" if run_time is None else "{:.1f}".format(run_time),
+                         ", ".join(job['resources'])))
+
+
+def main(args):
+    if args.test in ('status', 'stop'):
+        request = {'command': args.test}
+    else:
+        # The daemon runs in its own working directory
+        argv = [os.path.abspath(arg) if os.path.isfile(arg) else arg
+                for arg in args.args]
+        request = {'command': 'run', 'test': args.test, 'argv': argv}
+
+    try:
+        result = submit(args.socket, request)
+    except socket.error as e:
+        errmsg = "No daemon listening on {} ({}), start one with usrp_daemon.py"
+        print(errmsg.format(args.socket, e), file=sys.stderr)
+        return 1
+
+    if result['status'] != 'ok':
+        print(result.get('message', "test failed"), file=sys.stderr)
+        return 1
+
+    if args.test == 'status':
+        print_jobs(result['jobs'])
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket',
+                        help="Unix socket of the daemon",
+                        default=DEFAULT_SOCKET)
+    parser.add_argument('test',
+                        help="Test to run, status to list recent jobs, or " +
+                             "stop to shut the daemon down",
+                        choices=TESTS + ('status', 'stop'))
+    parser.add_argument('args',
+                        help="Arguments for the test's script",
+                        nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    try:
+        sys.exit(main(args))
+    except KeyboardInterrupt:
+        print("Caught Ctrl-C, exiting...", file=sys.stderr)
+        sys.exit(130)
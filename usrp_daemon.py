@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""Calibration daemon that keeps the USRP and instruments open between tests.
+
+Every run of usrp_pcal.py, usrp_danl.py or usrp_p1db.py otherwise finds
+and opens the USRP (reloading B2xx firmware and FPGA images) and presets
+the signal generator before doing any work. The daemon owns a Bench, so
+those costs are paid by the first test only. Tests are submitted with
+usrp_client.py over a Unix socket and their output is streamed back to
+the client.
+
+Each test leases the USRP and instruments named in its profile from a
+Scheduler (see scheduler.py): tests sharing a device run in the order
+they arrive, while tests on separate devices run at the same time.
+Simulated tests lease the devices of their profile too, so scheduling
+can be tried out without a bench. "usrp_client.py status" lists the
+wait and run time of recent jobs.
+
+Figures and settle time files are saved relative to the daemon's working
+directory.
+
+Usage:
+    $ ./usrp_daemon.py &
+    $ ./usrp_client.py danl profiles/usrp_b200_danl.profile
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import traceback
+
+import matplotlib
+matplotlib.use('Agg')  # figures are saved, never shown
+
+from instruments.bench import Bench
+from scheduler import Job, Scheduler
+import usrp_client
+import usrp_danl
+import usrp_p1db
+import usrp_pcal
+import utils
+
+
+TESTS = {
+    'danl': usrp_danl,
+    'p1db': usrp_p1db,
+    'pcal': usrp_pcal,
+}
+
+
+def send(wfile, **msg):
+    wfile.write(json.dumps(msg) + '\n')
+    wfile.flush()
+
+
+class ClientStream(object):
+    """File-like object that forwards a test's output to its client.
+
+    The first write after the client disconnects raises socket.error,
+    aborting the test; later writes are dropped.
+    """
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.disconnected = False
+
+    def write(self, text):
+        if self.disconnected:
+            return
+        try:
+            send(self.wfile, output=text)
+        except socket.error:
+            self.disconnected = True
+            raise
+
+    def flush(self):
+        pass
+
+
+class ThreadLocalStream(object):
+    """Stands in for sys.stdout/sys.stderr, writing to each thread's target.
+
+    Threads that haven't set a target write to default.
+    """
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def set_target(self, target):
+        self.local.target = target
+
+    def target(self):
+        return getattr(self.local, 'target', None) or self.default
+
+    def write(self, text):
+        self.target().write(text)
+
+    def flush(self):
+        self.target().flush()
+
+
+class JobHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return  # e.g., usrp_client.is_running() probing the socket
+        request = json.loads(line)
+
+        if request.get('command') == 'stop':
+            self.server.stopping = True
+            send(self.wfile, status='ok')
+        elif request.get('command') == 'status':
+            send(self.wfile, status='ok', jobs=self.server.scheduler.metrics())
+        elif request.get('test') not in TESTS:
+            errmsg = "unknown test {!r}".format(request.get('test'))
+            send(self.wfile, status='error', message=errmsg)
+        else:
+            self.run_test(request['test'], request['argv'])
+
+    def run_test(self, name, argv):
+        """Run test's main() on the daemon's bench with output to the client"""
+        stream = ClientStream(self.wfile)
+        status = 'error'
+        self.server.output.set_target(stream)
+        try:
+            test = TESTS[name]
+            parser = test.make_parser()
+            parser.prog = "usrp_{}.py".format(name)
+            args = parser.parse_args(argv)
+
+            profile = utils.load_profile(args.filename)
+            resources = set()
+            for dut in utils.dut_profiles(profile):
+                resources.update(Bench.key(kind, dut)
+                                 for kind in test.instruments(dut))
+            job = Job(name, resources)
+            with self.server.scheduler.lease(job):
+                test.main(args, self.server.bench)
+            print("Job {} waited {:.1f} s and ran {:.1f} s".format(
+                job.id, job.wait_time, job.run_time))
+            status = 'ok'
+        except SystemExit as e:
+            # e.g., argparse rejected the arguments or printed help
+            if not e.code:
+                status = 'ok'
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.server.output.set_target(None)
+
+        if stream.disconnected:
+            print("Client disconnected, test aborted", file=sys.stderr)
+        else:
+            send(self.wfile, status=status)
+
+
+class DaemonServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Handle each client on its own thread until told to stop"""
+    daemon_threads = True
+
+    def __init__(self, path, bench, output):
+        self.bench = bench
+        self.scheduler = Scheduler()
+        self.output = output
+        self.stopping = False
+        SocketServer.UnixStreamServer.__init__(self, path, JobHandler)
+
+    def serve_until_stopped(self):
+        self.timeout = 0.5  # so that a stop request is seen
+        while not self.stopping:
+            self.handle_request()
+
+
+def main(args):
+    if os.path.exists(args.socket):
+        if usrp_client.is_running(args.socket):
+            print("A daemon is already listening on {}".format(args.socket),
+                  file=sys.stderr)
+            return 1
+        os.remove(args.socket)
+
+    # Tests print from their handler threads
+    output = ThreadLocalStream(sys.stdout)
+    sys.stdout = sys.stderr = output
+
+    bench = Bench()
+    server = DaemonServer(args.socket, bench, output)
+    print("Listening on {}".format(args.socket))
+    try:
+        server.serve_until_stopped()
+        server.scheduler.wait_idle()
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+        bench.close()
+
+    print("Daemon stopped")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket',
+                        help="Unix socket to listen on",
+                        default=usrp_client.DEFAULT_SOCKET)
+    args = parser.parse_args()
+
+    try:
+        sys.exit(main(args))
+    except KeyboardInterrupt:
+        print("Caught Ctrl-C, exiting...", file=sys.stderr)
+        sys.exit(130)
@@ -3,7 +3,6 @@
 from __future__ import division, print_function
 
 import argparse
-import math
 import os
 from pprint import pprint
 import sys
@@ -13,25 +12,43 @@ import matplotlib.pyplot as plt
 from matplotlib.ticker import FuncFormatter
 import numpy as np
 
-import gnuradio.fft
 from gnuradio import blocks
 from gnuradio import gr
+import pmt
 
-from instruments.radio import RadioInterface
+from instruments.bench import test_bench
+import tuneplan
 from usrpcalibrator import (controller_cc,
-                            bin_statistics_ff,
+                            psd_estimator_cf,
                             stitch_fft_segments_ff)
 import utils
 
 
+def instruments(profile):
+    """Return the kinds of bench instrument the test leases"""
+    return ('radio',)
+
+
 class DANLTest(gr.top_block):
-    def __init__(self, freqs, usrp, profile):
+    """DANL flowgraph, built once and reused for every octave.
+
+    The USRP and controller are persistent. set_plan loads each octave's
+    tune plan between runs: it retunes the sample rate if the plan's
+    differs, rebuilds the power spectrum estimator if the FFT length
+    changes, and rebuilds the stitching tails, whose vector lengths depend
+    on the number of segments.
+
+    The estimator's averaged, max-hold and relative variance spectra are
+    each stitched into data_sink, max_sink and var_sink.
+    """
+    def __init__(self, plan, usrp, profile):
         gr.top_block.__init__(self)
 
-        self.freqs = freqs
         self.usrp = usrp
         self.profile = profile
-
+        # scale_factor holds at this gain; band_table gains are corrected
+        # back to it, and the sweep leaves the USRP at the last one
+        self.reference_gain = usrp.get_gain()
 
         # TODO: determine if profile.scale_factor needs to be corrected for
         #       gain to make this step correct
@@ -40,105 +57,314 @@ class DANLTest(gr.top_block):
 
         nsamples_each_cfreq = profile.fft_len * profile.naverages
         self.ctrl = controller_cc(self.usrp,
-                                  freqs.center_freqs,
+                                  plan.freqs.center_freqs,
                                   profile.usrp_lo_offset,
                                   profile.nskip_usrp_init,
                                   profile.nskip_usrp_tune,
                                   nsamples_each_cfreq,
                                   profile.usrp_use_integerN_tuning)
         self.ctrl.set_exit_after_complete(True)
-
-        stream_to_fft_vec = blocks.stream_to_vector(gr.sizeof_gr_complex,
-                                                    profile.fft_len)
-        fft_vec_to_stream = blocks.vector_to_stream(gr.sizeof_float,
-                                                    profile.fft_len)
-
-        scale = blocks.multiply_const_cc(profile.scale_factor,
-                                         profile.fft_len)
-
-        forward = True
-        shift = True
-        fft = gnuradio.fft.fft_vcc(profile.fft_len,
-                                   forward,
-                                   profile.window,
-                                   shift)
-
-        window_pwr = profile.fft_len * sum(tap*tap for tap in profile.window)
-
-        c2mag_sq = blocks.complex_to_mag_squared(profile.fft_len)
-        impedance = 50 # ohms
-        power_scalar = -10.0 * math.log10(window_pwr * impedance)
-
-        W2dBm = blocks.nlog10_ff(10.0, profile.fft_len, 30 + power_scalar)
-
-        stats = bin_statistics_ff(profile.fft_len, profile.naverages)
-
-        stitch_vlen = int(freqs.nsegments * profile.fft_len)
-        stream_to_stitch_vec = blocks.stream_to_vector(gr.sizeof_float,
-                                                       stitch_vlen)
-        stitch = stitch_fft_segments_ff(profile.fft_len,
-                                        freqs.nsegments,
-                                        profile.overlap,
-                                        freqs.nvalid_bins)
-
-        data_vlen = int(freqs.nsegments * freqs.nvalid_bins)
-        self.data_sink = blocks.vector_sink_f(data_vlen)
+        integerN_tolerance = getattr(profile, 'usrp_integerN_tolerance', None)
+        if integerN_tolerance is not None:
+            self.ctrl.set_auto_integer_tuning(integerN_tolerance)
+        lo_band_edges = getattr(profile, 'usrp_lo_band_edges', None)
+        if lo_band_edges is not None:
+            # Segments are placed by index, so the spectrum stays in order
+            self.ctrl.set_lo_band_order(lo_band_edges)
 
         self.connect(self.usrp, self.ctrl)
-        self.connect(self.ctrl, stream_to_fft_vec)
-        self.connect(stream_to_fft_vec, scale)
-        self.connect(scale, fft)
-        self.connect(fft, c2mag_sq)
-        self.connect(c2mag_sq, stats)
-        self.connect(stats, W2dBm)
-        self.connect(W2dBm, fft_vec_to_stream)
-        self.connect(fft_vec_to_stream, stream_to_stitch_vec, stitch)
-        self.connect(stitch, self.data_sink)
-
-
-class Frequencies(object):
-    def __init__(self, octave, overlap, fft_len, delta_f, sample_rate):
-        """Calculate and cache frequencies used in stitching FFT segments"""
-        self.start, self.stop = octave
 
-        # Check invariants
-        assert self.start < self.stop        # low freq is lower than high freq
-        assert 0 <= overlap < 1              # overlap is percentage
-        assert math.log(fft_len, 2) % 2 == 0 # fft_len is power of 2
+        # Completed segments' segment_start dicts, for measured_retune_cost
+        self.segment_log = blocks.message_debug()
+        self.msg_connect(self.ctrl, "segment", self.segment_log, "store")
+        self.nsegments_logged = 0
+
+        self.plan = None
+        self.psd = None
+        self.stitches = []
+        self.sinks = []
+        self.set_plan(plan)
+
+    def set_plan(self, plan):
+        """Load a BandPlan into the flowgraph. Call only while stopped.
+
+        After the first plan the USRP is already initialized, so the
+        initial sample delay is not paid again.
+        """
+        profile = self.profile
+
+        for port, (stitch, sink) in enumerate(zip(self.stitches, self.sinks)):
+            self.disconnect((self.psd, port), stitch, sink)
+
+        if self.plan is None or plan.fft_len != self.plan.fft_len:
+            if self.psd is not None:
+                self.disconnect(self.ctrl, self.psd)
+            self.psd = psd_estimator_cf(plan.fft_len,
+                                        profile.naverages,
+                                        fft_window(profile, plan.fft_len),
+                                        profile.scale_factor)
+            self.psd.set_reference_gain(self.reference_gain)
+            self.connect(self.ctrl, self.psd)
+
+        if self.plan is None or plan.sample_rate != self.plan.sample_rate:
+            self.usrp.set_samp_rate(plan.sample_rate)
+            # Time stamp segments even if the rx_rate tag is missed
+            self.ctrl.set_samp_rate(plan.sample_rate)
+            if getattr(profile, 'settle_window', None):
+                # nskip_usrp_tune becomes the upper bound on the tune delay
+                fs = plan.sample_rate
+                self.ctrl.set_adaptive_settle(
+                    rescale(profile.settle_window, profile, fs),
+                    profile.settle_tolerance_db,
+                    rescale(profile.nskip_usrp_tune_min, profile, fs))
+
+        if self.plan is not None:
+            self.ctrl.set_nskip_init(0)
+        self.ctrl.set_schedule(*band_schedule(plan,
+                                              profile,
+                                              self.reference_gain))
+
+        # Segments are placed by the controller's segment_start tags, so
+        # only one fft_len vector is buffered between psd and stitch
+        freqs = plan.freqs
+        data_vlen = int(freqs.nsegments * freqs.nvalid_bins)
+        self.stitches = []
+        self.sinks = []
+        for port in range(3):
+            stitch = stitch_fft_segments_ff(plan.fft_len,
+                                            freqs.nsegments,
+                                            profile.overlap,
+                                            freqs.nvalid_bins,
+                                            True)
+            sink = blocks.vector_sink_f(data_vlen)
+            self.connect((self.psd, port), stitch, sink)
+            self.stitches.append(stitch)
+            self.sinks.append(sink)
+        self.data_sink, self.max_sink, self.var_sink = self.sinks
+
+        self.plan = plan
+        self.freqs = freqs
 
-        self.span = self.stop - self.start
-        self.nvalid_bins = int((fft_len - (fft_len * overlap))) // 2 * 2
+    def measured_retune_cost(self):
+        """Return mean seconds skipped per retune since the last call.
+
+        Taken from the "nskip" of each segment the controller completed,
+        or None if none were. Re-acquired segments aren't retuned and are
+        left out.
+        """
+        nskips = []
+        nmessages = self.segment_log.num_messages()
+        for i in range(self.nsegments_logged, nmessages):
+            info = self.segment_log.get_message(i)
+            retries = pmt.dict_ref(info, pmt.intern("retries"), pmt.PMT_NIL)
+            if not pmt.is_null(retries) and pmt.to_uint64(retries) > 0:
+                continue
+            nskip = pmt.dict_ref(info, pmt.intern("nskip"), pmt.PMT_NIL)
+            nskips.append(pmt.to_uint64(nskip))
+        self.nsegments_logged = nmessages
+
+        if not nskips:
+            return None
+        return np.mean(nskips) / self.plan.sample_rate
+
+
+def rescale(nsamples, profile, sample_rate):
+    """Convert a sample count at profile.usrp_sample_rate to sample_rate"""
+    return int(round(nsamples * sample_rate / profile.usrp_sample_rate))
+
+
+def fft_window(profile, fft_len):
+    """Return profile's window taps for fft_len"""
+    window_func = getattr(profile, 'window_func', None)
+    if window_func is not None:
+        return np.array(window_func(fft_len))
+    if fft_len != profile.fft_len:
+        raise ValueError("set window_func in the profile to plan FFT " +
+                         "lengths other than fft_len")
+    return profile.window
+
+
+def band_schedule(plan, profile, default_gain):
+    """Return controller_cc.set_schedule arguments for a BandPlan.
+
+    profile.band_table is a list of (start, stop, settings) tuples.
+    settings is a dict that may override nskip_usrp_tune, naverages,
+    usrp_gain and usrp_lo_offset for center frequencies in [start, stop).
+    The first matching band wins; other frequencies use the profile
+    defaults. Skip counts are given at usrp_sample_rate and are rescaled to
+    the plan's sample rate. Gains are only scheduled if some band sets
+    usrp_gain, with default_gain used for the rest. The spectrum of a band
+    at another gain is corrected to default_gain by psd_estimator_cf.
+    """
+    table = getattr(profile, 'band_table', None) or []
+    center_freqs = plan.freqs.center_freqs
+
+    nskip, ncopy, gains, lo_offsets = [], [], [], []
+    for fc in center_freqs:
+        settings = {}
+        for start, stop, band in table:
+            if start <= fc < stop:
+                settings = band
+                break
+
+        nskip.append(rescale(settings.get('nskip_usrp_tune',
+                                          profile.nskip_usrp_tune),
+                             profile,
+                             plan.sample_rate))
+        naverages = settings.get('naverages', profile.naverages)
+        ncopy.append(int(plan.fft_len * naverages))
+        gains.append(settings.get('usrp_gain'))
+        lo_offsets.append(float(settings.get('usrp_lo_offset',
+                                             profile.usrp_lo_offset)))
+
+    if all(gain is None for gain in gains):
+        gains = []
+    else:
+        gains = [float(default_gain if gain is None else gain)
+                 for gain in gains]
+
+    return list(center_freqs), nskip, ncopy, gains, lo_offsets
 
-        usable_bw = sample_rate * (1 - overlap)
-        self.step = int(round(usable_bw / delta_f) * delta_f)
 
-        self.center_freqs = self.cache_center_freqs()
-        self.nsegments = len(self.center_freqs)
+# Matplotlib.ticker.FuncFormatter compatible Hz to MHz with 0 decimal places.
+format_mhz = lambda x, _: "{:.0f}".format(x / float(1e6))
 
-        self.bin_freqs = self.cache_bin_freqs(delta_f)
 
-        self.bin_start = int(fft_len * (overlap / 2))
-        self.bin_stop = int(fft_len - self.bin_start)
-        self.max_plotted_bin = utils.find_nearest(self.bin_freqs, self.stop) + 1
-        self.bin_offset = (self.bin_stop - self.bin_start) / 2
+def supported_sample_rates(profile, usrp):
+    """Return the profile's usrp_sample_rates that usrp can be set to"""
+    sample_rates = getattr(profile, 'usrp_sample_rates',
+                           [profile.usrp_sample_rate])
+    rates = usrp.get_samp_rates()
+    supported = [fs for fs in sample_rates
+                 if rates.start() <= fs <= rates.stop()]
+    if not supported:
+        raise ValueError("none of usrp_sample_rates {} are supported by "
+                         "the USRP".format(sample_rates))
+    return supported
 
-    def cache_center_freqs(self):
-        min_fc = self.start + (self.step / 2)
-        tmp_nsegments = math.floor(self.span / self.step)
-        max_fc = min_fc + (tmp_nsegments * self.step)
-        return np.arange(min_fc, max_fc + 1, self.step)
 
-    def cache_bin_freqs(self, delta_f):
-        max_fc = self.center_freqs[-1]
-        max_bin_freq = max_fc + (self.step / 2)
-        return np.arange(self.start, max_bin_freq, delta_f)
+def run_test(profile, usrp):
+    """Sweep each octave of usrp's frequency range and plot its DANL.
 
+    The sweep is planned with usrp_retune_cost. Once an octave has been
+    swept, the rest are planned again with the retune cost measured by
+    the controller.
+    """
+    freq_range = usrp.get_freq_range()
+    sample_rates = supported_sample_rates(profile, usrp)
+    retune_cost = getattr(profile, 'usrp_retune_cost',
+                          profile.nskip_usrp_tune / profile.usrp_sample_rate)
+    plans = tuneplan.plan_sweep(freq_range,
+                                sample_rates,
+                                profile.rbw,
+                                profile.nenbw,
+                                profile.overlap,
+                                profile.naverages,
+                                retune_cost)
+    tuneplan.print_plan(plans)
 
-# Matplotlib.ticker.FuncFormatter compatible Hz to MHz with 0 decimal places.
-format_mhz = lambda x, _: "{:.0f}".format(x / float(1e6))
+    print("-----")
+    test = None
+    for i in range(len(plans)):
+        plan = plans[i]
+        freqs = plan.freqs
+        octave = plan.band
+
+        if test is None:
+            test = DANLTest(plan, usrp, profile)
+        else:
+            test.set_plan(plan)
+        print("Running DANL on octave {!r}".format(octave))
+        nretries = test.ctrl.nretries()
+        start_time = time.time()
+        test.run()
+        print("Swept in {:.1f} s (predicted {:.1f} s)".format(
+            time.time() - start_time, plan.sweep_time))
+        nretries = test.ctrl.nretries() - nretries
+        if nretries:
+            print("Re-acquired {} segment(s) after dropped samples".format(
+                nretries))
+
+        measured_cost = test.measured_retune_cost()
+        if measured_cost is not None and i + 1 < len(plans):
+            print("Measured retune cost {:.4f} s, replanning the rest".format(
+                measured_cost))
+            plans[i+1:] = [tuneplan.plan_band(p.band,
+                                              sample_rates,
+                                              profile.rbw,
+                                              profile.nenbw,
+                                              profile.overlap,
+                                              profile.naverages,
+                                              measured_cost)
+                           for p in plans[i+1:]]
 
+        octave_str = '-'.join((format_mhz(freqs.start, None),
+                              format_mhz(freqs.stop, None) + " MHz"))
 
-def main(args):
+        # Standard error of the averaged level, to show enough averages
+        # were taken
+        rel_var = np.array(test.var_sink.data())
+        std_err_db = 10 * np.log10(1 + np.sqrt(rel_var))
+        print("Standard error of the average: {:.3f} dB max, "
+              "{:.3f} dB median".format(np.max(std_err_db),
+                                        np.median(std_err_db)))
+
+        with utils.plot_lock:
+            title_txt  = "Displayed Average Noise Level\n"
+            title_txt += "For Octave {0} of {1} {2}\n"
+            title_txt += "With Sample Rate {3} MS/s, ENBW {4} kHz, gain {5!r} dB"
+            plt.suptitle(title_txt.format(octave_str,
+                                          profile.usrp_device_str,
+                                          profile.usrp_serial,
+                                          format_mhz(plan.sample_rate, None),
+                                          plan.rbw / 1e3,
+                                          profile.usrp_gain))
+
+            plt.subplots_adjust(top=0.88)
+            plt.xlabel("Frequency (MHz)")
+            plt.xlim(freqs.start-1e6, freqs.stop+1e6)
+            xticks = np.linspace(freqs.start, freqs.stop, 5, endpoint=True)
+            plt.xticks(xticks)
+
+            xaxis_formatter = FuncFormatter(format_mhz)
+            ax = plt.gca()
+            ax.xaxis.set_major_formatter(xaxis_formatter)
+
+            plt.ylabel("Power (dBm)")
+            plt.ylim(-140, -90)   # Experiementally good range
+            plt.grid(color='0.90', linestyle='-', linewidth=1)
+
+            data = np.array(test.data_sink.data())
+            max_hold = np.array(test.max_sink.data())
+            plt.plot(freqs.bin_freqs, max_hold, color='0.70',
+                     linewidth=0.5, label="Max hold")
+            plt.plot(freqs.bin_freqs, data, zorder=99, label="Average")
+            plt.legend(loc='best')
+
+            # Ensure test_results dir exists
+            test_results_dir = 'test_results'
+            try:
+                os.makedirs(test_results_dir)
+            except OSError:
+                if not os.path.isdir(test_results_dir):
+                    raise
+
+            fig_name = '_'.join((profile.usrp_device_type,
+                                 profile.usrp_serial,
+                                 profile.test_type,
+                                 octave_str,
+                                 str(int(time.time()))))
+
+            fig_path = os.path.join(test_results_dir, fig_name + '.png')
+            print("Saving {}".format(fig_path))
+            plt.savefig(fig_path)
+            #plt.show()
+
+            plt.close()
+
+
+def main(args, bench=None):
+    """Run the DANL sweep, on bench's USRP if given"""
     raw_profile = {}
     execfile(args.filename, {}, raw_profile)
 
@@ -148,79 +374,13 @@ def main(args):
 
     profile = utils.DictDotAccessor(raw_profile)
 
-    print("Initializing USRP")
-    usrp = RadioInterface(profile).usrp
+    with test_bench(profile, bench) as (profile, bench):
+        print("Initializing USRP")
+        radio = bench.radio(profile)
+        run_test(profile, radio.usrp)
 
-    freq_range = usrp.get_freq_range()
-    octaves = utils.split_octaves(freq_range)
 
-    print("-----")
-    for octave in octaves:
-        freqs = Frequencies(octave,
-                            profile.overlap,
-                            profile.fft_len,
-                            profile.delta_f,
-                            profile.usrp_sample_rate)
-
-        test = DANLTest(freqs, usrp, profile)
-        print("Running DANL on octave {!r}".format(octave))
-        test.run()
-
-        octave_str = '-'.join((format_mhz(freqs.start, None),
-                              format_mhz(freqs.stop, None) + " MHz"))
-
-        title_txt  = "Displayed Average Noise Level\n"
-        title_txt += "For Octave {0} of {1} {2}\n"
-        title_txt += "With Sample Rate {3} MS/s, ENBW {4} kHz, gain {5!r} dB"
-        plt.suptitle(title_txt.format(octave_str,
-                                      profile.usrp_device_str,
-                                      profile.usrp_serial,
-                                      format_mhz(profile.usrp_sample_rate, None),
-                                      profile.enbw / 1e3,
-                                      profile.usrp_gain))
-
-        plt.subplots_adjust(top=0.88)
-        plt.xlabel("Frequency (MHz)")
-        plt.xlim(freqs.start-1e6, freqs.stop+1e6)
-        xticks = np.linspace(freqs.start, freqs.stop, 5, endpoint=True)
-        plt.xticks(xticks)
-
-        xaxis_formatter = FuncFormatter(format_mhz)
-        ax = plt.gca()
-        ax.xaxis.set_major_formatter(xaxis_formatter)
-
-        plt.ylabel("Power (dBm)")
-        plt.ylim(-140, -90)   # Experiementally good range
-        plt.grid(color='0.90', linestyle='-', linewidth=1)
-
-        data = np.array(test.data_sink.data())
-        plt.plot(freqs.bin_freqs, data, zorder=99)
-
-        # Ensure test_results dir exists
-        test_results_dir = 'test_results'
-        try:
-            os.makedirs(test_results_dir)
-        except OSError:
-            if not os.path.isdir(test_results_dir):
-                raise
-
-        fig_name = '_'.join((profile.usrp_device_type,
-                             profile.usrp_serial,
-                             profile.test_type,
-                             octave_str,
-                             str(int(time.time()))))
-
-        fig_path = os.path.join(test_results_dir, fig_name + '.png')
-        print("Saving {}".format(fig_path))
-        plt.savefig(fig_path)
-        #plt.show()
-
-        plt.close()
-
-        del test
-
-
-if __name__ == '__main__':
+def make_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('filename',
                         help="Filename of test profile",
@@ -229,7 +389,11 @@ if __name__ == '__main__':
                         help="Do not plot power meter readings against " +
                              "scaled USRP readings after test completes",
                         action='store_true')
-    args = parser.parse_args()
+    return parser
+
+
+if __name__ == '__main__':
+    args = make_parser().parse_args()
 
     try:
         main(args)
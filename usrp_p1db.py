@@ -12,12 +12,21 @@ import matplotlib.pyplot as plt
 from matplotlib.ticker import FuncFormatter
 import numpy as np
 
-from instruments.radio import RadioInterface
-from instruments.signalgenerator import SignalGenerator
+from instruments.asynchronous import (AsyncRadio,
+                                      AsyncSignalGenerator,
+                                      OverlapTimer,
+                                      wait_all)
+from instruments.bench import test_bench
+from settle import SettleTimer
 
 import utils
 
 
+def instruments(profile):
+    """Return the kinds of bench instrument the test leases"""
+    return ('radio', 'signal_generator')
+
+
 # Matplotlib.ticker.FuncFormatter compatible Hz to MHz with 0 decimal places.
 format_mhz = lambda x, _: "{:.0f}".format(x / float(1e6))
 
@@ -31,131 +40,233 @@ except OSError:
         raise
 
 
-def run_test(profile):
-    """Runs a P1dB test over USRP frequency range in 100 MHz intervals.
+class CompressionSearch(object):
+    """Adaptive search for the 1 dB compression point at one frequency.
+
+    A few coarse points are measured in the linear region to fit the expected
+    response. The search then brackets the compression point, starting from
+    an optional seed (e.g., the neighbouring frequency's result) and doubling
+    its step, and bisects toward it until it is known to p1db_resolution dB.
+
+    All amplitudes are dBm at USRP RF-in and lie on a grid of
+    p1db_resolution dB starting at p1db_min_amplitude.
+    """
+    def __init__(self, measure_fn, profile):
+        self.measure_fn = measure_fn
+        self.profile = profile
+        self.resolution = profile.p1db_resolution
+        self.min_ampl = profile.p1db_min_amplitude
+        self.max_ampl = profile.p1db_max_amplitude
+        self.measurements = {}  # amplitude -> radio measurement (dBm)
+        self.trendline_fn = None
+
+    def snap(self, ampl):
+        """Round ampl onto the search grid within [min_ampl, max_ampl]"""
+        nsteps = np.round((ampl - self.min_ampl) / self.resolution)
+        snapped = self.min_ampl + nsteps * self.resolution
+        return float(np.clip(snapped, self.min_ampl, self.max_ampl))
+
+    def measure(self, ampl):
+        if ampl not in self.measurements:
+            self.measurements[ampl] = self.measure_fn(ampl)
+        return self.measurements[ampl]
+
+    def is_compressed(self, ampl):
+        expected = self.trendline_fn(ampl)
+        print("Expected measurement value: {} dBm".format(expected))
+        actual = self.measure(ampl)
+        print("Actual measurement value: {} dBm".format(actual))
+        error = abs(expected - actual)
+        print("Error: {} dBm".format(error))
+        return error >= 1
+
+    def fit_linear_region(self):
+        nlinear = self.profile.p1db_nlinear_points
+        step = self.profile.p1db_linear_step
+        linear_ampls = [self.snap(self.min_ampl + i*step) for i in range(nlinear)]
+        linear_measurements = [self.measure(a) for a in linear_ampls]
+        # x-axis is the power at USRP RF-in, y-axis is radio
+        fit = np.polyfit(linear_ampls, linear_measurements, 1)
+        self.trendline_fn = np.poly1d(fit)
+        return linear_ampls[-1]
+
+    def run(self, seed=None):
+        """Return detected P1dB in dBm, or None if not detected by max_ampl"""
+        lo = self.fit_linear_region()  # highest amplitude known uncompressed
+        hi = None                      # lowest amplitude known compressed
+
+        bracket_step = self.profile.p1db_bracket_step
+        if seed is None:
+            seed = lo + bracket_step
+        probe = self.snap(max(seed, lo + self.resolution))
+
+        if probe > lo and self.is_compressed(probe):
+            # Seed is compressed, walk down until the linear region is found
+            hi = probe
+            while True:
+                probe = self.snap(hi - bracket_step)
+                if probe <= lo:
+                    break
+                if self.is_compressed(probe):
+                    hi = probe
+                    bracket_step *= 2
+                else:
+                    lo = probe
+                    break
+        elif probe > lo:
+            # Seed is linear, walk up until compression is found
+            lo = probe
+            while lo < self.max_ampl:
+                probe = self.snap(lo + bracket_step)
+                if self.is_compressed(probe):
+                    hi = probe
+                    break
+                lo = probe
+                bracket_step *= 2
 
-    Steps from -60 to -15 dBm in 1 dB increments. If P1dB not detected by -15
-    dBm, -15 dBm is appended to the P1dB array.
+        if hi is None:
+            return None
+
+        while hi - lo > self.resolution:
+            nsteps = np.round((hi - lo) / self.resolution / 2)
+            mid = lo + nsteps * self.resolution
+            if self.is_compressed(mid):
+                hi = mid
+            else:
+                lo = mid
+
+        return hi
+
+
+def run_test(profile, bench):
+    """Runs a P1dB test over USRP frequency range in 200 MHz intervals.
+
+    At each frequency, fits the linear region between p1db_min_amplitude and
+    a few coarse steps above it, then bisects toward the 1 dB compression
+    point (see CompressionSearch). Each search is seeded with the previous
+    frequency's result. If P1dB not detected by p1db_max_amplitude,
+    p1db_max_amplitude + 1 dBm is appended to the P1dB array.
+
+    The USRP retunes while the signal generator changes frequency, see
+    instruments.asynchronous, and how much was overlapped is reported.
 
     Returns (frequencies, P1dB) tuple of 2 arrays suitable for plotting.
     """
+    timer = OverlapTimer()
+    timeout = getattr(profile, 'instrument_timeout', None)
+
     print("Initializing USRP")
-    radio = RadioInterface(profile)
+    usrp_radio = bench.radio(profile)
+    radio = AsyncRadio(usrp_radio, timer, timeout)
     print("Initializing signal generator")
-    siggen = SignalGenerator(profile)
-
-    radio_measurements = []
+    siggen = AsyncSignalGenerator(bench.signal_generator(profile),
+                                  timer,
+                                  timeout)
 
     time.sleep(2)
     print("-----\n")
 
-    freq_range_min = radio.usrp.get_freq_range().start()
-    freq_range_max = radio.usrp.get_freq_range().stop()
+    freq_range_min = usrp_radio.usrp.get_freq_range().start()
+    freq_range_max = usrp_radio.usrp.get_freq_range().stop()
 
-    # Run a test every 100 MHz starting 50 MHz above radio's min freq
+    # Run a test every 200 MHz starting 50 MHz above radio's min freq
     frequencies = np.arange(freq_range_min+50e6, freq_range_max, 200e6)
-    # At each fc, step from -60 to at most -16 in 1 dB steps
-    amplitudes = np.arange(-60, -15)
 
-    p1db = []
+    settle = SettleTimer(profile)
 
-    for fc in frequencies:
-        print("Setting USRP to {} MHz".format(fc / 1e6))
-        radio.set_frequency(fc)
-        print("Setting siggen to {} MHz".format(fc / 1e6))
-        siggen.set_frequency(fc)
-
-        print("Signal generator RF ON")
-        siggen.rf_on()
-        time.sleep(2)
-
-        max_ampl = -15
-        for i, ampl in enumerate(amplitudes):
-            adjusted_ampl = ampl + profile.inline_attenuator
-            siggen_str = "Setting siggen amplitude to {} dBm ({} dBm before attenuation)"
-            print(siggen_str.format(ampl, adjusted_ampl))
-            siggen.set_amplitude(adjusted_ampl)
-            time.sleep(2)
-
-            print("Streaming samples from USRP... ", end="")
-            sys.stdout.flush()
-            data = np.array(radio.acquire_samples())
-            scaled_data = data * profile.scale_factor
-            idata = np.real(scaled_data)
-            qdata = np.imag(scaled_data)
-            meansquared = np.mean(idata**2 + qdata**2)
-            rms = np.sqrt(meansquared)
-            meanpwr = np.square(rms)/50
-            meanpwr_dbm = 30 + 10*np.log10(meanpwr)
-            rx_msg = "received {} samples with mean power of {} dBm"
-            print(rx_msg.format(len(data), meanpwr_dbm))
-
-            radio_measurement = meanpwr_dbm
-            radio_measurements.append(radio_measurement)
-
-            if i == 9:
-                # After 10 measurements, determine a line of best fit.
-                # x-axis is the power meter measurements, y-axis is radio
-                assert len(amplitudes[:i+1]) == len(radio_measurements)
-                fit = np.polyfit(amplitudes[:i+1], radio_measurements, 1)
-                trendline_fn = np.poly1d(fit)
-            elif i > 9:
-                expected = trendline_fn(ampl)
-                print("Expected measurement value: {} dBm".format(expected))
-                actual = radio_measurement
-                print("Actual measurement value: {} dBm".format(actual))
-                error = abs(expected - actual)
-                print("Error: {} dBm".format(error))
-                if error >= 1:
-                    # Reached P1dB
-                    max_ampl = ampl
-                    print("Detected P1dB {} dBm at {} MHz".format(ampl, fc/1e6))
-                    break
+    # Mean power scales with the square of the voltage scale factor
+    scale_factor_db = 20*np.log10(profile.scale_factor)
 
-            assert ampl + 1 < -15
+    def measure_radio():
+        raw_dbm = radio.measure_power(nskip=0,
+                                      nsamples=profile.settle_nsamples).result()
+        return raw_dbm + scale_factor_db
 
-        fc_str = format_mhz(fc, None) + " MHz"
+    def measure(ampl):
+        adjusted_ampl = ampl + profile.inline_attenuator
+        siggen_str = "Setting siggen amplitude to {} dBm ({} dBm before attenuation)"
+        print(siggen_str.format(ampl, adjusted_ampl))
+        siggen.set_amplitude(adjusted_ampl).result()
+        settle.wait("siggen amplitude change", measure_radio)
 
-        plt.plot(amplitudes[:i+1],
-                 [trendline_fn(a) for a in amplitudes[:i+1]],
-                 'k--',
-                 label="Expected measurement")
-        plt.plot(amplitudes[:i+1], amplitudes[:i+1], label="Power at USRP RF-in")
-        plt.plot(amplitudes[:i+1], radio_measurements, label="Actual measurement")
-        plt.legend(loc='best')
-        plt.xlabel("Power at USRP RF-in (dBm)")
-        plt.ylabel("USRP measurement (dBm)")
+        print("Streaming samples from USRP... ", end="")
+        sys.stdout.flush()
+        meanpwr_dbm = radio.measure_power().result() + scale_factor_db
+        rx_msg = "received {} samples with mean power of {} dBm"
+        print(rx_msg.format(profile.nsamples, meanpwr_dbm))
 
-        plt.grid(color='.90', linestyle='-', linewidth=1)
+        return meanpwr_dbm
 
-        title_txt  = "1 dB Compression Test at {}\n"
-        title_txt += "With {} Scale Factor Applied to {} {}\n"
-        title_txt += "And Gain Setting of {!r} dB"
-        plt.suptitle(title_txt.format(fc_str,
-                                      profile.scale_factor,
-                                      profile.usrp_device_str,
-                                      profile.usrp_serial,
-                                      profile.usrp_gain))
-        plt.subplots_adjust(top=0.88)
+    p1db = []
+    seed = None
 
-        fig_name = '_'.join((profile.usrp_device_type,
-                             profile.usrp_serial,
-                             profile.test_type,
-                             fc_str,
-                             str(int(time.time()))))
+    for fc in frequencies:
+        with timer.iteration("retune to {} MHz".format(fc / 1e6)):
+            print("Setting USRP and siggen to {} MHz, ".format(fc / 1e6) +
+                  "signal generator RF ON")
+            wait_all([radio.set_frequency(fc),
+                      siggen.set_frequency(fc),
+                      siggen.rf_on()])
+        settle.wait("RF on", measure_radio)
+
+        search = CompressionSearch(measure, profile)
+        detected = search.run(seed)
+        nsteps = len(search.measurements)
+        if detected is None:
+            max_ampl = profile.p1db_max_amplitude + 1
+            print("P1dB not detected at {} MHz".format(fc/1e6))
+        else:
+            max_ampl = detected
+            seed = detected
+            print("Detected P1dB {} dBm at {} MHz".format(max_ampl, fc/1e6))
+        print("Used {} siggen steps".format(nsteps))
 
-        fig_path = os.path.join(test_results_dir, fig_name + '.png')
-        print("Saving {}".format(fig_path))
-        plt.savefig(fig_path)
-        plt.close()
+        fc_str = format_mhz(fc, None) + " MHz"
 
-        print("Clearing radio measurements")
-        radio_measurements = []
+        amplitudes = np.array(sorted(search.measurements))
+        radio_measurements = [search.measurements[a] for a in amplitudes]
+
+        with utils.plot_lock:
+            plt.plot(amplitudes,
+                     [search.trendline_fn(a) for a in amplitudes],
+                     'k--',
+                     label="Expected measurement")
+            plt.plot(amplitudes, amplitudes, label="Power at USRP RF-in")
+            plt.plot(amplitudes, radio_measurements, 'o-', label="Actual measurement")
+            plt.legend(loc='best')
+            plt.xlabel("Power at USRP RF-in (dBm)")
+            plt.ylabel("USRP measurement (dBm)")
+
+            plt.grid(color='.90', linestyle='-', linewidth=1)
+
+            title_txt  = "1 dB Compression Test at {}\n"
+            title_txt += "With {} Scale Factor Applied to {} {}\n"
+            title_txt += "And Gain Setting of {!r} dB"
+            plt.suptitle(title_txt.format(fc_str,
+                                          profile.scale_factor,
+                                          profile.usrp_device_str,
+                                          profile.usrp_serial,
+                                          profile.usrp_gain))
+            plt.subplots_adjust(top=0.88)
+
+            fig_name = '_'.join((profile.usrp_device_type,
+                                 profile.usrp_serial,
+                                 profile.test_type,
+                                 fc_str,
+                                 str(int(time.time()))))
+
+            fig_path = os.path.join(test_results_dir, fig_name + '.png')
+            print("Saving {}".format(fig_path))
+            plt.savefig(fig_path)
+            plt.close()
 
         p1db.append(max_ampl)
         print("Signal Generator RF OFF")
-        siggen.rf_off()
-        time.sleep(2)
+        siggen.rf_off().result()
+        settle.wait("RF off", measure_radio)
+
+    settle.report()
+    timer.report()
 
     # sanity check
     assert len(frequencies) == len(p1db)
@@ -163,7 +274,8 @@ def run_test(profile):
     return (frequencies, p1db)
 
 
-def main(args):
+def main(args, bench=None):
+    """Run the P1dB test, on bench's instruments if given"""
     raw_profile = {}
     execfile(args.filename, {}, raw_profile)
 
@@ -173,51 +285,63 @@ def main(args):
 
     profile = utils.DictDotAccessor(raw_profile)
 
-    frequencies, p1db = run_test(profile)
+    with test_bench(profile, bench, args.simulate,
+                    instruments(profile)) as (profile, bench):
+        frequencies, p1db = run_test(profile, bench)
 
     print("Plotting...\n")
 
-    title_txt  = "1 dB Compression Test\n"
-    title_txt += "With {} Scale Factor Applied to {} {}\n"
-    title_txt += "And Gain Setting of {!r} dB"
-    plt.suptitle(title_txt.format(profile.scale_factor,
-                                  profile.usrp_device_str,
-                                  profile.usrp_serial,
-                                  profile.usrp_gain))
+    with utils.plot_lock:
+        title_txt  = "1 dB Compression Test\n"
+        title_txt += "With {} Scale Factor Applied to {} {}\n"
+        title_txt += "And Gain Setting of {!r} dB"
+        plt.suptitle(title_txt.format(profile.scale_factor,
+                                      profile.usrp_device_str,
+                                      profile.usrp_serial,
+                                      profile.usrp_gain))
 
-    plt.subplots_adjust(top=0.88)
+        plt.subplots_adjust(top=0.88)
 
-    p1db_line, = plt.plot(frequencies,
-                          p1db,
-                          label="P1dB",
-                          zorder=99)
-    plt_legend = plt.legend(loc='best')
-    plt.grid(color='.90', linestyle='-', linewidth=1)
+        p1db_line, = plt.plot(frequencies,
+                              p1db,
+                              label="P1dB",
+                              zorder=99)
+        plt_legend = plt.legend(loc='best')
+        plt.grid(color='.90', linestyle='-', linewidth=1)
 
-    plt.xlabel("Frequency (MHz)")
-    plt.ylabel("Power at USRP RF-in (dBm)")
+        plt.xlabel("Frequency (MHz)")
+        plt.ylabel("Power at USRP RF-in (dBm)")
 
-    xaxis_formatter = FuncFormatter(format_mhz)
-    ax = plt.gca()
-    ax.xaxis.set_major_formatter(xaxis_formatter)
+        xaxis_formatter = FuncFormatter(format_mhz)
+        ax = plt.gca()
+        ax.xaxis.set_major_formatter(xaxis_formatter)
 
-    fig_name = '_'.join((profile.usrp_device_type,
-                         profile.usrp_serial,
-                         profile.test_type,
-                         str(int(time.time()))))
+        fig_name = '_'.join((profile.usrp_device_type,
+                             profile.usrp_serial,
+                             profile.test_type,
+                             str(int(time.time()))))
 
-    fig_path = os.path.join(test_results_dir, fig_name + '.png')
-    print("Saving {}".format(fig_path))
-    plt.savefig(fig_path)
-    plt.show()
+        fig_path = os.path.join(test_results_dir, fig_name + '.png')
+        print("Saving {}".format(fig_path))
+        plt.savefig(fig_path)
+        plt.show()
+        plt.close()
 
 
-if __name__ == '__main__':
+def make_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('filename',
                         help="Filename of test profile",
                         type=utils.filetype)
-    args = parser.parse_args()
+    parser.add_argument('--simulate',
+                        help="Run against simulated instruments and USRP " +
+                             "instead of the test bench",
+                        action='store_true')
+    return parser
+
+
+if __name__ == '__main__':
+    args = make_parser().parse_args()
 
     try:
         main(args)
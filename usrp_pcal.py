@@ -10,72 +10,145 @@ import time
 from matplotlib import pyplot as plt
 import numpy as np
 
-from instruments.radio import RadioInterface
-from instruments.powermeter import PowerMeter
-from instruments.signalgenerator import SignalGenerator
-from instruments.switchdriver import SwitchDriver
+from instruments.asynchronous import (AsyncPowerMeter,
+                                      AsyncRadio,
+                                      AsyncSignalGenerator,
+                                      AsyncSwitchDriver,
+                                      OverlapTimer,
+                                      wait_all)
+from instruments.bench import test_bench
+from settle import SettleTimer
 import utils
 
 
-def run_test(profile):
-    print("Initializing USRP")
-    radio = RadioInterface(profile)
+def instruments(profile):
+    """Return the kinds of bench instrument the test leases"""
+    if splitter_bench(profile):
+        return ('radio', 'power_meter', 'signal_generator')
+    return ('radio', 'power_meter', 'signal_generator', 'switch')
+
+
+def splitter_bench(profile):
+    """Return True if a power splitter feeds the meter and USRPs at once"""
+    return getattr(profile, 'bench_topology', 'switch') == 'splitter'
+
+
+def run_test(profile, bench):
+    """Alternately measure the signal with the power meter and the USRPs.
+
+    With several USRPs (see utils.dut_profiles) the switch routes the
+    signal to all of them at once and they are measured concurrently, so
+    every USRP shares each meter reading.
+
+    On a splitter bench (bench_topology = 'splitter') there is no switch:
+    the meter and USRPs are measured at the same time, so no settling is
+    needed between them. Meter readings are returned as measured at the
+    meter's splitter port, see reference_measurements().
+
+    Independent instrument operations are overlapped, see
+    instruments.asynchronous, and how much was overlapped is reported.
+
+    Returns (meter measurements, [measurements of each USRP]) in dBm.
+    """
+    timer = OverlapTimer()
+    timeout = getattr(profile, 'instrument_timeout', None)
+
+    duts = utils.dut_profiles(profile)
+    print("Initializing {} USRP(s)".format(len(duts)))
+    radios = [AsyncRadio(bench.radio(dut), timer, timeout) for dut in duts]
     print("Initializing power meter")
-    meter = PowerMeter(profile)
+    meter = AsyncPowerMeter(bench.power_meter(profile), timer, timeout)
     print("Initializing signal generator")
-    siggen = SignalGenerator(profile)
-    siggen.set_frequency(profile.siggen_center_freq)
-    siggen.set_amplitude(profile.siggen_amplitude)
-    print("Initializing switch")
-    switch = SwitchDriver(profile)
+    siggen = AsyncSignalGenerator(bench.signal_generator(profile),
+                                  timer,
+                                  timeout)
+    splitter = splitter_bench(profile)
+    if not splitter:
+        print("Initializing switch")
+        switch = AsyncSwitchDriver(bench.switch(profile), timer, timeout)
+
+    with timer.iteration("setup"):
+        wait_all([siggen.set_frequency(profile.siggen_center_freq),
+                  siggen.set_amplitude(profile.siggen_amplitude),
+                  meter.set_frequency(profile.siggen_center_freq)])
 
     meter_measurements = []
-    radio_measurements = []
+    radio_measurements = [[] for _ in radios]
 
-    time.sleep(2)
+    settle = SettleTimer(profile)
 
-    print("Signal generator RF ON")
-    siggen.rf_on()
+    def measure_meter():
+        return meter.take_measurement().result()
 
-    time.sleep(2)
-    print("-----\n")
+    def measure_radios(nskip=None, nsamples=None):
+        return wait_all([radio.measure_power(nskip, nsamples)
+                         for radio in radios])
 
-    last_i = profile.nmeasurements - 1
-    for i in range(profile.nmeasurements):
-        start_time = time.time()
-
-        print("Starting test {} at {}".format(i+1, int(start_time)))
+    def measure_radio():
+        return measure_radios(nskip=0, nsamples=profile.settle_nsamples)
 
+    def measure_switched():
+        """Measure with the power meter, then switch to the USRPs"""
         print("Switching to power meter")
-        switch.select_meter()
+        switch.select_meter().result()
 
-        time.sleep(2)
+        settle.wait("switch to power meter", measure_meter)
 
         print("Taking power meter measurement... ", end="")
         sys.stdout.flush()
-        meter_measurement = meter.take_measurement()
-        meter_measurements.append(meter_measurement)
+        meter_measurement = measure_meter()
         print("{} dBm".format(meter_measurement))
 
         print("Switching to USRP")
-        switch.select_radio()
+        wait_all([switch.select_radio(dut) for dut in duts])
 
-        time.sleep(2)
+        settle.wait("switch to USRP", measure_radio)
 
         print("Streaming samples from USRP... ", end="")
         sys.stdout.flush()
-        data = radio.acquire_samples()
-        idata = np.real(data)
-        qdata = np.imag(data)
-        meansquared = np.mean(idata**2 + qdata**2)
-        rms = np.sqrt(meansquared)
-        meanpwr = np.square(rms)/50
-        meanpwr_db = 30 + 10*np.log10(meanpwr)
+        meanpwrs_db = measure_radios()
         rx_msg = "received {} samples with mean power of {} dB"
-        print(rx_msg.format(len(data), meanpwr_db))
+        print(rx_msg.format(profile.nsamples,
+                            ", ".join(str(p) for p in meanpwrs_db)))
+        return meter_measurement, meanpwrs_db
+
+    time.sleep(2)
+
+    if not splitter:
+        # The RF on wait below reads the meter, so route the signal to it
+        print("Switching to power meter")
+        switch.select_meter().result()
+
+    print("Signal generator RF ON")
+    siggen.rf_on().result()
+
+    settle.wait("RF on", measure_meter)
+    print("-----\n")
 
-        radio_measurement = meanpwr_db
-        radio_measurements.append(radio_measurement)
+    last_i = profile.nmeasurements - 1
+    for i in range(profile.nmeasurements):
+        start_time = time.time()
+
+        print("Starting test {} at {}".format(i+1, int(start_time)))
+
+        with timer.iteration("test {}".format(i+1)):
+            if splitter:
+                print("Measuring with power meter and USRP at once... ",
+                      end="")
+                sys.stdout.flush()
+                results = wait_all([meter.take_measurement()] +
+                                   [radio.measure_power() for radio in radios])
+                meter_measurement, meanpwrs_db = results[0], results[1:]
+                rx_msg = "{} dBm, {} samples with mean power of {} dB"
+                print(rx_msg.format(meter_measurement,
+                                    profile.nsamples,
+                                    ", ".join(str(p) for p in meanpwrs_db)))
+            else:
+                meter_measurement, meanpwrs_db = measure_switched()
+
+        meter_measurements.append(meter_measurement)
+        for measurements, meanpwr_db in zip(radio_measurements, meanpwrs_db):
+            measurements.append(meanpwr_db)
 
         if i < last_i:
             # Block until time for next measurement
@@ -92,9 +165,26 @@ def run_test(profile):
 
         print("-----\n")
 
+    settle.report()
+    timer.report()
+
     return (meter_measurements, radio_measurements)
 
 
+def reference_measurements(profile, meter_measurements):
+    """Return power meter measurements referred to the USRP's input.
+
+    On a splitter bench the meter reads the splitter's other port, so the
+    stored splitter ratio is added. Otherwise the switch routes the same
+    signal to both, and meter_measurements are returned unchanged.
+    """
+    meter_measurements = np.asarray(meter_measurements)
+    if not splitter_bench(profile):
+        return meter_measurements
+    return meter_measurements + utils.splitter_ratio(profile,
+                                                     profile.siggen_center_freq)
+
+
 def compute_scale_factor(meter_measurements, radio_measurements):
     # Convert power meter measurements from dBm to volts
     meter_measurements_volts = utils.dBm_to_volts(meter_measurements)
@@ -107,28 +197,14 @@ def compute_scale_factor(meter_measurements, radio_measurements):
     return meter_mean_voltage / radio_mean_voltage
 
 
-def main(args):
-    raw_profile = {}
-    execfile(args.filename, {}, raw_profile)
-
-    print("Using following profile:")
-    pprint(raw_profile)
-    print()
-
-    profile = utils.DictDotAccessor(raw_profile)
-
-    meter_measurements, radio_measurements = run_test(profile)
-
-    scale_factor = compute_scale_factor(meter_measurements, radio_measurements)
-    print("\nComputed scale factor: {}\n".format(scale_factor))
-
-    if not args.no_plot:
-        print("Plotting...\n")
-
-        radio_measurements_volts = utils.dBm_to_volts(radio_measurements)
-        scaled_radio_measurements = radio_measurements_volts * scale_factor
-        scaled_radio_measurements_dBm = utils.volts_to_dBm(scaled_radio_measurements)
+def plot_measurements(profile, meter_measurements, radio_measurements,
+                      scale_factor):
+    """Plot one USRP's scaled measurements against the power meter's"""
+    radio_measurements_volts = utils.dBm_to_volts(radio_measurements)
+    scaled_radio_measurements = radio_measurements_volts * scale_factor
+    scaled_radio_measurements_dBm = utils.volts_to_dBm(scaled_radio_measurements)
 
+    with utils.plot_lock:
         title_txt  = "Power Measurements Over Time\n"
         title_txt += "With {} Scale Factor Applied to {} {}\n"
         title_txt += "And Gain Setting of {!r} dB"
@@ -166,20 +242,56 @@ def main(args):
 
         plt.subplots_adjust(top=0.88)
         plt.show()
+        plt.close()
+
+
+def main(args, bench=None):
+    """Run the power calibration, on bench's instruments if given"""
+    raw_profile = {}
+    execfile(args.filename, {}, raw_profile)
+
+    print("Using following profile:")
+    pprint(raw_profile)
+    print()
+
+    profile = utils.DictDotAccessor(raw_profile)
+
+    with test_bench(profile, bench, args.simulate,
+                    instruments(profile)) as (profile, bench):
+        meter_measurements, radio_measurements = run_test(profile, bench)
+
+    duts = utils.dut_profiles(profile)
+    for dut, measurements in zip(duts, radio_measurements):
+        references = reference_measurements(dut, meter_measurements)
+        scale_factor = compute_scale_factor(references, measurements)
+        print("\nComputed scale factor for {} {}: {}\n".format(
+            dut.usrp_device_str, dut.usrp_serial, scale_factor))
+
+        if not args.no_plot:
+            print("Plotting...\n")
+            plot_measurements(dut, references, measurements, scale_factor)
 
     print("Calibration completed successfully, exiting...")
 
 
-if __name__ == '__main__':
+def make_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('filename',
                         help="Filename of test profile",
                         type=utils.filetype)
+    parser.add_argument('--simulate',
+                        help="Run against simulated instruments and USRP " +
+                             "instead of the test bench",
+                        action='store_true')
     parser.add_argument('--no-plot',
                         help="Do not plot power meter readings against " +
                              "scaled USRP readings after test completes",
                         action='store_true')
-    args = parser.parse_args()
+    return parser
+
+
+if __name__ == '__main__':
+    args = make_parser().parse_args()
 
     try:
         main(args)
@@ -1,9 +1,15 @@
 import argparse
 import os
+import threading
 
 import numpy as np
 
 
+# pyplot's current figure is global, so tests running side by side (e.g.,
+# in usrp_daemon.py) hold this while plotting
+plot_lock = threading.Lock()
+
+
 class DictDotAccessor(object):
     """Allow test profile attributes to be accessed via dot operator"""
     def __init__(self, dct):
@@ -51,6 +57,39 @@ class FindNearestDict(dict):
         dict.update(self, newdict)
 
 
+def load_profile(fname):
+    """Return the test profile in fname as a DictDotAccessor"""
+    raw_profile = {}
+    execfile(fname, {}, raw_profile)
+    return DictDotAccessor(raw_profile)
+
+
+def dut_profiles(profile):
+    """Return a profile for each USRP under test.
+
+    profile.duts optionally lists dicts that override profile's keys for
+    each USRP, e.g., usrp_serial and the switchdriver_scpi_select_radio_cmd
+    and switchdriver_scpi_select_meter_cmd of its switch route. Without
+    it, profile describes a single USRP.
+    """
+    duts = getattr(profile, 'duts', None)
+    if not duts:
+        return [profile]
+    return [DictDotAccessor(dict(vars(profile), **dut)) for dut in duts]
+
+
+def splitter_ratio(profile, freq):
+    """Return dB more power at a splitter's USRP port than its meter port.
+
+    profile.splitter_ratio_db is a number or a {freq: dB} dict of stored
+    splitter corrections, looked up nearest to freq. Defaults to 0.
+    """
+    ratio = getattr(profile, 'splitter_ratio_db', 0)
+    if isinstance(ratio, dict):
+        return FindNearestDict(ratio)[freq]
+    return ratio
+
+
 def filetype(fname):
     """Return fname if file exists, else raise ArgumentTypeError"""
     if os.path.isfile(fname):
@@ -78,7 +117,7 @@ def split_octaves(freq_range):
 
 def dBm_to_volts(values):
     """Takes iterable of dBm and returns numpy array of volts"""
-    return np.sqrt(10**(np.array(values) / 10) * 1e-3 * 50)
+    return np.sqrt(10**(np.array(values, dtype=float) / 10) * 1e-3 * 50)
 
 
 def volts_to_dBm(values):
@@ -86,6 +125,13 @@ def volts_to_dBm(values):
     return 10*np.log10(np.array(values)**2 / (50 * 1e-3))
 
 
+def mean_power_dBm(samples):
+    """Takes iterable of complex voltage samples and returns mean power in dBm"""
+    data = np.array(samples)
+    meansquared = np.mean(np.real(data)**2 + np.imag(data)**2)
+    return 30 + 10*np.log10(meansquared / 50)
+
+
 def find_nearest(array, value):
     """Find the index of the closest matching value in a NumPy array."""
     # http://stackoverflow.com/a/2566508